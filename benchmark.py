@@ -0,0 +1,490 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+from PIL import Image
+from file_utils import FileUtils
+from llm_stub_server import JUDGMENT_CATEGORIES, LLMStubServer
+
+
+class SyntheticTree:
+    """
+    ベンチマーク用の写真ツリーを seed から再現可能に生成する
+    撮影日ありとなしのJPEG、正規化後に同じ名前になるファイル、_filemany.simDB、その他のファイルを含む
+    JPEGは小さなテンプレートの撮影日部分だけを書き換え、末尾に乱数を付けて内容を互いに異なるものにする
+    """
+    PLACEHOLDER_DATE = b"2000:01:01 00:00:00"
+    OTHER_EXTENSIONS = (".txt", ".pdf", ".mov", ".png", ".xmp", "")
+
+    def __init__(self, files: int = 10000, depth: int = 3, fanout: int = 8, photo_ratio: float = 0.6,
+                 no_date_ratio: float = 0.1, collision_ratio: float = 0.05, duplicate_ratio: float = 0.02,
+                 filemany_ratio: float = 0.2, seed: int = 0):
+        self.files = files
+        self.depth = depth
+        self.fanout = fanout
+        self.photo_ratio = photo_ratio
+        self.no_date_ratio = no_date_ratio
+        self.collision_ratio = collision_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.filemany_ratio = filemany_ratio
+        self.seed = seed
+
+    def settings(self) -> Dict[str, Any]:
+        """生成条件（結果のJSONに記録する）"""
+        return dict(vars(self))
+
+    def generate(self, root_dir: str) -> Dict[str, int]:
+        """root_dir 以下にツリーを生成し、種類ごとの件数を返す"""
+        rng = random.Random(self.seed)
+        dated_template, undated_template = SyntheticTree._make_templates()
+        directories = self._make_directories(root_dir, rng)
+        counts = {"files": 0, "directories": len(directories), "photos": 0, "photos_without_date": 0,
+                  "name_collisions": 0, "duplicates": 0, "filemany": 0}
+
+        for directory in directories:
+            if rng.random() < self.filemany_ratio:
+                SyntheticTree._write(os.path.join(directory, "_filemany.simDB"),
+                                     SyntheticTree._random_bytes(rng, 64))
+                counts["filemany"] += 1
+                counts["files"] += 1
+
+        last_photo = None
+        for i in range(self.files):
+            directory = directories[i % len(directories)]
+
+            if rng.random() >= self.photo_ratio:
+                ext = rng.choice(SyntheticTree.OTHER_EXTENSIONS)
+                SyntheticTree._write(os.path.join(directory, f"Document {i}{ext}"),
+                                     SyntheticTree._random_bytes(rng, rng.randint(0, 512)))
+                counts["files"] += 1
+                continue
+
+            name = rng.choice(("IMG_{:06d}.JPG", "DSC {:06d}.jpg", "写真 {:06d}.jpeg", "Ｐｈｏｔｏ{:06d}.jpg")).format(i)
+            if last_photo is not None and rng.random() < self.duplicate_ratio:
+                data = last_photo
+                counts["duplicates"] += 1
+            elif rng.random() < self.no_date_ratio:
+                data = undated_template + SyntheticTree._random_bytes(rng, 8)
+                counts["photos_without_date"] += 1
+            else:
+                date = datetime.datetime(2005, 1, 1) + datetime.timedelta(seconds=rng.randrange(20 * 365 * 86400))
+                data = dated_template.replace(SyntheticTree.PLACEHOLDER_DATE,
+                                              date.strftime("%Y:%m:%d %H:%M:%S").encode("ascii"))
+                data += SyntheticTree._random_bytes(rng, 8)
+
+            SyntheticTree._write(os.path.join(directory, name), data)
+            counts["photos"] += 1
+            counts["files"] += 1
+            last_photo = data
+
+            # 正規化すると同じ名前になるファイルを同じディレクトリに置く
+            if rng.random() < self.collision_ratio:
+                base, ext = os.path.splitext(name)
+                SyntheticTree._write(os.path.join(directory, base.lower().replace(" ", "-") + ext.upper()),
+                                     data[:-8] + SyntheticTree._random_bytes(rng, 8))
+                counts["photos"] += 1
+                counts["files"] += 1
+                counts["name_collisions"] += 1
+
+        return counts
+
+    def _make_directories(self, root_dir: str, rng: random.Random) -> List[str]:
+        """depth 段・各段 fanout 個のディレクトリを作成し、全ディレクトリのパスを返す"""
+        directories = [root_dir]
+        level = [root_dir]
+        for _ in range(self.depth):
+            next_level = []
+            for parent in level:
+                for j in range(self.fanout):
+                    name = rng.choice(("Album {}", "ｱﾙﾊﾞﾑ_{}", "Trip-{}", "２０２０ {}")).format(j)
+                    path = os.path.join(parent, name)
+                    os.makedirs(path, exist_ok=True)
+                    next_level.append(path)
+            directories.extend(next_level)
+            level = next_level
+        return directories
+
+    @staticmethod
+    def _make_templates() -> tuple:
+        """撮影日あり・なしのテンプレートJPEGを作成する"""
+        image = Image.new("RGB", (64, 48), (90, 120, 150))
+        exif = Image.Exif()
+        exif[0x010F] = "BenchCam"
+        exif[0x0110] = "Model 1"
+        exif[0x8769] = {0x9003: SyntheticTree.PLACEHOLDER_DATE.decode("ascii")}
+
+        dated = io.BytesIO()
+        image.save(dated, format="JPEG", quality=70, exif=exif.tobytes())
+        undated = io.BytesIO()
+        image.save(undated, format="JPEG", quality=70)
+        return dated.getvalue(), undated.getvalue()
+
+    @staticmethod
+    def _random_bytes(rng: random.Random, size: int) -> bytes:
+        return rng.getrandbits(size * 8).to_bytes(size, "little") if size else b""
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+class SlowFilesystem:
+    """
+    NFS/SMB の往復遅延を模擬するシム。root 以下のパスに対する os.stat と os.scandir、
+    列挙したエントリの stat() のたびに latency 秒待つ（time.sleep は GIL を解放するため、並列走査の効果を確認できる）
+    """
+
+    def __init__(self, root: str, latency: float):
+        self.root = os.path.abspath(root)
+        self.latency = latency
+        self._stat = os.stat
+        self._scandir = os.scandir
+
+    def __enter__(self) -> "SlowFilesystem":
+        os.stat = self._slow_stat
+        os.scandir = self._slow_scandir
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        os.stat = self._stat
+        os.scandir = self._scandir
+
+    def _is_target(self, path: Any) -> bool:
+        if isinstance(path, int):
+            return False
+        path = os.path.abspath(os.fsdecode(path))
+        return path == self.root or path.startswith(self.root + os.sep)
+
+    def _slow_stat(self, path, *args, **kwargs):
+        if self._is_target(path):
+            time.sleep(self.latency)
+        return self._stat(path, *args, **kwargs)
+
+    def _slow_scandir(self, path="."):
+        if not self._is_target(path):
+            return self._scandir(path)
+        time.sleep(self.latency)
+        return _SlowScandirIterator(self._scandir(path), self.latency)
+
+
+class _SlowScandirIterator:
+    """os.scandir の結果を包み、各エントリの stat() に遅延を加える"""
+
+    def __init__(self, iterator, latency: float):
+        self._iterator = iterator
+        self._latency = latency
+
+    def __enter__(self) -> "_SlowScandirIterator":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._iterator.close()
+
+    def __iter__(self):
+        for entry in self._iterator:
+            yield _SlowDirEntry(entry, self._latency)
+
+    def close(self) -> None:
+        self._iterator.close()
+
+
+class _SlowDirEntry:
+    def __init__(self, entry: os.DirEntry, latency: float):
+        self._entry = entry
+        self._latency = latency
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._entry, name)
+
+    def __fspath__(self) -> str:
+        return self._entry.path
+
+    def stat(self, **kwargs) -> os.stat_result:
+        time.sleep(self._latency)
+        return self._entry.stat(**kwargs)
+
+
+class Benchmark:
+    """
+    各操作を個別の子プロセスで実行し、経過時間・ファイル/秒・ピークRSS・read/write システムコール数を計測する
+    ツリーを変更する操作の前にはツリーを生成し直し、キャッシュは操作ごとに空の状態から始める
+    """
+    # (操作名, ツリーを変更するか)
+    CASES = (
+        ("report-extensions", False),
+        ("report-exif", False),
+        ("report-exif-errors", False),
+        ("find-duplicates", False),
+        ("find-similar", False),
+        ("analyze", False),
+        ("remove-filemany", True),
+        ("sanitize-files", True),
+        ("sanitize-dirs", True),
+        ("rename-photos", True),
+        ("organize-photos", True),
+    )
+
+    @staticmethod
+    def run(work_dir: str, tree: SyntheticTree, operations: Optional[List[str]] = None, workers: int = 1,
+            warm: bool = False, llm_photos: int = 50, llm_delay: float = 0.01, fs_latency: float = 0.0,
+            scan_threads: int = 1, scan_ordered: bool = True) -> Dict[str, Any]:
+        """
+        ベンチマークを実行し、結果の辞書を返す
+        fs_latency を指定すると、ツリーへの stat と列挙のたびにその秒数の遅延を加えて計測する
+        """
+        operations = operations or [name for name, _ in Benchmark.CASES]
+        tree_dir = os.path.join(work_dir, "tree")
+        output_dir = os.path.join(work_dir, "output")
+        os.makedirs(output_dir, exist_ok=True)
+
+        counts = None
+        dirty = True
+        results = []
+
+        with LLMStubServer(delay=llm_delay, responses=JUDGMENT_CATEGORIES) as server:
+            options = {"workers": workers, "output_dir": output_dir, "llm_photos": llm_photos,
+                       "base_url": server.base_url, "fs_latency": fs_latency, "scan_threads": scan_threads,
+                       "scan_ordered": scan_ordered}
+
+            for name, mutates in Benchmark.CASES:
+                if name not in operations:
+                    continue
+
+                if dirty:
+                    shutil.rmtree(tree_dir, ignore_errors=True)
+                    os.makedirs(tree_dir)
+                    started = time.perf_counter()
+                    counts = tree.generate(tree_dir)
+                    print(f"ツリーを生成しました: {counts['files']}ファイル ({time.perf_counter() - started:.1f}秒)")
+                    dirty = False
+
+                cache_dir = os.path.join(work_dir, "cache", name)
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                runs = ["cold", "warm"] if warm and not mutates else ["cold"]
+                for run in runs:
+                    result = Benchmark._run_isolated(name, tree_dir, cache_dir, options)
+                    result.update({"operation": name, "run": run,
+                                   "files_per_sec": round(counts["files"] / result["seconds"], 1)
+                                   if result["seconds"] else None})
+                    results.append(result)
+                    Benchmark._print_result(result)
+
+                dirty = mutates
+
+        return {
+            "generated_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "revision": Benchmark._get_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workers": workers,
+            "fs_latency": fs_latency,
+            "scan_threads": scan_threads,
+            "scan_ordered": scan_ordered,
+            "tree": dict(tree.settings(), **(counts or {})),
+            "results": results,
+        }
+
+    @staticmethod
+    def _run_isolated(name: str, tree_dir: str, cache_dir: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """操作を新しい子プロセスで実行する（ピークRSSとシステムコール数を操作ごとに分けるため）"""
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            return executor.submit(Benchmark.run_case, name, tree_dir, cache_dir, options).result()
+
+    @staticmethod
+    def run_case(name: str, tree_dir: str, cache_dir: str, options: Dict[str, Any]) -> Dict[str, Any]:
+        """子プロセスで1つの操作を実行して計測結果を返す"""
+        from file_scanner import FileScanner
+
+        os.environ[FileUtils.CACHE_DIR_ENV] = cache_dir
+        os.chdir(options["output_dir"])
+        FileScanner.configure(options["scan_threads"], options["scan_ordered"])
+        slow_filesystem = (SlowFilesystem(tree_dir, options["fs_latency"]) if options["fs_latency"]
+                           else contextlib.nullcontext())
+
+        # 計測対象の操作が出力する進捗表示は捨てる
+        error = None
+        io_before = Benchmark._read_proc_io()
+        started = time.perf_counter()
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull), slow_filesystem:
+            try:
+                value = Benchmark._call(name, tree_dir, options)
+            except Exception as e:
+                value = None
+                error = f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - started
+        io_after = Benchmark._read_proc_io()
+
+        self_usage = resource.getrusage(resource.RUSAGE_SELF)
+        children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+        result = {
+            "seconds": round(seconds, 4),
+            "peak_rss_mb": round(max(self_usage.ru_maxrss, children_usage.ru_maxrss) / 1024, 1),
+            "user_cpu_sec": round(self_usage.ru_utime + children_usage.ru_utime, 3),
+            "system_cpu_sec": round(self_usage.ru_stime + children_usage.ru_stime, 3),
+            "result": Benchmark._to_json_value(value),
+            "error": error,
+        }
+        for key in ("syscr", "syscw", "read_bytes", "write_bytes"):
+            if key in io_before and key in io_after:
+                result[key] = io_after[key] - io_before[key]
+        return result
+
+    @staticmethod
+    def _call(name: str, tree_dir: str, options: Dict[str, Any]) -> Any:
+        """操作名に対応するエントリポイントを呼び出す"""
+        from duplicate_finder import DuplicateFinder
+        from file_operations import FileOperations
+        from file_reporter import FileReporter
+        from photo_operations import PhotoOperations
+
+        output_dir = options["output_dir"]
+        workers = options["workers"]
+        if name == "report-extensions":
+            return FileReporter.report_file_extensions(tree_dir, output_json=os.path.join(output_dir, "ext.json"))
+        if name == "report-exif":
+            return PhotoOperations.report_exif(tree_dir, os.path.join(output_dir, "exif_report.txt"), workers)
+        if name == "report-exif-errors":
+            return PhotoOperations.report_exif_errors(tree_dir, os.path.join(output_dir, "exif_errors.txt"), workers)
+        if name == "find-duplicates":
+            return DuplicateFinder.report_duplicates(tree_dir, os.path.join(output_dir, "duplicates.txt"))
+        if name == "find-similar":
+            return PhotoOperations.report_similar_photos(tree_dir, os.path.join(output_dir, "similar_photos.txt"),
+                                                         workers=workers)
+        if name == "analyze":
+            return PhotoOperations.analyze_photo_path_exif_correlation(
+                tree_dir, max_photos=options["llm_photos"], base_url=options["base_url"])
+        if name == "remove-filemany":
+            return FileOperations.remove_filemany_files(tree_dir)
+        if name == "sanitize-files":
+            return FileOperations.sanitize_filenames(tree_dir)
+        if name == "sanitize-dirs":
+            return FileOperations.sanitize_directories(tree_dir)
+        if name == "rename-photos":
+            return PhotoOperations.rename_photos_with_date(tree_dir, workers)
+        if name == "organize-photos":
+            return PhotoOperations.organize_photos_by_date(tree_dir, os.path.join(output_dir, "images"), workers)
+        raise ValueError(f"未対応の操作です: {name}")
+
+    @staticmethod
+    def _read_proc_io() -> Dict[str, int]:
+        """/proc/self/io の値を返す（Linux 以外では空）"""
+        try:
+            with open("/proc/self/io", encoding="ascii") as f:
+                return {key: int(value) for key, value in (line.split(":") for line in f)}
+        except OSError:
+            return {}
+
+    @staticmethod
+    def _to_json_value(value: Any) -> Any:
+        """JSONに保存できない戻り値は文字列にする"""
+        try:
+            json.dumps(value)
+            return value
+        except TypeError:
+            return str(value)
+
+    @staticmethod
+    def _get_revision() -> Optional[str]:
+        """計測したソースの git リビジョン"""
+        try:
+            return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    @staticmethod
+    def _print_result(result: Dict[str, Any]) -> None:
+        line = (f"{result['operation']:<20} {result['run']:<5} {result['seconds']:>9.3f}秒 "
+                f"{result['files_per_sec'] or 0:>12.1f} files/s  RSS {result['peak_rss_mb']:>7.1f} MB  "
+                f"read {result.get('syscr', '-')} / write {result.get('syscw', '-')} syscalls")
+        if result["error"]:
+            line += f"  エラー: {result['error']}"
+        print(line)
+
+    @staticmethod
+    def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> None:
+        """前回の結果と比べて、操作ごとのファイル/秒の変化を表示する"""
+        previous_results = {(r["operation"], r["run"]): r for r in previous.get("results", [])}
+        print(f"比較: {previous.get('revision')} -> {current.get('revision')}")
+        for result in current["results"]:
+            before = previous_results.get((result["operation"], result["run"]))
+            if not before or not before.get("files_per_sec") or not result["files_per_sec"]:
+                continue
+            ratio = result["files_per_sec"] / before["files_per_sec"]
+            mark = "  ← 低下" if ratio < 0.9 else ""
+            print(f"{result['operation']:<20} {result['run']:<5} {before['files_per_sec']:>12.1f} -> "
+                  f"{result['files_per_sec']:>12.1f} files/s ({ratio:.2f}倍){mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成した写真ツリーで各操作の処理速度を計測します")
+    parser.add_argument("--work-dir", default="benchmark_work",
+                        help="ツリーとキャッシュを作成する作業ディレクトリ（この中に実行ごとのディレクトリを作る）")
+    parser.add_argument("--files", type=int, default=10000, help="生成するファイル数")
+    parser.add_argument("--depth", type=int, default=3, help="ディレクトリの深さ")
+    parser.add_argument("--fanout", type=int, default=8, help="各ディレクトリのサブディレクトリ数")
+    parser.add_argument("--photo-ratio", type=float, default=0.6, help="写真の割合")
+    parser.add_argument("--no-date-ratio", type=float, default=0.1, help="撮影日のない写真の割合")
+    parser.add_argument("--collision-ratio", type=float, default=0.05, help="正規化後の名前が衝突する写真の割合")
+    parser.add_argument("--seed", type=int, default=0, help="乱数の種")
+    parser.add_argument("--operations", nargs="+", choices=[name for name, _ in Benchmark.CASES],
+                        help="計測する操作（デフォルト: すべて）")
+    parser.add_argument("--workers", type=int, default=1, help="EXIF解析などの並列ワーカー数")
+    parser.add_argument("--warm", action="store_true", help="ツリーを変更しない操作はキャッシュが温まった状態でも計測")
+    parser.add_argument("--llm-photos", type=int, default=50, help="関連性分析で判定する写真の枚数")
+    parser.add_argument("--llm-delay", type=float, default=0.01, help="スタブサーバーの応答遅延（秒）")
+    parser.add_argument("--fs-latency", type=float, default=0.0,
+                        help="ツリーへの stat と列挙のたびに加える遅延（ミリ秒、ネットワークファイルシステムの模擬）")
+    parser.add_argument("--scan-threads", type=int, default=1, help="同時に列挙するディレクトリ数")
+    parser.add_argument("--scan-unordered", action="store_true", help="走査順を保たずに列挙が終わった順に処理する")
+    parser.add_argument("--output", default="benchmark.json", help="結果のJSONの出力先")
+    parser.add_argument("--compare", help="比較する前回の結果のJSON")
+    parser.add_argument("--keep", action="store_true", help="終了後も実行ごとの作業ディレクトリを残す")
+    args = parser.parse_args()
+
+    tree = SyntheticTree(args.files, args.depth, args.fanout, args.photo_ratio, args.no_date_ratio,
+                         args.collision_ratio, seed=args.seed)
+    # 既存のファイルを消さないよう、--work-dir の中に今回の実行専用のディレクトリを作り、それだけを削除する
+    parent_dir = os.path.abspath(args.work_dir)
+    created_parent = not os.path.isdir(parent_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="run_", dir=parent_dir)
+    try:
+        results = Benchmark.run(work_dir, tree, args.operations, args.workers, args.warm, args.llm_photos,
+                                args.llm_delay, args.fs_latency / 1000, args.scan_threads, not args.scan_unordered)
+    finally:
+        if args.keep:
+            print(f"作業ディレクトリを残しました: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            if created_parent:
+                with contextlib.suppress(OSError):
+                    os.rmdir(parent_dir)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"結果が {args.output} に保存されました")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            Benchmark.compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,141 @@
+import datetime
+import os
+import re
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence
+
+
+class ResolvedDate(NamedTuple):
+    """撮影日時（EXIFと同じ "YYYY:MM:DD HH:MM:SS" 形式）と、その取得元"""
+    value: str
+    source: str
+
+
+class DateResolver:
+    """
+    写真の撮影日時を、読み込みの少ない取得元から順に試して決める
+      prefix:   rename_photos_with_date が付けた "pYYYY-MM-DD_HH-MM-SS_" 接頭辞（ファイルを読まない）
+      filename: カメラ・スマートフォンのファイル名の日時 (IMG_20190315_123456 など、ファイルを読まない)
+      index:    メタデータインデックスの記録（ファイルを読まない）
+      exif:     ヘッダーのEXIF（EXIFキャッシュにあれば読まない）
+      mtime:    ファイルの更新日時（既定では使わない）
+    iter_exif の lookup に lookup() を渡すと、ファイルを読まずに日時が分かる写真はEXIF解析を省略する
+    """
+    SOURCES = ("prefix", "filename", "index", "exif", "mtime")
+    DEFAULT_SOURCES = ("prefix", "filename", "index", "exif")
+
+    PREFIX_PATTERN = re.compile(r'^p(\d{4})-(\d{2})-(\d{2})_(\d{2})-(\d{2})-(\d{2})_')
+
+    # (年, 月, 日[, 時, 分, 秒]) をグループに持つファイル名のパターン
+    FILENAME_PATTERNS = (
+        # IMG_20190315_123456.jpg / PXL_20190315_123456789.jpg / 20190315_123456.jpg / Screenshot_20190315-123456.png
+        re.compile(r'(?:^|[^0-9])((?:19|20)\d{2})(\d{2})(\d{2})[_-](\d{2})(\d{2})(\d{2})'),
+        # 2019-03-15 12.34.56.jpg (Dropbox) / 2019-03-15_12-34-56.jpg
+        re.compile(r'(?:^|[^0-9])((?:19|20)\d{2})-(\d{2})-(\d{2})[ _T](\d{2})[.:-](\d{2})[.:-](\d{2})'),
+        # IMG-20190315-WA0001.jpg (WhatsApp、時刻はない)
+        re.compile(r'^(?:IMG|VID)-((?:19|20)\d{2})(\d{2})(\d{2})-WA\d+'),
+    )
+
+    def __init__(self, sources: Sequence[str] = DEFAULT_SOURCES,
+                 index_lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None):
+        unknown = [source for source in sources if source not in DateResolver.SOURCES]
+        if unknown:
+            raise ValueError(f"未対応の撮影日の取得元です: {', '.join(unknown)}")
+        self.sources = tuple(sources)
+        self.index_lookup = index_lookup
+        self.counts: Dict[str, int] = {}
+
+        # lookup() で試した写真の取得元（決まらなかった場合は空文字）
+        self._sources: Dict[str, str] = {}
+
+    def lookup(self, file_path: str) -> Optional[Dict[str, Any]]:
+        """
+        EXIFを解析せずに撮影日時が分かる場合は、EXIF情報の代わりになる辞書を返す（iter_exif の lookup 用）
+        exif より前の取得元だけを試し、取得元に exif がない場合は解析させないために空の辞書を返す
+        """
+        for source in self.sources:
+            if source == "exif":
+                break
+            if source == "index":
+                exif_data = self.index_lookup(file_path) if self.index_lookup is not None else None
+                if exif_data is not None:
+                    # 撮影日がないことが記録されている写真も、解析し直しても同じ結果になる
+                    self._sources[file_path] = source if "DateTimeOriginal" in exif_data else ""
+                    return exif_data
+            elif source != "mtime":
+                value = DateResolver.from_prefix(file_path) if source == "prefix" else \
+                    DateResolver.from_filename(file_path)
+                if value is not None:
+                    self._sources[file_path] = source
+                    return {"DateTimeOriginal": value}
+
+        self._sources[file_path] = ""
+        return None if "exif" in self.sources else {}
+
+    def resolve(self, file_path: str, exif_data: Dict[str, Any]) -> Optional[ResolvedDate]:
+        """
+        lookup() またはEXIF解析の結果から撮影日時と取得元を決める（決まらなければ None）
+        lookup() を通していない写真（パイプラインなど）は、ここで exif より前の取得元を試す
+        """
+        source = self._sources.pop(file_path, None)
+        if source is None:
+            known = self.lookup(file_path)
+            source = self._sources.pop(file_path)
+            if source:
+                exif_data = known
+
+        if not source:
+            if "exif" in self.sources and "DateTimeOriginal" in exif_data:
+                source = "exif"
+            elif "mtime" in self.sources:
+                exif_data = {"DateTimeOriginal": DateResolver.from_mtime(file_path)}
+                source = "mtime"
+
+        value = exif_data.get("DateTimeOriginal") if source else None
+        if value is None:
+            return None
+        self.counts[source] = self.counts.get(source, 0) + 1
+        return ResolvedDate(value, source)
+
+    def discard(self, file_path: str) -> None:
+        """resolve() を呼ばずに処理を終えた写真の記録を消す"""
+        self._sources.pop(file_path, None)
+
+    def summary(self) -> str:
+        """取得元ごとの件数を表示用の文字列で返す"""
+        return ", ".join(f"{source} {self.counts[source]}件" for source in self.sources if source in self.counts)
+
+    @staticmethod
+    def from_prefix(file_path: str) -> Optional[str]:
+        """"pYYYY-MM-DD_HH-MM-SS_" 接頭辞から撮影日時を返す"""
+        match = DateResolver.PREFIX_PATTERN.match(os.path.basename(file_path))
+        return DateResolver._format(match.groups()) if match else None
+
+    @staticmethod
+    def from_filename(file_path: str) -> Optional[str]:
+        """カメラ・スマートフォンが付けるファイル名から撮影日時を返す（日付として正しくないものは使わない）"""
+        filename = os.path.basename(file_path)
+        for pattern in DateResolver.FILENAME_PATTERNS:
+            match = pattern.search(filename)
+            if match:
+                value = DateResolver._format(match.groups())
+                if value is not None:
+                    return value
+        return None
+
+    @staticmethod
+    def from_mtime(file_path: str) -> Optional[str]:
+        """ファイルの更新日時を返す"""
+        try:
+            mtime = os.stat(file_path).st_mtime
+        except OSError:
+            return None
+        return datetime.datetime.fromtimestamp(mtime).strftime('%Y:%m:%d %H:%M:%S')
+
+    @staticmethod
+    def _format(groups: Sequence[str]) -> Optional[str]:
+        """(年, 月, 日[, 時, 分, 秒]) を "YYYY:MM:DD HH:MM:SS" にする（存在しない日時なら None）"""
+        parts = [int(part) for part in groups] + [0] * (6 - len(groups))
+        try:
+            return datetime.datetime(*parts).strftime('%Y:%m:%d %H:%M:%S')
+        except ValueError:
+            return None
@@ -0,0 +1,276 @@
+import atexit
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from exif_cache import ExifCache, FileIdentity
+from file_scanner import FileScanner
+from file_utils import FileUtils
+from metrics import Metrics
+
+
+class HashStore:
+    """ファイルの同一性 (デバイス, inode, サイズ, mtime_ns) をキーに部分ハッシュと完全ハッシュを保存する"""
+    DB_NAME = "file_hashes.sqlite"
+    COMMIT_INTERVAL = 500
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(FileUtils.get_cache_dir(), HashStore.DB_NAME)
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, path TEXT, partial TEXT, full TEXT, "
+            "PRIMARY KEY (dev, inode, size, mtime_ns))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS hashes_path ON hashes(path)")
+        self._db.commit()
+
+    @staticmethod
+    def get_default() -> "HashStore":
+        """プロセス共通のストアを返す（終了時に自動で保存される）"""
+        with HashStore._default_lock:
+            if HashStore._default is None:
+                HashStore._default = HashStore()
+                atexit.register(HashStore._default.close)
+            return HashStore._default
+
+    def get(self, identity: FileIdentity, kind: str) -> Optional[str]:
+        """保存済みのハッシュを返す（kind は "partial" または "full"）"""
+        with self._lock:
+            row = self._db.execute(
+                f"SELECT {HashStore._column(kind)} FROM hashes "
+                "WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?", identity).fetchone()
+        return row[0] if row else None
+
+    def put(self, identity: FileIdentity, path: str, kind: str, value: str) -> None:
+        """ハッシュを保存する。同じパスに残っている古い同一性のエントリは削除する"""
+        column = HashStore._column(kind)
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM hashes WHERE path = ? AND NOT (dev = ? AND inode = ? AND size = ? AND mtime_ns = ?)",
+                (path,) + identity)
+            self._db.execute(
+                "INSERT OR IGNORE INTO hashes (dev, inode, size, mtime_ns, path) VALUES (?, ?, ?, ?, ?)",
+                identity + (path,))
+            self._db.execute(
+                f"UPDATE hashes SET {column} = ?, path = ? "
+                "WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?", (value, path) + identity)
+            self._pending_writes += 1
+            if self._pending_writes >= HashStore.COMMIT_INTERVAL:
+                self._db.commit()
+                self._pending_writes = 0
+
+    def close(self) -> None:
+        """保存してデータベースを閉じる"""
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    @staticmethod
+    def _column(kind: str) -> str:
+        if kind not in ("partial", "full"):
+            raise ValueError(f"未対応のハッシュ種別です: {kind}")
+        return kind
+
+
+class DuplicateFinder:
+    """
+    内容が完全に一致するファイルを段階的に検出する
+    1. サイズでグループ化  2. 先頭と末尾のブロックの部分ハッシュで絞り込み  3. 完全ハッシュを並列に計算して確定
+    計算したハッシュは HashStore に保存し、変更のないファイルは再計算しない
+    """
+    PARTIAL_BLOCK_SIZE = 64 * 1024
+    DEFAULT_WORKERS = 4
+
+    @staticmethod
+    def partial_hash(path: str, identity: Optional[FileIdentity] = None) -> str:
+        """
+        先頭と末尾のブロックから部分ハッシュを計算する
+        2ブロック以下のファイルは全体を読むため、部分ハッシュの一致がそのまま内容の一致を意味する
+        """
+        identity = identity or ExifCache.file_identity(path)
+        store = HashStore.get_default()
+        cached = store.get(identity, "partial")
+        if cached is not None:
+            return cached
+
+        size = identity[2]
+        block = DuplicateFinder.PARTIAL_BLOCK_SIZE
+        digest = hashlib.sha256(str(size).encode("ascii"))
+        with Metrics.phase("hash.partial"), open(path, "rb") as f:
+            if size <= block * 2:
+                digest.update(f.read())
+            else:
+                digest.update(f.read(block))
+                f.seek(-block, os.SEEK_END)
+                digest.update(f.read(block))
+
+        value = digest.hexdigest()
+        store.put(identity, path, "partial", value)
+        return value
+
+    @staticmethod
+    def full_hash(path: str, identity: Optional[FileIdentity] = None) -> str:
+        """ファイル全体のSHA-256を計算する（保存済みならそれを返す）"""
+        identity = identity or ExifCache.file_identity(path)
+        store = HashStore.get_default()
+        cached = store.get(identity, "full")
+        if cached is not None:
+            return cached
+
+        with Metrics.phase("hash.full"):
+            value = FileUtils.hash_file(path)
+        store.put(identity, path, "full", value)
+        return value
+
+    @staticmethod
+    def group_duplicates(files: Iterable[Tuple[str, FileIdentity]],
+                         workers: int = DEFAULT_WORKERS) -> List[List[str]]:
+        """(パス, 同一性) の一覧から、内容が一致するファイルのグループを返す"""
+        by_size = defaultdict(list)
+        for path, identity in files:
+            by_size[identity[2]].append((path, identity))
+
+        candidates = [group for group in by_size.values() if len(group) > 1]
+        duplicate_groups = []
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for group in candidates:
+                # 部分ハッシュで絞り込む
+                by_partial = defaultdict(list)
+                partials = executor.map(lambda item: DuplicateFinder._safe_hash(DuplicateFinder.partial_hash, item),
+                                        group)
+                for item, partial in zip(group, partials):
+                    if partial is not None:
+                        by_partial[partial].append(item)
+
+                for partial_group in by_partial.values():
+                    if len(partial_group) < 2:
+                        continue
+                    if partial_group[0][1][2] <= DuplicateFinder.PARTIAL_BLOCK_SIZE * 2:
+                        duplicate_groups.append([path for path, _ in partial_group])
+                        continue
+
+                    # 完全ハッシュを並列に計算して確定する
+                    by_full = defaultdict(list)
+                    fulls = executor.map(lambda item: DuplicateFinder._safe_hash(DuplicateFinder.full_hash, item),
+                                         partial_group)
+                    for (path, _), full in zip(partial_group, fulls):
+                        if full is not None:
+                            by_full[full].append(path)
+                    duplicate_groups.extend(paths for paths in by_full.values() if len(paths) > 1)
+
+        return duplicate_groups
+
+    @staticmethod
+    def find_duplicate(path: str, candidates: List[str], workers: int = DEFAULT_WORKERS) -> Optional[str]:
+        """candidates の中から path と内容が一致するファイルを1つ返す"""
+        try:
+            identity = ExifCache.file_identity(path)
+        except OSError:
+            return None
+
+        items = [(path, identity)]
+        for candidate in candidates:
+            try:
+                candidate_identity = ExifCache.file_identity(candidate)
+            except OSError:
+                continue
+            if candidate_identity[2] == identity[2]:
+                items.append((candidate, candidate_identity))
+
+        if len(items) < 2:
+            return None
+
+        for group in DuplicateFinder.group_duplicates(items, workers):
+            if path in group:
+                return next(other for other in group if other != path)
+        return None
+
+    @staticmethod
+    def report_duplicates(root_dir: Optional[str] = None, output_file: str = "duplicates.txt",
+                          workers: int = DEFAULT_WORKERS) -> int:
+        """ツリー内の重複ファイルのグループを出力する関数"""
+        root_dir = root_dir or os.getcwd()
+        files = ((entry.path, (entry.dev, entry.inode, entry.size, entry.mtime_ns))
+                 for entry in FileScanner.iter_files(root_dir) if entry.size > 0)
+        groups = DuplicateFinder.group_duplicates(files, workers)
+
+        redundant_bytes = 0
+        with open(output_file, "w", encoding="utf-8") as f:
+            for group in groups:
+                group.sort()
+                redundant_bytes += os.path.getsize(group[0]) * (len(group) - 1)
+                for path in group:
+                    f.write(f"{path}\n")
+                f.write("\n")
+
+        print(f"重複グループ: {len(groups)}件 (重複ファイル {sum(len(group) - 1 for group in groups)}件, "
+              f"{redundant_bytes / (1024 * 1024):.1f} MB)")
+        print(f"レポートが {output_file} に保存されました")
+        return len(groups)
+
+    @staticmethod
+    def _safe_hash(hash_function, item: Tuple[str, FileIdentity]) -> Optional[str]:
+        """読み込めないファイルは重複候補から外す"""
+        path, identity = item
+        try:
+            return hash_function(path, identity)
+        except OSError as e:
+            print(f"ハッシュ計算エラー: {path} - {e}")
+            return None
+
+
+class DuplicateIndex:
+    """
+    organize_photos_by_date の移動先ディレクトリにある既存ファイルをサイズ別に保持し、
+    移動しようとしている写真と同じ内容のファイルがあるかを調べる
+    mode: "skip"（移動しない） / "hardlink"（移動元を既存ファイルへのハードリンクに置き換える） / "report"（報告のみ）
+    """
+    MODES = ("skip", "hardlink", "report")
+
+    def __init__(self, mode: str, workers: int = DuplicateFinder.DEFAULT_WORKERS):
+        if mode not in DuplicateIndex.MODES:
+            raise ValueError(f"未対応の重複処理モードです: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self.duplicate_count = 0
+        self._dirs = {}  # ディレクトリ -> {サイズ: [パス]}
+
+    def find(self, path: str, target_dir: str) -> Optional[str]:
+        """target_dir 内で path と同じ内容のファイルを返す"""
+        by_size = self._get_dir(target_dir)
+        candidates = by_size.get(os.path.getsize(path), [])
+        if not candidates:
+            return None
+        return DuplicateFinder.find_duplicate(path, candidates, self.workers)
+
+    def add(self, path: str, size: int) -> None:
+        """移動した写真を移動先ディレクトリの一覧に追加する（転送中でまだ存在しない場合もある）"""
+        target_dir = os.path.dirname(path)
+        if target_dir in self._dirs:
+            self._dirs[target_dir].setdefault(size, []).append(path)
+
+    def _get_dir(self, target_dir: str) -> Dict[int, List[str]]:
+        """ディレクトリの一覧を初回だけ読み込み、以降は使い回す"""
+        by_size = self._dirs.get(target_dir)
+        if by_size is None:
+            by_size = {}
+            try:
+                with os.scandir(target_dir) as it:
+                    for entry in it:
+                        if entry.is_file(follow_symlinks=False):
+                            by_size.setdefault(entry.stat(follow_symlinks=False).st_size, []).append(entry.path)
+            except FileNotFoundError:
+                pass
+            self._dirs[target_dir] = by_size
+        return by_size
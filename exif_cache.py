@@ -0,0 +1,149 @@
+import atexit
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Sequence, Tuple
+from file_utils import FileUtils
+from metrics import Metrics
+
+# (st_dev, st_ino, st_size, st_mtime_ns)
+FileIdentity = Tuple[int, int, int, int]
+
+
+class ExifCache:
+    """
+    ファイルの同一性 (デバイス, inode, サイズ, mtime_ns) をキーに
+    抽出済みEXIF情報を保存するSQLiteキャッシュ
+    値は pickle で保存し、ヒットした場合も解析した場合と同じ型（GPSInfo のタグIDの int やタプルなど）で返す
+    """
+    DEFAULT_MAX_ENTRIES = 2_000_000
+    COMMIT_INTERVAL = 1000
+    DB_NAME = "exif_cache.sqlite"
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, db_path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.db_path = db_path or os.path.join(FileUtils.get_cache_dir(), ExifCache.DB_NAME)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        self._touched = set()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS exif_cache ("
+            "dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, tags TEXT, "
+            "path TEXT, data BLOB, last_used REAL, "
+            "PRIMARY KEY (dev, inode, size, mtime_ns, tags))")
+        self._db.execute("CREATE INDEX IF NOT EXISTS exif_cache_path ON exif_cache(path)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS exif_cache_last_used ON exif_cache(last_used)")
+        self._db.commit()
+        self._entry_count = self._db.execute("SELECT COUNT(*) FROM exif_cache").fetchone()[0]
+
+    @staticmethod
+    def get_default() -> "ExifCache":
+        """プロセス共通のキャッシュを返す（終了時に自動で保存される）"""
+        with ExifCache._default_lock:
+            if ExifCache._default is None:
+                ExifCache._default = ExifCache()
+                atexit.register(ExifCache._default.close)
+            return ExifCache._default
+
+    @staticmethod
+    def file_identity(file_path: str) -> FileIdentity:
+        """ファイルの同一性を表すキーを返す"""
+        st = os.stat(file_path)
+        return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+
+    def get(self, file_path: str, identity: FileIdentity, tags: Sequence[str]) -> Optional[Dict[str, Any]]:
+        """キャッシュ済みのEXIF情報を返す。なければ None（同じパスの古いエントリは削除する）"""
+        tags_key = ",".join(tags)
+        with self._lock, Metrics.phase("exif_cache.get"):
+            row = self._db.execute(
+                "SELECT rowid, data FROM exif_cache WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ? AND tags = ?",
+                identity + (tags_key,)).fetchone()
+            # 以前の形式（JSON文字列）のエントリは型が変わっているため使わずに読み直す
+            if row is not None and isinstance(row[1], bytes):
+                self.hits += 1
+                self._touched.add(row[0])
+                return pickle.loads(row[1])
+
+            self.misses += 1
+            # ファイルが更新・置換された場合、同じパスに残っている古いエントリを無効化する
+            deleted = self._db.execute(
+                "DELETE FROM exif_cache WHERE path = ? AND tags = ?", (file_path, tags_key)).rowcount
+            if deleted:
+                self.invalidated += deleted
+                self._entry_count -= deleted
+                self._after_write()
+            return None
+
+    def put(self, file_path: str, identity: FileIdentity, tags: Sequence[str], exif_data: Dict[str, Any]) -> None:
+        """EXIF情報をキャッシュに保存する（pickle できない値を含む場合は保存しない）"""
+        try:
+            data = pickle.dumps(exif_data, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        with self._lock:
+            cursor = self._db.execute(
+                "INSERT OR REPLACE INTO exif_cache (dev, inode, size, mtime_ns, tags, path, data, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                identity + (",".join(tags), file_path, data, time.time()))
+            if cursor.rowcount:
+                self._entry_count += 1
+            self._after_write()
+
+    def stats(self) -> Dict[str, int]:
+        """ヒット/ミスなどのカウンタを返す"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidated": self.invalidated,
+            "evicted": self.evicted,
+            "entries": self._entry_count,
+        }
+
+    def flush(self) -> None:
+        """最終使用時刻の更新とサイズ上限を超えた分の削除（LRU）を行い、コミットする"""
+        with self._lock:
+            if self._touched:
+                now = time.time()
+                self._db.executemany("UPDATE exif_cache SET last_used = ? WHERE rowid = ?",
+                                     [(now, rowid) for rowid in self._touched])
+                self._touched.clear()
+
+            if self._entry_count > self.max_entries:
+                # INSERT OR REPLACE による重複カウントを補正してから削除件数を決める
+                self._entry_count = self._db.execute("SELECT COUNT(*) FROM exif_cache").fetchone()[0]
+            overflow = self._entry_count - self.max_entries
+            if overflow > 0:
+                deleted = self._db.execute(
+                    "DELETE FROM exif_cache WHERE rowid IN "
+                    "(SELECT rowid FROM exif_cache ORDER BY last_used LIMIT ?)", (overflow,)).rowcount
+                self.evicted += deleted
+                self._entry_count -= deleted
+
+            self._db.commit()
+            self._pending_writes = 0
+
+    def close(self) -> None:
+        """保存してデータベースを閉じる"""
+        if self._db is None:
+            return
+        self.flush()
+        self._db.close()
+        self._db = None
+
+    def _after_write(self) -> None:
+        """一定件数の書き込みごとにコミットする（ロック取得済みで呼ぶ）"""
+        self._pending_writes += 1
+        if self._pending_writes >= ExifCache.COMMIT_INTERVAL:
+            self._db.commit()
+            self._pending_writes = 0
@@ -0,0 +1,450 @@
+import os
+import struct
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class ExifFormatError(ValueError):
+    """ファイルのヘッダーやEXIF構造が想定外で、高速リーダーでは読めない場合の例外"""
+
+
+class ExifReader:
+    """
+    ファイル先頭のシグネチャで形式を判別し、EXIFが入っている部分だけを読んで
+    TIFF IFDを直接たどり、指定タグのみを取り出す軽量EXIFリーダー
+    対応形式: JPEG (APP1)、TIFF と TIFF ベースのRAW (DNG/CR2/NEF/ARW/ORF/RW2 など)、
+    HEIF/HEIC (ISOBMFF の Exif アイテム)、PNG (eXIf チャンク)
+    """
+    DEFAULT_TAGS = ("DateTimeOriginal", "Make", "Model", "GPSInfo")
+
+    # APP1を探すためにヘッダーを読み進める上限
+    MAX_HEADER_SCAN = 256 * 1024
+
+    # TIFFベースのファイルでIFDやタグの値を1回に読むバイト数の上限（IFDはファイル内のどこにあってもよい）
+    MAX_TIFF_READ = 64 * 1024
+
+    # ISOBMFF の meta ボックスと Exif アイテムの大きさの上限（バイト）
+    MAX_META_SIZE = 1024 * 1024
+    MAX_EXIF_ITEM_SIZE = 1024 * 1024
+
+    # meta ボックスを探すために調べるトップレベルのボックス数の上限
+    MAX_TOP_LEVEL_BOXES = 64
+
+    PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+    # TIFF と、独自のマジックナンバーを持つTIFFベースのRAW (ORF: "RO"/"SR", RW2: 0x55)
+    TIFF_SIGNATURES = (b"II*\x00", b"MM\x00*", b"IIRO", b"IIRS", b"MMOR", b"IIU\x00")
+    TIFF_MAGICS = (42, 0x4F52, 0x5352, 0x55)
+
+    # 1つのIFDに許容するエントリ数の上限（壊れたファイル対策）
+    MAX_IFD_ENTRIES = 1024
+
+    EXIF_IFD_POINTER = 0x8769
+    GPS_IFD_POINTER = 0x8825
+
+    # タグ名 -> (IFD種別, タグID)
+    SUPPORTED_TAGS = {
+        "Make": ("ifd0", 0x010F),
+        "Model": ("ifd0", 0x0110),
+        "Orientation": ("ifd0", 0x0112),
+        "DateTime": ("ifd0", 0x0132),
+        "GPSInfo": ("ifd0", GPS_IFD_POINTER),
+        "DateTimeOriginal": ("exif", 0x9003),
+        "DateTimeDigitized": ("exif", 0x9004),
+    }
+
+    # TIFFのデータ型ごとの1要素のバイト数
+    TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+    @staticmethod
+    def read_tags(file_path: str, tags: Sequence[str] = DEFAULT_TAGS) -> Dict[str, Any]:
+        """
+        写真ファイルから指定タグのみを読み出す
+        EXIFがないファイルは空の辞書を返し、構造が不正な場合や未対応の形式は ExifFormatError を送出する
+        """
+        unknown = [tag for tag in tags if tag not in ExifReader.SUPPORTED_TAGS]
+        if unknown:
+            raise ValueError(f"未対応のタグです: {', '.join(unknown)}")
+
+        with open(file_path, "rb") as f:
+            head = f.read(16)
+            f.seek(0)
+            if head[:4] in ExifReader.TIFF_SIGNATURES:
+                # IFD0 や Exif IFD はファイルの後ろにあることもあるため、オフセットごとにシークして読む
+                return ExifReader._parse_tiff_file(f, tags)
+            tiff_data = ExifReader._read_tiff_data(f, head)
+
+        if tiff_data is None:
+            return {}
+        return ExifReader.parse_tiff(tiff_data, tags)
+
+    @staticmethod
+    def _read_tiff_data(f, head: bytes) -> Optional[bytes]:
+        """ファイル先頭のシグネチャから形式を判別し、EXIFのTIFF部分を返す（EXIFがなければ None）"""
+        if head[:2] == b"\xff\xd8":
+            return ExifReader._read_jpeg_app1(f)
+        if head[:8] == ExifReader.PNG_SIGNATURE:
+            return ExifReader._read_png_exif(f)
+        if head[4:8] == b"ftyp":
+            return ExifReader._read_isobmff_exif(f)
+        raise ExifFormatError("対応していないファイル形式です")
+
+    @staticmethod
+    def _read_jpeg_app1(f) -> Optional[bytes]:
+        """JPEGのマーカーをたどり、最初のExif APP1セグメントのTIFF部分を返す"""
+        if f.read(2) != b"\xff\xd8":
+            raise ExifFormatError("JPEGのSOIマーカーがありません")
+
+        position = 2
+        while position < ExifReader.MAX_HEADER_SCAN:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                raise ExifFormatError("JPEGのマーカーが不正です")
+
+            # 0xFF のフィルバイトを読み飛ばす
+            marker_type = marker[1]
+            while marker_type == 0xFF:
+                fill = f.read(1)
+                if not fill:
+                    raise ExifFormatError("JPEGのマーカーが途中で終わっています")
+                marker_type = fill[0]
+                position += 1
+
+            # SOS/EOI まで来たらEXIFはない
+            if marker_type in (0xDA, 0xD9):
+                return None
+
+            length_bytes = f.read(2)
+            if len(length_bytes) < 2:
+                raise ExifFormatError("JPEGのセグメント長が読めません")
+            length = struct.unpack(">H", length_bytes)[0]
+            if length < 2:
+                raise ExifFormatError("JPEGのセグメント長が不正です")
+
+            if marker_type == 0xE1:
+                segment = f.read(length - 2)
+                if len(segment) < length - 2:
+                    raise ExifFormatError("APP1セグメントが途中で終わっています")
+                if segment.startswith(b"Exif\x00\x00"):
+                    return segment[6:]
+            else:
+                f.seek(length - 2, 1)
+
+            position += 2 + length
+
+        return None
+
+    @staticmethod
+    def _read_png_exif(f) -> Optional[bytes]:
+        """PNGのチャンクをたどり、eXIf チャンクの内容を返す（画像データより後ろは読まない）"""
+        f.seek(len(ExifReader.PNG_SIGNATURE))
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ExifFormatError("PNGのチャンクが途中で終わっています")
+            length, chunk_type = struct.unpack(">I4s", header)
+            if length > 0x7FFFFFFF:
+                raise ExifFormatError("PNGのチャンク長が不正です")
+
+            if chunk_type == b"eXIf":
+                data = f.read(length)
+                if len(data) < length:
+                    raise ExifFormatError("eXIf チャンクが途中で終わっています")
+                # 古い書き込みツールは JPEG と同じ "Exif\0\0" を先頭に付けている
+                if data.startswith(b"Exif\x00\x00"):
+                    data = data[6:]
+                return data
+
+            # eXIf は画像データより前に置かれる
+            if chunk_type in (b"IDAT", b"IEND"):
+                return None
+
+            # チャンクの内容とCRCを読み飛ばす
+            f.seek(length + 4, 1)
+
+    @staticmethod
+    def _read_isobmff_exif(f) -> Optional[bytes]:
+        """
+        HEIF/HEIC などの ISOBMFF ファイルから、meta ボックスの iinf/iloc をたどって
+        Exif アイテムのTIFF部分を返す（画像データは読まない）
+        """
+        file_size = os.fstat(f.fileno()).st_size
+        meta = None
+        position = 0
+        for _ in range(ExifReader.MAX_TOP_LEVEL_BOXES):
+            if position + 8 > file_size:
+                break
+            f.seek(position)
+            header = f.read(16)
+            box_type, header_size, box_size = ExifReader._parse_box_header(header, 0, file_size - position)
+            if box_type == b"meta":
+                if box_size > ExifReader.MAX_META_SIZE:
+                    raise ExifFormatError("meta ボックスが大きすぎます")
+                f.seek(position + header_size)
+                meta = f.read(box_size - header_size)
+                break
+            position += box_size
+
+        if meta is None:
+            raise ExifFormatError("ISOBMFF の meta ボックスがありません")
+
+        # meta はフルボックスなので version/flags の4バイトを飛ばす
+        boxes = {box_type: (start, end) for box_type, start, end in ExifReader._iter_boxes(meta, 4, len(meta))}
+        if b"iinf" not in boxes or b"iloc" not in boxes:
+            return None
+
+        exif_item_id = ExifReader._find_exif_item(meta, *boxes[b"iinf"])
+        if exif_item_id is None:
+            return None
+        location = ExifReader._parse_iloc(meta, *boxes[b"iloc"]).get(exif_item_id)
+        if location is None:
+            raise ExifFormatError("Exif アイテムの位置がありません")
+
+        construction_method, base_offset, extents = location
+        if sum(length for _, length in extents) > ExifReader.MAX_EXIF_ITEM_SIZE:
+            raise ExifFormatError("Exif アイテムが大きすぎます")
+
+        chunks = []
+        for offset, length in extents:
+            if construction_method == 0:
+                f.seek(base_offset + offset)
+                chunk = f.read(length)
+            elif construction_method == 1 and b"idat" in boxes:
+                idat_start, idat_end = boxes[b"idat"]
+                chunk = meta[idat_start + base_offset + offset:min(idat_start + base_offset + offset + length,
+                                                                   idat_end)]
+            else:
+                raise ExifFormatError(f"未対応の Exif アイテムの格納方法です: {construction_method}")
+            if len(chunk) < length:
+                raise ExifFormatError("Exif アイテムが途中で終わっています")
+            chunks.append(chunk)
+        item = b"".join(chunks)
+
+        # Exif アイテムは先頭4バイトのTIFFヘッダーまでのオフセットに続いてTIFFデータが入る
+        if len(item) < 4:
+            raise ExifFormatError("Exif アイテムが短すぎます")
+        tiff_offset = 4 + struct.unpack(">I", item[:4])[0]
+        tiff_data = item[tiff_offset:]
+        if tiff_data.startswith(b"Exif\x00\x00"):
+            tiff_data = tiff_data[6:]
+        return tiff_data
+
+    @staticmethod
+    def _parse_box_header(data: bytes, offset: int, available: int) -> Tuple[bytes, int, int]:
+        """ボックスのヘッダーを読み、(種別, ヘッダー長, ボックス全体の長さ) を返す"""
+        if len(data) < offset + 8:
+            raise ExifFormatError("ボックスのヘッダーが途中で終わっています")
+        box_size, box_type = struct.unpack(">I4s", data[offset:offset + 8])
+        header_size = 8
+        if box_size == 1:
+            if len(data) < offset + 16:
+                raise ExifFormatError("ボックスのヘッダーが途中で終わっています")
+            box_size = struct.unpack(">Q", data[offset + 8:offset + 16])[0]
+            header_size = 16
+        elif box_size == 0:
+            # ファイル（親ボックス）の終わりまで
+            box_size = available
+        if box_size < header_size or box_size > available:
+            raise ExifFormatError("ボックスの長さが不正です")
+        return box_type, header_size, box_size
+
+    @staticmethod
+    def _iter_boxes(data: bytes, start: int, end: int):
+        """data[start:end] に並ぶ子ボックスの (種別, 内容の開始位置, 終了位置) を返す"""
+        position = start
+        while position + 8 <= end:
+            box_type, header_size, box_size = ExifReader._parse_box_header(data, position, end - position)
+            yield box_type, position + header_size, position + box_size
+            position += box_size
+
+    @staticmethod
+    def _find_exif_item(meta: bytes, start: int, end: int) -> Optional[int]:
+        """iinf ボックスから種別が "Exif" のアイテムのIDを返す"""
+        if end - start < 6:
+            raise ExifFormatError("iinf ボックスが短すぎます")
+        version = meta[start]
+        position = start + (6 if version == 0 else 8)
+
+        for box_type, infe_start, infe_end in ExifReader._iter_boxes(meta, position, end):
+            if box_type != b"infe" or infe_end - infe_start < 4:
+                continue
+            infe_version = meta[infe_start]
+            # version 0/1 の infe にはアイテム種別がない
+            if infe_version < 2:
+                continue
+            if infe_version == 2:
+                fmt, id_size = ">H", 2
+            else:
+                fmt, id_size = ">I", 4
+            item_start = infe_start + 4
+            if infe_end < item_start + id_size + 6:
+                raise ExifFormatError("infe ボックスが短すぎます")
+            item_id = struct.unpack(fmt, meta[item_start:item_start + id_size])[0]
+            item_type = meta[item_start + id_size + 2:item_start + id_size + 6]
+            if item_type == b"Exif":
+                return item_id
+        return None
+
+    @staticmethod
+    def _parse_iloc(meta: bytes, start: int, end: int) -> Dict[int, Tuple[int, int, List[Tuple[int, int]]]]:
+        """iloc ボックスを アイテムID -> (格納方法, 基準オフセット, [(オフセット, 長さ), ...]) の辞書として読む"""
+        data = meta[start:end]
+        if len(data) < 8:
+            raise ExifFormatError("iloc ボックスが短すぎます")
+        version = data[0]
+        offset_size, length_size = data[4] >> 4, data[4] & 0x0F
+        base_offset_size, index_size = data[5] >> 4, data[5] & 0x0F
+        if version < 1:
+            index_size = 0
+        position = 6
+
+        def read_uint(size: int) -> int:
+            nonlocal position
+            if size not in (0, 2, 4, 8):
+                raise ExifFormatError("iloc のフィールド長が不正です")
+            if position + size > len(data):
+                raise ExifFormatError("iloc ボックスが途中で終わっています")
+            value = int.from_bytes(data[position:position + size], "big") if size else 0
+            position += size
+            return value
+
+        item_count = read_uint(4 if version == 2 else 2)
+        locations = {}
+        for _ in range(item_count):
+            item_id = read_uint(4 if version == 2 else 2)
+            construction_method = read_uint(2) & 0x0F if version in (1, 2) else 0
+            read_uint(2)  # data_reference_index
+            base_offset = read_uint(base_offset_size)
+            extent_count = read_uint(2)
+            extents = []
+            for _ in range(extent_count):
+                read_uint(index_size)
+                extents.append((read_uint(offset_size), read_uint(length_size)))
+            locations[item_id] = (construction_method, base_offset, extents)
+        return locations
+
+    @staticmethod
+    def parse_tiff(data: bytes, tags: Sequence[str] = DEFAULT_TAGS) -> Dict[str, Any]:
+        """TIFF形式のEXIFデータから指定タグを取り出す"""
+        return ExifReader._parse_tiff(lambda offset, size: data[offset:offset + size], len(data), tags)
+
+    @staticmethod
+    def _parse_tiff_file(f, tags: Sequence[str]) -> Dict[str, Any]:
+        """TIFFベースのファイルから、ヘッダー・IFD・タグの値をそれぞれのオフセットにシークして読む"""
+        file_size = os.fstat(f.fileno()).st_size
+
+        def read(offset: int, size: int) -> bytes:
+            if size > ExifReader.MAX_TIFF_READ:
+                raise ExifFormatError("IFDまたはタグの値が大きすぎます")
+            f.seek(offset)
+            return f.read(size)
+
+        return ExifReader._parse_tiff(read, file_size, tags)
+
+    @staticmethod
+    def _parse_tiff(read: Callable[[int, int], bytes], data_size: int, tags: Sequence[str]) -> Dict[str, Any]:
+        """
+        TIFFデータから指定タグを取り出す
+        read(オフセット, 長さ) はTIFF先頭からの位置のバイト列を返す関数、data_size はTIFFデータ全体の長さ
+        """
+        if data_size < 8:
+            raise ExifFormatError("TIFFヘッダーが短すぎます")
+        header = read(0, 8)
+
+        if header[:2] == b"II":
+            endian = "<"
+        elif header[:2] == b"MM":
+            endian = ">"
+        else:
+            raise ExifFormatError("TIFFのバイトオーダーが不正です")
+
+        magic, ifd0_offset = struct.unpack(endian + "HI", header[2:8])
+        if magic not in ExifReader.TIFF_MAGICS:
+            raise ExifFormatError("TIFFのマジックナンバーが不正です")
+
+        ifd0 = ExifReader._read_ifd(read, data_size, ifd0_offset, endian)
+
+        exif_ifd = {}
+        if any(ExifReader.SUPPORTED_TAGS[tag][0] == "exif" for tag in tags) and ExifReader.EXIF_IFD_POINTER in ifd0:
+            exif_offset = ExifReader._decode_value(read, data_size, ifd0[ExifReader.EXIF_IFD_POINTER], endian)
+            if not isinstance(exif_offset, int):
+                raise ExifFormatError("Exif IFDへのポインタが不正です")
+            exif_ifd = ExifReader._read_ifd(read, data_size, exif_offset, endian)
+
+        result = {}
+        for tag in tags:
+            ifd_name, tag_id = ExifReader.SUPPORTED_TAGS[tag]
+            entries = ifd0 if ifd_name == "ifd0" else exif_ifd
+            if tag_id not in entries:
+                continue
+
+            value = ExifReader._decode_value(read, data_size, entries[tag_id], endian)
+            if tag_id == ExifReader.GPS_IFD_POINTER:
+                # Pillow と同様、GPS IFD はタグID -> 値の辞書として返す
+                if not isinstance(value, int):
+                    raise ExifFormatError("GPS IFDへのポインタが不正です")
+                gps_ifd = ExifReader._read_ifd(read, data_size, value, endian)
+                value = {gps_tag: ExifReader._decode_value(read, data_size, entry, endian)
+                         for gps_tag, entry in gps_ifd.items()}
+            result[tag] = value
+
+        return result
+
+    @staticmethod
+    def _read_ifd(read: Callable[[int, int], bytes], data_size: int, offset: int,
+                  endian: str) -> Dict[int, Tuple[int, int, bytes]]:
+        """IFDのエントリを タグID -> (型, 個数, 値フィールド) の辞書として読む"""
+        if offset < 8 or offset + 2 > data_size:
+            raise ExifFormatError("IFDのオフセットが範囲外です")
+
+        count = struct.unpack(endian + "H", read(offset, 2))[0]
+        if count > ExifReader.MAX_IFD_ENTRIES or offset + 2 + count * 12 > data_size:
+            raise ExifFormatError("IFDのエントリ数が不正です")
+        data = read(offset + 2, count * 12)
+        if len(data) < count * 12:
+            raise ExifFormatError("IFDが途中で終わっています")
+
+        entries = {}
+        for i in range(count):
+            start = i * 12
+            tag_id, value_type, value_count = struct.unpack(endian + "HHI", data[start:start + 8])
+            entries[tag_id] = (value_type, value_count, data[start + 8:start + 12])
+        return entries
+
+    @staticmethod
+    def _decode_value(read: Callable[[int, int], bytes], data_size: int, entry: Tuple[int, int, bytes],
+                      endian: str) -> Any:
+        """IFDエントリの値をデコードする（文字列と整数はPillowと同じ型で返す）"""
+        value_type, value_count, field = entry
+        type_size = ExifReader.TYPE_SIZES.get(value_type)
+        if type_size is None:
+            raise ExifFormatError(f"未知のTIFFデータ型です: {value_type}")
+
+        size = type_size * value_count
+        if size <= 4:
+            raw = field[:size]
+        else:
+            value_offset = struct.unpack(endian + "I", field)[0]
+            if value_offset + size > data_size:
+                raise ExifFormatError("タグの値が範囲外を指しています")
+            raw = read(value_offset, size)
+            if len(raw) < size:
+                raise ExifFormatError("タグの値が途中で終わっています")
+
+        if value_type == 2:
+            # Pillow と同じく末尾のNULを1つだけ取り除き latin-1 でデコードする
+            if raw.endswith(b"\x00"):
+                raw = raw[:-1]
+            return raw.decode("latin-1", "replace")
+
+        if value_type in (3, 4):
+            fmt = "H" if value_type == 3 else "I"
+            values = struct.unpack(endian + fmt * value_count, raw)
+            return values[0] if value_count == 1 else values
+
+        if value_type in (5, 10):
+            fmt = "II" if value_type == 5 else "ii"
+            values = struct.unpack(endian + fmt * value_count, raw)
+            pairs = tuple((values[i], values[i + 1]) for i in range(0, len(values), 2))
+            return pairs[0] if value_count == 1 else pairs
+
+        return raw
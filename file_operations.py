@@ -1,6 +1,7 @@
 import os
 from typing import Optional
-from file_utils import FileUtils
+from file_scanner import FileScanner
+from rename_planner import RenamePlanner
 
 class FileOperations:
     @staticmethod
@@ -12,7 +13,7 @@ class FileOperations:
 
         print(f"検索開始: {root_dir}")
 
-        for root, _, files in os.walk(root_dir):
+        for root, _, files in FileScanner.walk(root_dir):
             for file in files:
                 if file == target_file:
                     file_path = os.path.join(root, file)
@@ -27,66 +28,35 @@ class FileOperations:
         return deleted_count
 
     @staticmethod
-    def sanitize_filenames(root_dir: Optional[str] = None) -> int:
-        """ファイル名を正規化する関数"""
-        root_dir = root_dir or os.getcwd()
-        renamed_count = 0
-
-        for root, _, files in os.walk(root_dir):
-            for old_name in files:
-                old_path = os.path.join(root, old_name)
-                base, ext = os.path.splitext(old_name)
-
-                # 拡張子の小文字化
-                ext = ext.lower()
-
-                # 名前を正規化
-                normalized_base = FileUtils.normalize_name(base)
-
-                # 元のファイル名に半角全角英数が一つもない場合に備え、空になったら仮名を入れる
-                if not normalized_base:
-                    normalized_base = "file"
-
-                new_name = normalized_base + ext
-                new_path = os.path.join(root, new_name)
-
-                # ファイル名の一意性を確保
-                new_path = FileUtils.ensure_unique_path(new_path)
+    def sanitize_filenames(root_dir: Optional[str] = None, dry_run: bool = False) -> int:
+        """
+        ファイル名を正規化する関数
+        ディレクトリごとに名前の衝突をまとめて解決したリネーム計画を作成してから一括で適用する
+        dry_run=True の場合は計画を表示するだけで変更しない
+        """
+        plan = RenamePlanner.plan_file_renames(root_dir)
 
-                # 名前が変わったときだけリネーム
-                if old_path != new_path:
-                    os.rename(old_path, new_path)
-                    print(f"リネーム: {old_path} -> {new_path}")
-                    renamed_count += 1
+        if dry_run:
+            RenamePlanner.print_plan(plan, "リネーム")
+            return len(plan)
 
-        return renamed_count
+        return RenamePlanner.apply(plan, "リネーム")
 
     @staticmethod
-    def sanitize_directories(root_dir: Optional[str] = None) -> int:
-        """ディレクトリ名を正規化する関数"""
-        root_dir = root_dir or os.getcwd()
-        renamed_count = 0
-
-        for root, dirs, _ in os.walk(root_dir, topdown=False):
-            for old_dir_name in dirs:
-                old_dir_path = os.path.join(root, old_dir_name)
-
-                # 名前を正規化
-                normalized_name = FileUtils.normalize_name(old_dir_name)
+    def sanitize_directories(root_dir: Optional[str] = None, dry_run: bool = False) -> int:
+        """
+        ディレクトリ名を正規化する関数（下層から上層へ）
+        dry_run=True の場合は計画を表示するだけで変更しない
+        """
+        plan = RenamePlanner.plan_directory_renames(root_dir)
 
-                # 空になったら仮のディレクトリ名を入れる
-                if not normalized_name:
-                    normalized_name = "folder"
+        if dry_run:
+            RenamePlanner.print_plan(plan, "ディレクトリリネーム")
+            return len(plan)
 
-                new_dir_path = os.path.join(root, normalized_name)
+        return RenamePlanner.apply(plan, "ディレクトリリネーム")
 
-                # ディレクトリ名の一意性を確保
-                new_dir_path = FileUtils.ensure_unique_path(new_dir_path, is_directory=True)
-
-                # 変更がある場合のみリネーム
-                if old_dir_path != new_dir_path:
-                    os.rename(old_dir_path, new_dir_path)
-                    print(f"ディレクトリリネーム: {old_dir_path} -> {new_dir_path}")
-                    renamed_count += 1
-
-        return renamed_count
+    @staticmethod
+    def undo_last_rename(journal_path: Optional[str] = None) -> int:
+        """直前の名前の正規化を取り消す関数"""
+        return RenamePlanner.undo(journal_path)
@@ -1,50 +1,129 @@
+import csv
+import datetime
+import json
 import os
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+from file_scanner import FileScanner
+
+
+class ExtensionReport:
+    """
+    拡張子ごとの件数・合計サイズ・ファイル一覧をストリーミングで集計するクラス
+    ファイルパスは拡張子ごとに max_files_to_show 件までしか保持しないため、メモリ使用量は総ファイル数に依存しない
+    """
+
+    def __init__(self, max_files_to_show: int = 50):
+        self.max_files_to_show = max_files_to_show
+        self.extension_counts = {}
+        self.extension_bytes = {}
+        self.extension_files = {}  # 拡張子ごとのファイルパス（件数が上限を超えた拡張子は None）
+        self.total_files = 0
+        self.total_bytes = 0
+
+    def add(self, path: str, ext: str, size: int) -> None:
+        """1ファイル分を集計に加える"""
+        self.total_files += 1
+        self.total_bytes += size
+
+        # 拡張子別の件数と合計サイズを集計
+        count = self.extension_counts.get(ext, 0) + 1
+        self.extension_counts[ext] = count
+        self.extension_bytes[ext] = self.extension_bytes.get(ext, 0) + size
+
+        # 拡張子別のファイルパスは表示対象になりうる間だけ記録する
+        if count > self.max_files_to_show:
+            self.extension_files[ext] = None
+        elif count == 1:
+            self.extension_files[ext] = [path]
+        else:
+            self.extension_files[ext].append(path)
+
+    def rows(self) -> List[Dict]:
+        """件数の多い順に並べた拡張子ごとの集計結果を返す"""
+        rows = []
+        for ext, count in sorted(self.extension_counts.items(), key=lambda x: x[1], reverse=True):
+            files = self.extension_files[ext]
+            rows.append({
+                "extension": ext,
+                "count": count,
+                "percentage": round(count / self.total_files * 100, 4),
+                "total_bytes": self.extension_bytes[ext],
+                "files": sorted(files) if files is not None else None,
+            })
+        return rows
+
+    def print_report(self) -> None:
+        """集計結果をコンソールに表示する"""
+        print(f"総ファイル数: {self.total_files}")
+
+        for row in self.rows():
+            ext = row["extension"]
+            percentage = (row["count"] / self.total_files) * 100
+            print(f"{ext or '(拡張子なし)'}: {row['count']} 個, {percentage:.2f}%")
+
+            # 50件以下の拡張子は全ファイルパスを表示
+            if row["files"] is not None:
+                print(f"  -- {ext or '(拡張子なし)'}のファイル一覧 --")
+                for file_path in row["files"]:
+                    print(f"    {file_path}")
+                print()  # 空行で区切り
+
+    def to_dict(self, root_dir: str) -> Dict:
+        """JSON出力用の辞書を返す"""
+        return {
+            "root_dir": os.path.abspath(root_dir),
+            "generated_at": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "total_files": self.total_files,
+            "total_bytes": self.total_bytes,
+            "extensions": self.rows(),
+        }
+
+    def write_json(self, output_file: str, root_dir: str) -> None:
+        """集計結果をJSONで保存する"""
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(root_dir), f, ensure_ascii=False, indent=2)
+
+    def write_csv(self, output_file: str) -> None:
+        """集計結果をCSVで保存する（ファイル一覧は含めない）"""
+        with open(output_file, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["extension", "count", "percentage", "total_bytes"])
+            for row in self.rows():
+                writer.writerow([row["extension"], row["count"], row["percentage"], row["total_bytes"]])
+
 
 class FileReporter:
     @staticmethod
-    def report_file_extensions(root_dir: Optional[str] = None, max_files_to_show: int = 50) -> Dict[str, int]:
+    def report_file_extensions(root_dir: Optional[str] = None, max_files_to_show: int = 50,
+                               output_json: Optional[str] = None, output_csv: Optional[str] = None) -> Dict[str, int]:
         """
         拡張子ごとの件数と割合を表示する関数
         50件以下の拡張子は全ファイルパスも表示
+        output_json / output_csv を指定すると拡張子ごとの合計サイズを含む集計結果も保存する
         """
         root_dir = root_dir or os.getcwd()
-        extension_counts = {}
-        extension_files = {}  # 拡張子ごとのファイルパスを保持する辞書
-        total_files = 0
+        report = ExtensionReport(max_files_to_show)
 
         # 全ファイルを走査
-        for root, _, files in os.walk(root_dir):
-            for file in files:
-                total_files += 1
-                _, ext = os.path.splitext(file)
-                ext = ext.lower()
-
-                # 拡張子別の件数をカウント
-                extension_counts[ext] = extension_counts.get(ext, 0) + 1
+        for entry in FileScanner.iter_files(root_dir):
+            report.add(entry.path, entry.ext, entry.size)
 
-                # 拡張子別のファイルパスを記録
-                if ext not in extension_files:
-                    extension_files[ext] = []
-                extension_files[ext].append(os.path.join(root, file))
+        FileReporter.print_extension_report(report, root_dir, output_json, output_csv)
+        return report.extension_counts
 
-        if total_files == 0:
+    @staticmethod
+    def print_extension_report(report: ExtensionReport, root_dir: str, output_json: Optional[str] = None,
+                               output_csv: Optional[str] = None) -> None:
+        """集計済みの拡張子レポートを表示し、指定があればJSON/CSVにも保存する"""
+        if report.total_files == 0:
             print("ファイルが見つかりませんでした。")
-            return {}
+            return
 
-        print(f"総ファイル数: {total_files}")
-
-        # 件数の多い順に並べ替え
-        sorted_ext_counts = sorted(extension_counts.items(), key=lambda x: x[1], reverse=True)
-        for ext, count in sorted_ext_counts:
-            percentage = (count / total_files) * 100
-            print(f"{ext or '(拡張子なし)'}: {count} 個, {percentage:.2f}%")
-
-            # 50件以下の拡張子は全ファイルパスを表示
-            if count <= max_files_to_show:
-                print(f"  -- {ext or '(拡張子なし)'}のファイル一覧 --")
-                for file_path in sorted(extension_files[ext]):
-                    print(f"    {file_path}")
-                print()  # 空行で区切り
+        report.print_report()
 
-        return extension_counts
+        if output_json:
+            report.write_json(output_json, root_dir)
+            print(f"JSONレポートが {output_json} に保存されました")
+        if output_csv:
+            report.write_csv(output_csv)
+            print(f"CSVレポートが {output_csv} に保存されました")
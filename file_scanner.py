@@ -0,0 +1,395 @@
+import contextlib
+import hashlib
+import os
+import queue
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from file_utils import FileUtils
+from metrics import Metrics
+
+
+class FileEntry(NamedTuple):
+    """スキャンで得たファイル1件分の情報（stat結果をキャッシュしたもの）"""
+    path: str
+    name: str
+    size: int
+    mtime_ns: int
+    inode: int
+    ext: str
+    dev: int
+
+
+class FileScanner:
+    """
+    os.scandir ベースのディレクトリ走査とスキャンインデックスの管理
+    前回のスキャン結果をインデックスとして保存し、mtime が変わっていない
+    ディレクトリは再列挙せずにインデックスの名前一覧を再利用する
+    （ファイルを上書きしてもディレクトリの mtime は変わらないため、各ファイルは stat し直す）
+    """
+    INDEX_VERSION = "1"
+
+    # 直近に更新されたディレクトリは同じ mtime のまま再変更される可能性があるため信用しない
+    RACY_WINDOW_NS = 2_000_000_000
+
+    # エントリ種別: ファイル / ディレクトリ / シンボリックリンクのディレクトリ（再帰しない）
+    KIND_FILE = "f"
+    KIND_DIR = "d"
+    KIND_LINK_DIR = "l"
+
+    # 並列走査で1スレッドあたりに先行して列挙するディレクトリ数
+    PREFETCH_PER_THREAD = 4
+
+    # 全操作で共通の走査設定（configure() で変更する）
+    threads = 1
+    ordered = True
+
+    _null_lock = contextlib.nullcontext()
+
+    @staticmethod
+    def configure(threads: int = 1, ordered: bool = True) -> None:
+        """
+        全操作で使う走査の並列度を設定する
+        threads > 1 の場合は複数のディレクトリを同時に列挙する（NFS/SMB など1回の列挙の遅延が大きい場合向け）
+        ordered=False にすると、トップダウンの走査では列挙が終わった順にディレクトリを返す
+        """
+        FileScanner.threads = max(threads, 1)
+        FileScanner.ordered = ordered
+
+    @staticmethod
+    def get_index_path(root_dir: str) -> str:
+        """ルートディレクトリに対応するスキャンインデックスのパスを返す"""
+        root_dir = os.path.abspath(root_dir)
+        digest = hashlib.sha1(root_dir.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+        return os.path.join(FileUtils.get_cache_dir(), f"scan_{digest}.sqlite")
+
+    @staticmethod
+    def walk(root_dir: Optional[str] = None, topdown: bool = True, use_index: bool = True,
+             threads: Optional[int] = None, ordered: Optional[bool] = None) -> Iterator[Tuple[str, List[str], List[str]]]:
+        """os.walk 互換の (root, dirs, files) を返す走査関数"""
+        for root, dirs, entries in FileScanner.walk_entries(root_dir, topdown=topdown, use_index=use_index,
+                                                            threads=threads, ordered=ordered):
+            yield root, dirs, [entry.name for entry in entries]
+
+    @staticmethod
+    def iter_files(root_dir: Optional[str] = None, use_index: bool = True) -> Iterator[FileEntry]:
+        """ツリー内の全ファイルを FileEntry として順に返す"""
+        for _, _, entries in FileScanner.walk_entries(root_dir, use_index=use_index):
+            yield from entries
+
+    @staticmethod
+    def walk_entries(root_dir: Optional[str] = None, topdown: bool = True, use_index: bool = True,
+                     threads: Optional[int] = None,
+                     ordered: Optional[bool] = None) -> Iterator[Tuple[str, List[str], List[FileEntry]]]:
+        """
+        ディレクトリツリーを走査し (root, dirs, entries) を返す
+        topdown=True の場合は os.walk と同様に dirs をその場で変更して枝刈りできる
+        threads と ordered を省略した場合は configure() の設定を使う
+        最後まで走査した場合のみインデックスを更新する
+        """
+        root_dir = root_dir or os.getcwd()
+        threads = FileScanner.threads if threads is None else threads
+        ordered = FileScanner.ordered if ordered is None else ordered
+        index_path = FileScanner.get_index_path(root_dir)
+        old_db = FileScanner._open_index(index_path) if use_index else None
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix=".tmp")
+        os.close(fd)
+        new_db = sqlite3.connect(tmp_path)
+        FileScanner._create_schema(new_db)
+        scan_start_ns = time.time_ns()
+
+        completed = False
+        try:
+            if threads > 1:
+                yield from FileScanner._walk_parallel(root_dir, topdown, old_db, new_db, scan_start_ns, threads,
+                                                      ordered)
+            else:
+                yield from FileScanner._walk_dir(root_dir, "", topdown, old_db, new_db, scan_start_ns)
+            completed = True
+        finally:
+            if old_db is not None:
+                old_db.close()
+            if completed:
+                new_db.execute("CREATE INDEX entries_dir ON entries(dir_id)")
+                new_db.commit()
+                new_db.close()
+                os.replace(tmp_path, index_path)
+            else:
+                new_db.close()
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _walk_dir(top: str, key: str, topdown: bool, old_db: Optional[sqlite3.Connection],
+                  new_db: sqlite3.Connection, scan_start_ns: int) -> Iterator[Tuple[str, List[str], List[FileEntry]]]:
+        """
+        1ディレクトリを列挙（またはインデックスから復元）して再帰的に走査する
+        key はルートからの相対パスで、インデックスの検索キーとして使う
+        """
+        listing = FileScanner._list_dir(top, key, old_db, new_db, scan_start_ns)
+        if listing is None:
+            # os.walk と同様、読めないディレクトリは無視する
+            return
+        dirs, link_dirs, entries = listing
+
+        if topdown:
+            yield top, dirs, entries
+            for name in dirs:
+                if name not in link_dirs:
+                    yield from FileScanner._walk_dir(os.path.join(top, name), os.path.join(key, name),
+                                                    topdown, old_db, new_db, scan_start_ns)
+        else:
+            for name in dirs:
+                if name not in link_dirs:
+                    yield from FileScanner._walk_dir(os.path.join(top, name), os.path.join(key, name),
+                                                    topdown, old_db, new_db, scan_start_ns)
+            yield top, dirs, entries
+
+    @staticmethod
+    def _walk_parallel(root_dir: str, topdown: bool, old_db: Optional[sqlite3.Connection],
+                       new_db: sqlite3.Connection, scan_start_ns: int, threads: int,
+                       ordered: bool) -> Iterator[Tuple[str, List[str], List[FileEntry]]]:
+        """
+        ディレクトリの列挙（stat・scandir・インデックスの参照）をスレッドプールで並列に行う走査
+        先行して列挙するディレクトリ数を threads * PREFETCH_PER_THREAD 件に制限するため、
+        列挙済みで未返却の結果が際限なく溜まることはない。インデックスへの書き込みは呼び出し元のスレッドで行う
+        ordered=True またはボトムアップの場合は逐次の走査と同じ順序で返す
+        """
+        lock = threading.Lock()
+        window = threads * FileScanner.PREFETCH_PER_THREAD
+        executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="scan")
+
+        def submit(top: str, key: str):
+            return executor.submit(FileScanner._read_dir, top, key, old_db, lock)
+
+        try:
+            if not ordered and topdown:
+                yield from FileScanner._walk_as_completed(root_dir, submit, window, new_db, scan_start_ns)
+            elif topdown:
+                for top, dirs, entries, _ in FileScanner._walk_prefetch(root_dir, submit, window, new_db,
+                                                                          scan_start_ns):
+                    yield top, dirs, entries
+            else:
+                # 行きがけ順の結果を、祖先を保留しておくことで帰りがけ順に並べ替える
+                ancestors = []
+                for top, dirs, entries, depth in FileScanner._walk_prefetch(root_dir, submit, window, new_db,
+                                                                            scan_start_ns):
+                    while ancestors and ancestors[-1][3] >= depth:
+                        yield ancestors.pop()[:3]
+                    ancestors.append((top, dirs, entries, depth))
+                while ancestors:
+                    yield ancestors.pop()[:3]
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    @staticmethod
+    def _walk_prefetch(root_dir: str, submit, window: int, new_db: sqlite3.Connection,
+                       scan_start_ns: int) -> Iterator[Tuple[str, List[str], List[FileEntry], int]]:
+        """
+        逐次の走査と同じ行きがけ順に (root, dirs, entries, 深さ) を返す
+        次に返す予定のディレクトリ（スタックの上から window 件）を先行して列挙しておく
+        """
+        stack = [(root_dir, "", 0)]
+        futures = {}
+        while stack:
+            for top, key, _ in reversed(stack[-window:]):
+                if len(futures) >= window:
+                    break
+                if key not in futures:
+                    futures[key] = submit(top, key)
+
+            top, key, depth = stack.pop()
+            future = futures.pop(key, None) or submit(top, key)
+            listing = future.result()
+            if listing is None:
+                # os.walk と同様、読めないディレクトリは無視する
+                continue
+            dirs, link_dirs, entries = FileScanner._record_dir(top, key, *listing, new_db, scan_start_ns)
+
+            # 呼び出し元が dirs を変更（枝刈り）してから子ディレクトリを積む
+            yield top, dirs, entries, depth
+            for name in reversed(dirs):
+                if name not in link_dirs:
+                    stack.append((os.path.join(top, name), os.path.join(key, name), depth + 1))
+
+    @staticmethod
+    def _walk_as_completed(root_dir: str, submit, window: int, new_db: sqlite3.Connection,
+                           scan_start_ns: int) -> Iterator[Tuple[str, List[str], List[FileEntry]]]:
+        """列挙が終わった順に (root, dirs, entries) を返す（順序は実行ごとに変わりうる）"""
+        completed = queue.Queue(maxsize=window)
+        pending = [(root_dir, "")]
+        in_flight = 0
+        while pending or in_flight:
+            # 未列挙のディレクトリは深さ優先で投入し、待ち行列が広がりすぎないようにする
+            while pending and in_flight < window:
+                top, key = pending.pop()
+                future = submit(top, key)
+                future.add_done_callback(lambda done, top=top, key=key: completed.put((top, key, done)))
+                in_flight += 1
+
+            top, key, future = completed.get()
+            in_flight -= 1
+            listing = future.result()
+            if listing is None:
+                continue
+            dirs, link_dirs, entries = FileScanner._record_dir(top, key, *listing, new_db, scan_start_ns)
+
+            yield top, dirs, entries
+            for name in reversed(dirs):
+                if name not in link_dirs:
+                    pending.append((os.path.join(top, name), os.path.join(key, name)))
+
+    @staticmethod
+    def _list_dir(path: str, key: str, old_db: Optional[sqlite3.Connection], new_db: sqlite3.Connection,
+                  scan_start_ns: int) -> Optional[Tuple[List[str], set, List[FileEntry]]]:
+        """ディレクトリの内容を返す。mtime が前回と同じならインデックスから復元する"""
+        listing = FileScanner._read_dir(path, key, old_db, FileScanner._null_lock)
+        if listing is None:
+            return None
+        return FileScanner._record_dir(path, key, *listing, new_db, scan_start_ns)
+
+    @staticmethod
+    def _read_dir(path: str, key: str, old_db: Optional[sqlite3.Connection],
+                  lock) -> Optional[Tuple[os.stat_result, List[tuple]]]:
+        """
+        ディレクトリの stat と、インデックスの行形式の内容を返す（読めない場合は None）
+        mtime が前回と同じならインデックスから復元する。並列走査ではワーカースレッドから呼ばれる
+        """
+        try:
+            dir_stat = os.stat(path)
+        except OSError:
+            return None
+
+        rows = None
+        if old_db is not None:
+            with lock, Metrics.phase("scan.index_lookup"):
+                found = old_db.execute("SELECT id, mtime_ns FROM dirs WHERE path = ?", (key,)).fetchone()
+                if found and found[1] == dir_stat.st_mtime_ns:
+                    rows = old_db.execute(
+                        "SELECT name, kind, size, mtime_ns, inode, ext FROM entries WHERE dir_id = ? ORDER BY rowid",
+                        (found[0],)).fetchall()
+                    Metrics.count("scan.dirs_from_index")
+
+        if rows is not None:
+            with Metrics.phase("scan.restat"):
+                rows = FileScanner._restat_rows(path, rows)
+        else:
+            with Metrics.phase("scan.scandir"):
+                rows = FileScanner._scan_dir(path)
+            if rows is None:
+                return None
+        return dir_stat, rows
+
+    @staticmethod
+    def _record_dir(path: str, key: str, dir_stat: os.stat_result, rows: List[tuple], new_db: sqlite3.Connection,
+                    scan_start_ns: int) -> Tuple[List[str], set, List[FileEntry]]:
+        """列挙結果を新しいインデックスに書き込み、(dirs, link_dirs, entries) を返す"""
+        # 更新直後のディレクトリは次回必ず再列挙させる
+        recorded_mtime = dir_stat.st_mtime_ns
+        if scan_start_ns - recorded_mtime < FileScanner.RACY_WINDOW_NS:
+            recorded_mtime = -1
+        dir_id = new_db.execute("INSERT INTO dirs (path, mtime_ns, dev) VALUES (?, ?, ?)",
+                                (key, recorded_mtime, dir_stat.st_dev)).lastrowid
+        new_db.executemany(
+            "INSERT INTO entries (dir_id, name, kind, size, mtime_ns, inode, ext) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(dir_id,) + tuple(row) for row in rows])
+
+        dirs = []
+        link_dirs = set()
+        entries = []
+        for name, kind, size, mtime_ns, inode, ext in rows:
+            if kind == FileScanner.KIND_FILE:
+                entries.append(FileEntry(os.path.join(path, name), name, size, mtime_ns, inode, ext, dir_stat.st_dev))
+            else:
+                dirs.append(name)
+                if kind == FileScanner.KIND_LINK_DIR:
+                    link_dirs.add(name)
+
+        return dirs, link_dirs, entries
+
+    @staticmethod
+    def _restat_rows(path: str, rows: List[tuple]) -> List[tuple]:
+        """
+        インデックスから復元した行のうちファイルを stat し直し、サイズ・mtime・inode を現在の値にする
+        上書きされたファイルはディレクトリの mtime を変えないため、名前一覧だけを再利用する
+        """
+        fresh = []
+        for row in rows:
+            name, kind = row[0], row[1]
+            if kind != FileScanner.KIND_FILE:
+                fresh.append(row)
+                continue
+            file_path = os.path.join(path, name)
+            try:
+                # inode は os.scandir の DirEntry.inode() と同じくリンク自体のもの
+                link_st = os.lstat(file_path)
+            except OSError:
+                continue
+            st = link_st
+            if stat.S_ISLNK(link_st.st_mode):
+                try:
+                    st = os.stat(file_path)
+                except OSError:
+                    # リンク切れのシンボリックリンク（_scan_dir と同じ扱い）
+                    pass
+            fresh.append((name, kind, st.st_size, st.st_mtime_ns, link_st.st_ino, row[5]))
+        return fresh
+
+    @staticmethod
+    def _scan_dir(path: str) -> Optional[List[tuple]]:
+        """os.scandir でディレクトリを列挙し、インデックスの行形式で返す"""
+        rows = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+
+                    if is_dir:
+                        kind = FileScanner.KIND_LINK_DIR if entry.is_symlink() else FileScanner.KIND_DIR
+                        rows.append((entry.name, kind, 0, 0, 0, ""))
+                        continue
+
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        # リンク切れのシンボリックリンクなど
+                        try:
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    rows.append((entry.name, FileScanner.KIND_FILE, st.st_size, st.st_mtime_ns, entry.inode(), ext))
+        except OSError:
+            return None
+        return rows
+
+    @staticmethod
+    def _open_index(index_path: str) -> Optional[sqlite3.Connection]:
+        """既存のインデックスを開く。存在しないかバージョンが異なる場合は None"""
+        if not os.path.exists(index_path):
+            return None
+        try:
+            # 並列走査ではワーカースレッドからロックを取って参照する
+            db = sqlite3.connect(index_path, check_same_thread=False)
+            row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if row and row[0] == FileScanner.INDEX_VERSION:
+                return db
+            db.close()
+        except sqlite3.Error:
+            pass
+        return None
+
+    @staticmethod
+    def _create_schema(db: sqlite3.Connection) -> None:
+        """インデックスのテーブルを作成する"""
+        db.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        db.execute("CREATE TABLE dirs (id INTEGER PRIMARY KEY, path TEXT UNIQUE, mtime_ns INTEGER, dev INTEGER)")
+        db.execute("CREATE TABLE entries (dir_id INTEGER, name TEXT, kind TEXT, size INTEGER, "
+                   "mtime_ns INTEGER, inode INTEGER, ext TEXT)")
+        db.execute("INSERT INTO meta (key, value) VALUES ('version', ?)", (FileScanner.INDEX_VERSION,))
@@ -0,0 +1,172 @@
+import errno
+import os
+import shutil
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Set
+from file_utils import FileUtils
+from metrics import Metrics
+
+
+class FileTransfer:
+    """
+    ファイルを移動する。同じデバイス上では os.rename で移動し、
+    別のデバイスへの移動 (EXDEV) はカーネル内コピー (copy_file_range / sendfile) で複製してから
+    サイズ（指定があればハッシュ）を検証し、移動元を削除する
+    デバイスをまたぐコピーはスレッドプールで並列に行い、完了の表示は依頼した順に行う
+    """
+    DEFAULT_WORKERS = 4
+    COPY_CHUNK_SIZE = 64 * 1024 * 1024
+    TEMP_PREFIX = ".transfer-"
+
+    # copy_file_range が使えない場合に sendfile へ切り替えるエラー
+    _FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM}
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, verify_hash: bool = False):
+        self.workers = max(workers, 1)
+        self.verify_hash = verify_hash
+        self.copied_count = 0
+        self.failed_count = 0
+        self.reserved: Set[str] = set()
+        self._pending = deque()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def __enter__(self) -> "FileTransfer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def move(self, src: str, dst: str) -> None:
+        """
+        src を dst に移動する。同じデバイス上ならその場で移動し、
+        別のデバイスならコピーを予約して dst を使用中として記録する（完了は後で表示される）
+        """
+        try:
+            with Metrics.phase("fs.rename"):
+                os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        else:
+            print(f"移動: {src} -> {dst}")
+            return
+
+        # 転送中のパスは ensure_unique_path で衝突とみなされるように予約する
+        self.reserved.add(dst)
+        future = self._executor.submit(FileTransfer.copy_and_remove, src, dst, self.verify_hash)
+        self._pending.append((src, dst, future))
+
+        # 完了したものを順に表示し、実行中のコピー数を制限する
+        self._drain(limit=self.workers * 2)
+
+    def wait(self) -> None:
+        """予約済みのコピーがすべて完了するまで待つ"""
+        self._drain(limit=0)
+
+    def close(self) -> None:
+        """残りのコピーを待ってスレッドプールを終了する"""
+        self.wait()
+        self._executor.shutdown()
+
+    def _drain(self, limit: int) -> None:
+        """完了したコピーを依頼順に表示する。未完了が limit 件を超える間は古いものから待つ"""
+        while self._pending:
+            src, dst, future = self._pending[0]
+            if not future.done() and len(self._pending) <= limit:
+                break
+            self._pending.popleft()
+            try:
+                future.result()
+            except Exception as e:
+                print(f"エラー: {src} を {dst} に転送できませんでした - {e}")
+                self.failed_count += 1
+            else:
+                print(f"転送: {src} -> {dst}")
+                self.copied_count += 1
+            self.reserved.discard(dst)
+
+    @staticmethod
+    def move_file(src: str, dst: str, verify_hash: bool = False) -> None:
+        """src を dst に移動する（デバイスをまたぐ場合はコピーしてから移動元を削除する）"""
+        try:
+            with Metrics.phase("fs.rename"):
+                os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            FileTransfer.copy_and_remove(src, dst, verify_hash)
+
+    @staticmethod
+    def copy_and_remove(src: str, dst: str, verify_hash: bool = False) -> None:
+        """
+        移動先のディレクトリ内の一時ファイルにコピーし、検証後に dst へ置いてから移動元を削除する
+        途中で失敗した場合は一時ファイルを削除し、移動元は残す
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst), prefix=FileTransfer.TEMP_PREFIX, suffix=".tmp")
+        try:
+            with Metrics.phase("fs.copy"), open(src, "rb") as fsrc, os.fdopen(fd, "wb") as fdst:
+                size = os.fstat(fsrc.fileno()).st_size
+                FileTransfer._copy_range(fsrc.fileno(), fdst.fileno(), size)
+                os.fsync(fdst.fileno())
+            shutil.copystat(src, tmp_path)
+
+            copied_size = os.path.getsize(tmp_path)
+            if copied_size != size or os.path.getsize(src) != size:
+                raise OSError(f"コピー後のサイズが一致しません ({size} -> {copied_size})")
+            if verify_hash and FileUtils.hash_file(src) != FileUtils.hash_file(tmp_path):
+                raise OSError("コピー後のハッシュが一致しません")
+
+            if os.path.lexists(dst):
+                raise FileExistsError(f"移動先が既に存在します: {dst}")
+            os.replace(tmp_path, dst)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        os.remove(src)
+
+    @staticmethod
+    def _copy_range(src_fd: int, dst_fd: int, size: int) -> None:
+        """copy_file_range、sendfile、read/write の順に使える方法で size バイトをコピーする"""
+        offset = 0
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                while offset < size:
+                    copied = os.copy_file_range(src_fd, dst_fd, min(size - offset, FileTransfer.COPY_CHUNK_SIZE),
+                                                offset, offset)
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError as e:
+                if e.errno not in FileTransfer._FALLBACK_ERRNOS:
+                    raise
+
+        # copy_file_range はファイル位置を進めないため、続きの位置に合わせる
+        os.lseek(dst_fd, offset, os.SEEK_SET)
+
+        if offset < size and hasattr(os, "sendfile"):
+            try:
+                while offset < size:
+                    copied = os.sendfile(dst_fd, src_fd, offset, min(size - offset, FileTransfer.COPY_CHUNK_SIZE))
+                    if copied == 0:
+                        break
+                    offset += copied
+            except OSError as e:
+                if e.errno not in FileTransfer._FALLBACK_ERRNOS:
+                    raise
+                os.lseek(dst_fd, offset, os.SEEK_SET)
+
+        if offset < size:
+            os.lseek(src_fd, offset, os.SEEK_SET)
+            while offset < size:
+                chunk = os.read(src_fd, min(size - offset, 1024 * 1024))
+                if not chunk:
+                    break
+                view = memoryview(chunk)
+                while view:
+                    view = view[os.write(dst_fd, view):]
+                offset += len(chunk)
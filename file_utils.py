@@ -1,8 +1,49 @@
+import functools
+import hashlib
 import os
 import re
 import unicodedata
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+
+class _NameCharTable(dict):
+    """
+    str.translate 用の変換表。normalize_name で残す文字（半角/全角英数）はそのまま、
+    それ以外はアンダースコアに変換する。初めて見た文字だけ判定して表に追加する
+    """
+    _KEEP = re.compile(r'[0-9A-Za-z\uFF10-\uFF19\uFF21-\uFF3A\uFF41-\uFF5A]')
+
+    def __missing__(self, code: int) -> str:
+        value = chr(code) if _NameCharTable._KEEP.match(chr(code)) else "_"
+        self[code] = value
+        return value
+
 
 class FileUtils:
+    CACHE_DIR_ENV = "IMAGECLASSIFICATION_CACHE_DIR"
+    NORMALIZE_CACHE_SIZE = 65536
+
+    # ASCII の範囲はあらかじめ変換表を作っておく
+    _NAME_CHAR_TABLE = _NameCharTable({code: chr(code) if chr(code).isascii() and chr(code).isalnum() else "_"
+                                       for code in range(128)})
+
+    @staticmethod
+    def get_cache_dir() -> str:
+        """キャッシュやインデックスを保存するディレクトリを返す（なければ作成する）"""
+        cache_dir = os.environ.get(FileUtils.CACHE_DIR_ENV) or os.path.join(
+            os.path.expanduser("~"), ".cache", "imageClassification")
+        os.makedirs(cache_dir, exist_ok=True)
+        return cache_dir
+
+    @staticmethod
+    def hash_file(path: str, algorithm: str = "sha256", chunk_size: int = 1024 * 1024) -> str:
+        """ファイル内容のハッシュ値を、ファイル全体をメモリに載せずに計算する"""
+        digest = hashlib.new(algorithm)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
     @staticmethod
     def normalize_name(name: str) -> str:
         """名前を正規化する共通関数"""
@@ -27,9 +68,59 @@ class FileUtils:
         return name
 
     @staticmethod
-    def ensure_unique_path(path: str, is_directory: bool = False) -> str:
-        """パスの一意性を確保する関数"""
-        if not os.path.exists(path):
+    def normalize_names(names: Iterable[str]) -> Tuple[List[str], Dict[str, List[str]]]:
+        """
+        ディレクトリ内の名前をまとめて正規化する（結果は normalize_name と同じ）
+        正規化後の名前のリストと、複数の異なる名前が同じ名前になった衝突グループ
+        {正規化後の名前: [元の名前, ...]} を返す
+        """
+        normalized = []
+        sources: Dict[str, Dict[str, None]] = {}
+        for name in names:
+            new_name = FileUtils._normalize_cached(name)
+            normalized.append(new_name)
+            sources.setdefault(new_name, {})[name] = None
+
+        collisions = {new_name: list(group) for new_name, group in sources.items() if len(group) > 1}
+        return normalized, collisions
+
+    @staticmethod
+    @functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+    def _normalize_cached(name: str) -> str:
+        """
+        normalize_name を正規表現の代わりに変換表で行う版（IMG_0001 のように繰り返し現れる名前はキャッシュする）
+        ASCII だけの名前は NFKC で変わらないため正規化を省く
+        """
+        if not name.isascii():
+            name = unicodedata.normalize('NFKC', name)
+        name = name.translate(FileUtils._NAME_CHAR_TABLE)
+
+        # 連続するアンダースコアをまとめ、先頭と末尾のアンダースコアを削除する
+        if "_" in name:
+            name = "_".join(part for part in name.split("_") if part)
+
+        return name.lower()
+
+    @staticmethod
+    def ensure_unique_path(path: str, is_directory: bool = False, source_path: Optional[str] = None,
+                           reserved: Optional[Set[str]] = None, sidecars: Sequence[str] = ()) -> str:
+        """
+        パスの一意性を確保する関数
+        source_path を渡した場合、大文字小文字の違いだけでそのファイル自身を指すパスは衝突とみなさない
+        reserved を渡した場合、まだ存在しないが使用予定のパス（転送中のファイルなど）も衝突とみなす
+        sidecars を渡した場合、それらを同じ名前（拡張子だけ異なる）で置く先も空いている名前を選ぶ
+        """
+        reserved = reserved or set()
+
+        def is_taken(candidate: str, source: Optional[str]) -> bool:
+            return ((os.path.exists(candidate) or candidate in reserved)
+                    and not FileUtils._is_same_path(candidate, source))
+
+        def is_group_taken(candidate: str) -> bool:
+            return is_taken(candidate, source_path) or any(
+                is_taken(FileUtils.sidecar_path(candidate, sidecar), sidecar) for sidecar in sidecars)
+
+        if not is_group_taken(path):
             return path
 
         directory, name = os.path.split(path)
@@ -43,10 +134,27 @@ class FileUtils:
         counter = 1
         new_path = path
 
-        # 同じパスが存在し、かつ大文字小文字の区別なしでも異なる場合は連番を付加
-        while os.path.exists(new_path) and os.path.normcase(path) != os.path.normcase(new_path):
+        # 同じパスが存在し、かつ移動元自身（大文字小文字の違いのみ）でない場合は連番を付加
+        while is_group_taken(new_path):
             new_name = f"{base}_{counter}{ext}"
             new_path = os.path.join(directory, new_name)
             counter += 1
 
         return new_path
+
+    @staticmethod
+    def sidecar_path(path: str, sidecar: str) -> str:
+        """path と同じ場所・同じ名前で、拡張子だけ sidecar のものにしたパスを返す（RAW+JPEG の組など）"""
+        return os.path.splitext(path)[0] + os.path.splitext(sidecar)[1]
+
+    @staticmethod
+    def _is_same_path(path: str, source_path: Optional[str]) -> bool:
+        """path が source_path と同じエントリを指しているかを判定する"""
+        if source_path is None:
+            return False
+        if os.path.normcase(path) == os.path.normcase(source_path):
+            return True
+        try:
+            return os.path.samefile(path, source_path)
+        except OSError:
+            return False
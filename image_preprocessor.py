@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import io
+import os
+import tempfile
+from PIL import Image, ImageOps
+from exif_cache import ExifCache
+from file_utils import FileUtils
+
+
+class ImagePreprocessor:
+    """
+    LLMに送る画像を長辺 max_edge 以内のJPEGに縮小して再エンコードする
+    JPEGはdraftモードでDCT段階から縮小して読むため、元画像全体をデコードしない
+    結果はファイルの同一性と縮小設定をキーにディスクへキャッシュする
+    """
+    DEFAULT_MAX_EDGE = 1024
+    DEFAULT_QUALITY = 85
+    CACHE_SUBDIR = "thumbnails"
+
+    @staticmethod
+    def get_payload(file_path: str, max_edge: int = DEFAULT_MAX_EDGE, quality: int = DEFAULT_QUALITY,
+                    use_cache: bool = True) -> bytes:
+        """縮小済みJPEGのバイト列を返す（キャッシュがあればそれを使う）"""
+        cache_path = None
+        if use_cache:
+            cache_path = ImagePreprocessor._get_cache_path(file_path, max_edge, quality)
+            try:
+                with open(cache_path, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+
+        payload = ImagePreprocessor.reduce_image(file_path, max_edge, quality)
+
+        if cache_path is not None:
+            ImagePreprocessor._write_cache(cache_path, payload)
+        return payload
+
+    @staticmethod
+    def encode_base64(file_path: str, max_edge: int = DEFAULT_MAX_EDGE, quality: int = DEFAULT_QUALITY,
+                      use_cache: bool = True) -> str:
+        """縮小済みJPEGをBase64文字列で返す"""
+        return base64.b64encode(ImagePreprocessor.get_payload(file_path, max_edge, quality, use_cache)).decode('utf-8')
+
+    @staticmethod
+    def reduce_image(file_path: str, max_edge: int = DEFAULT_MAX_EDGE, quality: int = DEFAULT_QUALITY) -> bytes:
+        """画像を長辺 max_edge 以内に縮小してJPEGにエンコードする"""
+        with Image.open(file_path) as img:
+            # JPEGの場合は 1/2, 1/4, 1/8 のスケールでデコードさせる
+            img.draft("RGB", (max_edge, max_edge))
+            img = ImageOps.exif_transpose(img)
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            img.thumbnail((max_edge, max_edge), Image.LANCZOS, reducing_gap=2.0)
+
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=quality, optimize=True)
+            return buffer.getvalue()
+
+    @staticmethod
+    def _get_cache_path(file_path: str, max_edge: int, quality: int) -> str:
+        """ファイルの同一性と縮小設定からキャッシュファイルのパスを決める"""
+        identity = ExifCache.file_identity(file_path)
+        key = "-".join(str(value) for value in identity + (max_edge, quality))
+        digest = hashlib.sha1(key.encode("ascii")).hexdigest()
+        return os.path.join(FileUtils.get_cache_dir(), ImagePreprocessor.CACHE_SUBDIR, digest[:2], f"{digest}.jpg")
+
+    @staticmethod
+    def _write_cache(cache_path: str, payload: bytes) -> None:
+        """一時ファイル経由でキャッシュを書き込む（並行実行時に途中のファイルを読ませない）"""
+        cache_dir = os.path.dirname(cache_path)
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(payload)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+from typing import Dict, List, Optional
+from exif_cache import ExifCache, FileIdentity
+from file_scanner import FileEntry
+from file_utils import FileUtils
+
+
+class IncrementalState:
+    """
+    差分実行用の状態ストア。操作とルートディレクトリごとに、前回処理を終えたファイルの
+    同一性 (デバイス, inode, サイズ, mtime_ns) をディレクトリ単位で記録する
+    同一性が前回と同じファイルは処理済みとして読み飛ばし、新しいファイルと変更されたファイルだけを処理対象にする
+    mtime が変わっていないディレクトリの列挙はスキャンインデックスから復元されるため、
+    変更のないディレクトリではファイルを開かずに stat と照合だけで済む
+    """
+    DB_NAME = "incremental_state.sqlite"
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, operation: str, root_dir: str, db_path: Optional[str] = None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.scope = f"{operation}:{self.root_dir}"
+        self.db_path = db_path or os.path.join(FileUtils.get_cache_dir(), IncrementalState.DB_NAME)
+        self.skipped_count = 0
+        self.changed_count = 0
+
+        # 処理対象として渡したが、まだ結果が記録されていないファイル
+        self._pending: Dict[str, FileIdentity] = {}
+        self._pending_writes = 0
+        self._db = sqlite3.connect(self.db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "scope TEXT, dir TEXT, name TEXT, dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "PRIMARY KEY (scope, dir, name)) WITHOUT ROWID")
+        self._db.commit()
+
+    def __enter__(self) -> "IncrementalState":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def filter_entries(self, directory: str, entries: List[FileEntry]) -> List[FileEntry]:
+        """
+        1つのディレクトリのファイルのうち、前回から変わっていないものを除いて返す
+        entries にはディレクトリ内の対象ファイルをすべて渡すこと（なくなったファイルの記録はここで削除する）
+        同一性は走査結果ではなく stat し直した値で比べる（上書きされたファイルを見逃さないため）
+        """
+        directory = os.path.abspath(directory)
+        recorded = {name: (dev, inode, size, mtime_ns) for name, dev, inode, size, mtime_ns in self._db.execute(
+            "SELECT name, dev, inode, size, mtime_ns FROM files WHERE scope = ? AND dir = ?",
+            (self.scope, directory))}
+
+        changed = []
+        for entry in entries:
+            try:
+                identity = ExifCache.file_identity(entry.path)
+            except OSError:
+                identity = (entry.dev, entry.inode, entry.size, entry.mtime_ns)
+            if recorded.pop(entry.name, None) == identity:
+                self.skipped_count += 1
+                continue
+            self._pending[entry.path] = identity
+            changed.append(entry)
+        self.changed_count += len(changed)
+
+        # 削除・移動されたファイルの記録
+        if recorded:
+            self._db.executemany("DELETE FROM files WHERE scope = ? AND dir = ? AND name = ?",
+                                 [(self.scope, directory, name) for name in recorded])
+            self._count_write(len(recorded))
+        return changed
+
+    def mark_done(self, path: str, new_path: Optional[str] = None) -> None:
+        """
+        処理を終えたファイルを記録し、次回から読み飛ばす
+        リネームした場合は new_path に新しいパスを渡す（ルートの外に移動した場合は記録しない）
+        """
+        identity = self._pending.pop(path, None)
+        if identity is None:
+            return
+
+        if new_path is not None:
+            self._delete(path)
+            new_path = os.path.abspath(new_path)
+            if os.path.commonpath([self.root_dir, new_path]) != self.root_dir:
+                return
+            path = new_path
+
+        path = os.path.abspath(path)
+        self._db.execute(
+            "INSERT OR REPLACE INTO files (scope, dir, name, dev, inode, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (self.scope, os.path.dirname(path), os.path.basename(path)) + identity)
+        self._count_write()
+
+    def discard(self, path: str) -> None:
+        """処理に失敗したファイルを記録せずに忘れる（次回もう一度処理される）"""
+        self._pending.pop(path, None)
+
+    def close(self) -> None:
+        """保存してデータベースを閉じる"""
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def _delete(self, path: str) -> None:
+        path = os.path.abspath(path)
+        self._db.execute("DELETE FROM files WHERE scope = ? AND dir = ? AND name = ?",
+                         (self.scope, os.path.dirname(path), os.path.basename(path)))
+        self._count_write()
+
+    def _count_write(self, count: int = 1) -> None:
+        self._pending_writes += count
+        if self._pending_writes >= IncrementalState.COMMIT_INTERVAL:
+            self._db.commit()
+            self._pending_writes = 0
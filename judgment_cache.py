@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from file_utils import FileUtils
+
+
+class JudgmentCache:
+    """
+    LLMによる関連性判定の結果を保存するSQLiteキャッシュ
+    キーは画像の内容ハッシュ・パス/EXIFの入力・モデル名・プロンプトのバージョンと、
+    送信する画像の縮小設定（長辺・JPEG品質）から作る
+    """
+    DB_NAME = "llm_judgments.sqlite"
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(FileUtils.get_cache_dir(), JudgmentCache.DB_NAME)
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS judgments ("
+            "key TEXT PRIMARY KEY, file_path TEXT, judgments TEXT, created_at REAL)")
+        self._db.commit()
+
+    def __enter__(self) -> "JudgmentCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def make_key(content_hash: str, path_parts: List[str], filename: str, exif_summary: Dict[str, Any],
+                 model: str, prompt_version: int, image_max_edge: int, image_quality: int) -> str:
+        """判定結果を一意に決める入力からキャッシュキーを作る（LLMに渡す画像が変わる縮小設定も含める）"""
+        material = json.dumps([content_hash, path_parts, filename, exif_summary, model, prompt_version,
+                               image_max_edge, image_quality], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        """保存済みの投票結果を返す。なければ None"""
+        with self._lock:
+            row = self._db.execute("SELECT judgments FROM judgments WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key: str, file_path: str, judgments: List[str]) -> None:
+        """投票結果を保存する"""
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO judgments (key, file_path, judgments, created_at) VALUES (?, ?, ?, ?)",
+                (key, file_path, json.dumps(judgments, ensure_ascii=False), time.time()))
+            self._db.commit()
+
+    def hit_rate(self) -> float:
+        """ヒット率（%）を返す"""
+        lookups = self.hits + self.misses
+        return self.hits / lookups * 100 if lookups else 0.0
+
+    def close(self) -> None:
+        """データベースを閉じる"""
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
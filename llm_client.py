@@ -0,0 +1,97 @@
+import http.client
+import json
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List
+from urllib.parse import urlsplit
+from metrics import Metrics
+
+
+class LLMError(Exception):
+    """LLMサーバーとの通信や応答形式に問題がある場合の例外"""
+
+
+class LLMClient:
+    """
+    OpenAI互換の /chat/completions エンドポイントを呼び出すクライアント
+    スレッドごとにKeep-Aliveの接続を使い回し、同時に送信するリクエスト数を max_in_flight に制限する
+    """
+    DEFAULT_BASE_URL = "http://localhost:1234/v1"
+    DEFAULT_MODEL = "gemma-3-4b-it"
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, model: str = DEFAULT_MODEL, api_key: str = "",
+                 max_in_flight: int = 4, timeout: float = 300.0):
+        parts = urlsplit(base_url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"未対応のURLです: {base_url}")
+
+        self.base_url = base_url
+        self.model = model
+        self.api_key = api_key
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+
+        self._scheme = parts.scheme
+        self._netloc = parts.netloc
+        self._path = parts.path.rstrip("/") + "/chat/completions"
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="llm")
+
+    def __enter__(self) -> "LLMClient":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """関数をリクエスト用スレッドで実行する（同時実行数は max_in_flight まで）"""
+        return self._executor.submit(fn, *args, **kwargs)
+
+    def chat(self, messages: List[Dict[str, Any]]) -> str:
+        """チャット補完を呼び出し、最初の選択肢の本文を返す"""
+        body = json.dumps({"model": self.model, "messages": messages}).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+
+        with Metrics.phase("llm.request"):
+            status, payload = self._post(body, headers)
+        if status != 200:
+            raise LLMError(f"HTTP {status}: {payload[:200].decode('utf-8', 'replace')}")
+
+        try:
+            return json.loads(payload)["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise LLMError(f"応答の形式が不正です: {e}") from e
+
+    def close(self) -> None:
+        """実行中のリクエストの完了を待ってスレッドを終了する"""
+        self._executor.shutdown(wait=True)
+
+    def _post(self, body: bytes, headers: Dict[str, str]) -> tuple:
+        """スレッドごとの接続でPOSTする。サーバー側で切断済みの接続は1回だけ張り直す"""
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection.request("POST", self._path, body=body, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                self._local.connection = None
+                if attempt == 1:
+                    raise
+            except Exception:
+                connection.close()
+                self._local.connection = None
+                raise
+
+    def _get_connection(self) -> http.client.HTTPConnection:
+        """現在のスレッドのKeep-Alive接続を返す（なければ作成）"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = (http.client.HTTPSConnection if self._scheme == "https"
+                                else http.client.HTTPConnection)
+            connection = connection_class(self._netloc, timeout=self.timeout)
+            self._local.connection = connection
+        return connection
@@ -0,0 +1,112 @@
+import argparse
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Sequence
+
+JUDGMENT_CATEGORIES = ("関連あり_一致", "関連あり_不一致_パス名不正", "関連あり_不一致_EXIF不正", "関連なし")
+
+
+class LLMStubServer:
+    """
+    localhost:1234/v1 のOpenAI互換サーバーを模した動作確認・ベンチマーク用のスタブ
+    応答は responses を順番に繰り返し、delay 秒だけ遅延させる
+    リクエスト数・同時に処理したリクエスト数の最大値・受け付けた接続数を記録する（クライアントの動作確認用）
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0,
+                 responses: Optional[Sequence[str]] = None):
+        self.delay = delay
+        self.request_count = 0
+        self.max_active = 0
+        self.connection_count = 0
+        self._active = 0
+        self._responses = itertools.cycle(responses or JUDGMENT_CATEGORIES[:1])
+        self._lock = threading.Lock()
+        self._thread = None
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connection_count += 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                with stub._lock:
+                    stub.request_count += 1
+                    stub._active += 1
+                    stub.max_active = max(stub.max_active, stub._active)
+                    content = next(stub._responses)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                with stub._lock:
+                    stub._active -= 1
+
+                body = json.dumps({
+                    "model": request.get("model", ""),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}}],
+                }, ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "LLMStubServer":
+        """バックグラウンドスレッドでサーバーを起動する"""
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """サーバーを停止する"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> "LLMStubServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルLLMサーバーのスタブを起動します")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--delay", type=float, default=0.0, help="1リクエストあたりの応答遅延（秒）")
+    parser.add_argument("--response", action="append", choices=JUDGMENT_CATEGORIES,
+                        help="返す判定（複数指定すると順番に繰り返す）")
+    args = parser.parse_args()
+
+    server = LLMStubServer(args.host, args.port, args.delay, args.response)
+    print(f"スタブサーバーを起動しました: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,271 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+from typing import Any, List, Optional
+from date_resolver import DateResolver
+from duplicate_finder import DuplicateFinder, DuplicateIndex
 from file_operations import FileOperations
 from file_reporter import FileReporter
+from file_scanner import FileScanner
+from file_transfer import FileTransfer
+from llm_client import LLMClient
+from metrics import Metrics
 from photo_operations import PhotoOperations
+from photo_pipeline import PhotoPipeline
+from photo_watcher import PhotoWatcher
+
+def _ask_workers() -> int:
+    return int(input("EXIF解析の並列ワーカー数を入力してください (デフォルト: 1): ") or "1")
+
+def _ask_dry_run() -> bool:
+    return input("変更せずに計画だけを表示しますか? (y/N): ").strip().lower() == "y"
+
+def _ask_duplicate_mode() -> Optional[str]:
+    mode = input("移動先に同じ内容の写真がある場合の処理 (skip/hardlink/report, 空欄で確認しない): ").strip()
+    return mode or None
+
+def build_parser() -> argparse.ArgumentParser:
+    """非対話モードのコマンドライン引数の定義"""
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--root", help="処理対象のルートディレクトリ（デフォルト: カレントディレクトリ）")
+    common.add_argument("--workers", type=int, default=1, help="EXIF解析・画像デコードの並列ワーカー数")
+    common.add_argument("--scan-threads", type=int, default=1,
+                        help="同時に列挙するディレクトリ数（NFS/SMB など遅延の大きいファイルシステム向け）")
+    common.add_argument("--scan-unordered", action="store_true",
+                        help="--scan-threads 使用時、走査順を保たずに列挙が終わったディレクトリから処理する")
+    common.add_argument("--format", choices=("text", "json"), default="text",
+                        help="結果の出力形式（json の場合、進捗は標準エラー出力に表示）")
+    common.add_argument("--metrics", help="フェーズごとの処理時間とカウンタをJSONで保存し、最後に集計表を表示")
+    common.add_argument("--profile", choices=Metrics.PROFILE_MODES,
+                        help="プロファイルも取る（cprofile: --metrics と同名の .prof に保存, sample: 集計に上位の関数を表示）")
+
+    parser = argparse.ArgumentParser(description="ファイルユーティリティ（引数なしで実行すると対話メニュー）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("remove-filemany", parents=[common], help="_filemany.simDBファイルを削除")
+
+    sub = subparsers.add_parser("report-extensions", parents=[common], help="ファイル拡張子レポート生成")
+    _add_extension_report_arguments(sub)
+
+    sub = subparsers.add_parser("sanitize-files", parents=[common], help="ファイル名を正規化")
+    sub.add_argument("--dry-run", action="store_true", help="変更せずに計画だけを表示")
+
+    sub = subparsers.add_parser("sanitize-dirs", parents=[common], help="ディレクトリ名を正規化")
+    sub.add_argument("--dry-run", action="store_true", help="変更せずに計画だけを表示")
+
+    sub = subparsers.add_parser("undo-rename", parents=[common], help="直前の名前の正規化を取り消す")
+    sub.add_argument("--journal", help="取り消すジャーナルファイル（デフォルト: 最新）")
+
+    sub = subparsers.add_parser("report-exif", parents=[common], help="写真EXIF情報レポート生成")
+    sub.add_argument("--output", default="exif_report.txt", help="レポートの出力先")
+    _add_incremental_argument(sub)
+
+    sub = subparsers.add_parser("report-exif-errors", parents=[common], help="撮影日情報がない写真の一覧を生成")
+    sub.add_argument("--output", default="exif_errors.txt", help="一覧の出力先")
+
+    sub = subparsers.add_parser("rename-photos", parents=[common], help="写真ファイル名に撮影日を追加")
+    _add_incremental_argument(sub)
+
+    sub = subparsers.add_parser("organize-photos", parents=[common], help="写真を撮影日に基づいて整理")
+    sub.add_argument("--target-dir", default="images", help="整理先のベースディレクトリ")
+    sub.add_argument("--report", help="写真ごとの撮影日・取得元・移動先をタブ区切りで出力するファイル")
+    _add_organize_arguments(sub)
+    _add_incremental_argument(sub)
+
+    sub = subparsers.add_parser("find-duplicates", parents=[common], help="内容が同じファイルを検出")
+    sub.add_argument("--output", default="duplicates.txt", help="レポートの出力先")
+    sub.add_argument("--hash-workers", type=int, default=DuplicateFinder.DEFAULT_WORKERS,
+                     help="ハッシュ計算の並列スレッド数")
+
+    sub = subparsers.add_parser("find-similar", parents=[common], help="リサイズ・再エンコードされた類似写真を検出")
+    sub.add_argument("--output", default="similar_photos.txt", help="レポートの出力先")
+    sub.add_argument("--max-distance", type=int, default=6, help="類似とみなすハミング距離の上限")
+    sub.add_argument("--hash", dest="hash_name", choices=("dhash", "phash"), default="phash",
+                     help="比較に使う知覚ハッシュ")
+
+    sub = subparsers.add_parser("analyze", parents=[common], help="パス名とEXIF情報の関連性分析")
+    sub.add_argument("--max-photos", type=int, default=100, help="分析する最大写真枚数")
+    sub.add_argument("--max-in-flight", type=int, default=4, help="同時に送信するLLMリクエスト数")
+    sub.add_argument("--base-url", default=LLMClient.DEFAULT_BASE_URL, help="LLMサーバーのURL")
+    sub.add_argument("--model", default=LLMClient.DEFAULT_MODEL, help="LLMのモデル名")
+    sub.add_argument("--force", action="store_true", help="判定済みの写真も再評価する")
+    sub.add_argument("--sample", action="store_true",
+                     help="走査順の先頭からではなく、ツリー全体から無作為に --max-photos 枚を抽出する")
+    sub.add_argument("--seed", type=int, default=0, help="--sample の乱数シード（同じ値なら同じ写真を抽出）")
+    sub.add_argument("--checkpoint", help="1枚ごとの結果を追記するJSONLファイル（同じファイルを指定すると続きから再開）")
+
+    sub = subparsers.add_parser("pipeline", parents=[common],
+                                help="複数の操作を1回の走査でまとめて実行（例: pipeline rename-photos organize-photos）")
+    sub.add_argument("steps", nargs="+", choices=PhotoPipeline.STEP_NAMES, metavar="STEP",
+                     help=f"実行する操作（{', '.join(PhotoPipeline.STEP_NAMES)}）")
+    sub.add_argument("--target-dir", default="images", help="organize-photos の整理先")
+    _add_organize_arguments(sub)
+    sub.add_argument("--exif-report", default="exif_report.txt", help="report-exif の出力先")
+    sub.add_argument("--exif-errors", default="exif_errors.txt", help="report-exif-errors の出力先")
+    _add_extension_report_arguments(sub)
+
+    sub = subparsers.add_parser("watch", parents=[common],
+                                help="取り込み用ディレクトリを監視し、届いた写真を撮影日で整理し続ける")
+    sub.add_argument("--target-dir", default="images", help="整理先のベースディレクトリ")
+    sub.add_argument("--rename", action="store_true", help="整理の前にファイル名の先頭に撮影日を追加する")
+    _add_organize_arguments(sub)
+    sub.add_argument("--settle", type=float, default=PhotoWatcher.DEFAULT_SETTLE,
+                     help="書き込みが終わったとみなすまでに、サイズと更新日時が変わらない秒数")
+    sub.add_argument("--batch-size", type=int, default=PhotoWatcher.DEFAULT_BATCH_SIZE,
+                     help="一度にまとめて処理する写真の最大数")
+    sub.add_argument("--max-pending", type=int, default=PhotoWatcher.DEFAULT_MAX_PENDING,
+                     help="書き込み完了を待つファイルを保持する最大数（超えた分は後から走査し直して拾う）")
+    sub.add_argument("--polling", action="store_true", help="inotify を使わずに一定間隔で走査する")
+    sub.add_argument("--poll-interval", type=float, default=PhotoWatcher.DEFAULT_POLL_INTERVAL,
+                     help="走査で監視する場合の間隔（秒）")
+    sub.add_argument("--stats-file", help="待機数・処理数・スループットを書き出すJSONファイル"
+                                          "（デフォルト: キャッシュディレクトリの watch_status.json）")
+    sub.add_argument("--status-port", type=int, help="指定すると 127.0.0.1 のこのポートで状態のJSONを返す")
+    sub.add_argument("--duration", type=float, help="指定した秒数で監視を終える（デフォルト: 止めるまで続ける）")
+
+    sub = subparsers.add_parser("query", parents=[common],
+                                help="メタデータインデックスから写真を検索（例: query --date 2019-03 --make Canon）")
+    sub.add_argument("--date", help="撮影日の年・年月・日付（例: 2019, 2019-03, 2019-03-15）")
+    sub.add_argument("--from", dest="date_from", help="この日付以降に撮影された写真")
+    sub.add_argument("--to", dest="date_to", help="この日付までに撮影された写真")
+    sub.add_argument("--make", help="カメラのメーカー（大文字小文字を区別しない）")
+    sub.add_argument("--model", help="カメラのモデル（大文字小文字を区別しない）")
+    sub.add_argument("--dir", dest="directory", help="このディレクトリ以下の写真")
+    sub.add_argument("--no-date", action="store_true", help="撮影日情報がない写真")
+    sub.add_argument("--limit", type=int, help="表示する最大件数")
+    sub.add_argument("--count", action="store_true", help="件数だけを表示")
+    sub.add_argument("--refresh", action="store_true", help="検索の前に --root 以下の写真をインデックスに反映する")
+
+    return parser
+
+def _add_extension_report_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--max-files", type=int, default=50, help="ファイル一覧を表示する拡張子の最大件数")
+    parser.add_argument("--json", dest="output_json", help="拡張子レポートのJSON出力先")
+    parser.add_argument("--csv", dest="output_csv", help="拡張子レポートのCSV出力先")
+
+def _add_organize_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--duplicates", choices=DuplicateIndex.MODES,
+                        help="移動先に同じ内容の写真がある場合の処理（skip: 移動しない, "
+                             "hardlink: 移動元をハードリンクに置換, report: 報告のみ）")
+    parser.add_argument("--transfer-workers", type=int, default=FileTransfer.DEFAULT_WORKERS,
+                        help="整理先が別のデバイスの場合に並列に行うコピーの数")
+    parser.add_argument("--verify-hash", action="store_true",
+                        help="別のデバイスへのコピー後、移動元を削除する前にハッシュを照合する")
+    parser.add_argument("--date-sources", type=_parse_date_sources, default=DateResolver.DEFAULT_SOURCES,
+                        help=f"撮影日を試す取得元の順序（カンマ区切り、{', '.join(DateResolver.SOURCES)} から選択、"
+                             f"デフォルト: {','.join(DateResolver.DEFAULT_SOURCES)}）")
+
+def _parse_date_sources(value: str) -> List[str]:
+    sources = [source.strip() for source in value.split(",") if source.strip()]
+    unknown = [source for source in sources if source not in DateResolver.SOURCES]
+    if unknown or not sources:
+        raise argparse.ArgumentTypeError(f"未対応の取得元です: {value}")
+    return sources
+
+def _add_incremental_argument(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--incremental", action="store_true",
+                        help="前回の実行以降に追加・変更された写真だけを処理する")
+
+def run_command(args: argparse.Namespace) -> Any:
+    """解析済みの引数に従って操作を実行し、その戻り値を返す"""
+    if args.command == "remove-filemany":
+        return FileOperations.remove_filemany_files(args.root)
+    if args.command == "report-extensions":
+        return FileReporter.report_file_extensions(args.root, args.max_files, args.output_json, args.output_csv)
+    if args.command == "sanitize-files":
+        return FileOperations.sanitize_filenames(args.root, dry_run=args.dry_run)
+    if args.command == "sanitize-dirs":
+        return FileOperations.sanitize_directories(args.root, dry_run=args.dry_run)
+    if args.command == "undo-rename":
+        return FileOperations.undo_last_rename(args.journal)
+    if args.command == "report-exif":
+        return PhotoOperations.report_exif(args.root, args.output, workers=args.workers,
+                                           incremental=args.incremental)
+    if args.command == "report-exif-errors":
+        return PhotoOperations.report_exif_errors(args.root, args.output, workers=args.workers)
+    if args.command == "rename-photos":
+        return PhotoOperations.rename_photos_with_date(args.root, workers=args.workers,
+                                                       incremental=args.incremental)
+    if args.command == "organize-photos":
+        return PhotoOperations.organize_photos_by_date(args.root, args.target_dir, workers=args.workers,
+                                                       duplicate_mode=args.duplicates,
+                                                       transfer_workers=args.transfer_workers,
+                                                       verify_hash=args.verify_hash,
+                                                       incremental=args.incremental,
+                                                       date_sources=args.date_sources, report_file=args.report)
+    if args.command == "find-duplicates":
+        return DuplicateFinder.report_duplicates(args.root, args.output, workers=args.hash_workers)
+    if args.command == "find-similar":
+        return PhotoOperations.report_similar_photos(args.root, args.output, max_distance=args.max_distance,
+                                                     hash_name=args.hash_name, workers=args.workers)
+    if args.command == "analyze":
+        return PhotoOperations.analyze_photo_path_exif_correlation(
+            args.root, max_photos=args.max_photos, max_in_flight=args.max_in_flight,
+            base_url=args.base_url, model=args.model, force_reevaluate=args.force,
+            sample=args.sample, seed=args.seed, checkpoint=args.checkpoint)
+    if args.command == "pipeline":
+        steps = PhotoPipeline.create_steps(args.steps, args.root, target_base_dir=args.target_dir,
+                                           duplicate_mode=args.duplicates,
+                                           transfer_workers=args.transfer_workers, verify_hash=args.verify_hash,
+                                           date_sources=args.date_sources,
+                                           exif_report=args.exif_report, exif_errors=args.exif_errors,
+                                           max_files_to_show=args.max_files, output_json=args.output_json,
+                                           output_csv=args.output_csv)
+        return PhotoPipeline.run(steps, args.root, workers=args.workers)
+    if args.command == "watch":
+        watcher = PhotoWatcher(args.root or os.getcwd(), args.target_dir, rename=args.rename, workers=args.workers,
+                               duplicate_mode=args.duplicates, transfer_workers=args.transfer_workers,
+                               verify_hash=args.verify_hash, date_sources=args.date_sources, settle=args.settle,
+                               batch_size=args.batch_size, max_pending=args.max_pending,
+                               poll_interval=args.poll_interval, polling=args.polling, stats_file=args.stats_file,
+                               status_port=args.status_port)
+        watcher.install_signal_handlers()
+        return watcher.run(args.duration)
+    if args.command == "query":
+        if args.refresh:
+            PhotoOperations.update_photo_index(args.root, workers=args.workers)
+        return PhotoOperations.query_photos(date=args.date, date_from=args.date_from, date_to=args.date_to,
+                                            make=args.make, model=args.model, directory=args.directory,
+                                            no_date=args.no_date, limit=args.limit, count_only=args.count)
+    raise ValueError(f"未対応のコマンドです: {args.command}")
+
+def run_cli(argv: List[str]) -> int:
+    """非対話モードで実行する"""
+    args = build_parser().parse_args(argv)
+    FileScanner.configure(args.scan_threads, ordered=not args.scan_unordered)
+
+    if args.format == "json":
+        # 結果のJSONだけを標準出力に出し、進捗表示は標準エラー出力に回す
+        with contextlib.redirect_stdout(sys.stderr):
+            result = _run_with_metrics(args)
+        json.dump({"command": args.command, "result": result}, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        _run_with_metrics(args)
+    return 0
+
+def _run_with_metrics(args: argparse.Namespace) -> Any:
+    """--metrics / --profile が指定されていれば計測しながら実行する"""
+    if not args.metrics and not args.profile:
+        return run_command(args)
+
+    Metrics.enable(args.profile)
+    try:
+        with Metrics.phase("total"):
+            return run_command(args)
+    finally:
+        Metrics.disable()
+        Metrics.write_json(args.metrics or "metrics.json")
+        Metrics.print_summary()
+        print(f"計測結果が {args.metrics or 'metrics.json'} に保存されました")
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return run_cli(argv)
 
-def main():
     print("ファイルユーティリティ - 選択してください:")
     print("1: _filemany.simDBファイルを削除")
     print("2: ファイル拡張子レポート生成")
@@ -12,28 +275,46 @@ def main():
     print("6: 写真ファイル名に撮影日を追加")
     print("7: 写真を撮影日に基づいて整理")
     print("8: パス名とEXIF情報の関連性分析")
+    print("9: 直前のファイル名/ディレクトリ名の正規化を取り消す")
+    print("10: 内容が同じファイルを検出")
+    print("11: 類似した写真を検出")
+    print("12: フォルダを監視し、届いた写真を撮影日に基づいて整理")
 
-    choice = input("選択 (1-8): ")
+    choice = input("選択 (1-12): ")
 
     if choice == "1":
         FileOperations.remove_filemany_files()
     elif choice == "2":
         FileReporter.report_file_extensions()
     elif choice == "3":
-        FileOperations.sanitize_filenames()
+        FileOperations.sanitize_filenames(dry_run=_ask_dry_run())
     elif choice == "4":
-        FileOperations.sanitize_directories()
+        FileOperations.sanitize_directories(dry_run=_ask_dry_run())
     elif choice == "5":
-        PhotoOperations.report_exif()
+        PhotoOperations.report_exif(workers=_ask_workers())
     elif choice == "6":
-        PhotoOperations.rename_photos_with_date()
+        PhotoOperations.rename_photos_with_date(workers=_ask_workers())
     elif choice == "7":
-        PhotoOperations.organize_photos_by_date()
+        PhotoOperations.organize_photos_by_date(workers=_ask_workers(), duplicate_mode=_ask_duplicate_mode())
     elif choice == "8":
         max_photos = int(input("分析する最大写真枚数を入力してください (デフォルト: 100): ") or "100")
-        PhotoOperations.analyze_photo_path_exif_correlation(max_photos=max_photos)
+        force = input("判定済みの写真も再評価しますか? (y/N): ").strip().lower() == "y"
+        sample = input("ツリー全体から無作為に抽出しますか? (y/N): ").strip().lower() == "y"
+        PhotoOperations.analyze_photo_path_exif_correlation(max_photos=max_photos, force_reevaluate=force,
+                                                            sample=sample)
+    elif choice == "9":
+        FileOperations.undo_last_rename()
+    elif choice == "10":
+        DuplicateFinder.report_duplicates()
+    elif choice == "11":
+        max_distance = int(input("類似とみなすハミング距離の上限を入力してください (デフォルト: 6): ") or "6")
+        PhotoOperations.report_similar_photos(max_distance=max_distance, workers=_ask_workers())
+    elif choice == "12":
+        watcher = PhotoWatcher(os.getcwd(), workers=_ask_workers(), duplicate_mode=_ask_duplicate_mode())
+        watcher.install_signal_handlers()
+        watcher.run()
     else:
         print("無効な選択です。")
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
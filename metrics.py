@@ -0,0 +1,209 @@
+import cProfile
+import collections
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class LatencyHistogram:
+    """
+    処理時間をマイクロ秒単位の2のべき乗のバケットで集計するヒストグラム
+    バケット i には [2^(i-1), 2^i) マイクロ秒の値が入る
+    """
+    BUCKETS = 40
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * LatencyHistogram.BUCKETS
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        index = min(int(seconds * 1_000_000).bit_length(), LatencyHistogram.BUCKETS - 1)
+        self.buckets[index] += 1
+
+    def percentile(self, fraction: float) -> float:
+        """値が入っているバケットの上限から、パーセンタイルの近似値（秒）を返す"""
+        threshold = self.count * fraction
+        cumulative = 0
+        for index, bucket_count in enumerate(self.buckets):
+            cumulative += bucket_count
+            if cumulative >= threshold and bucket_count:
+                return min((1 << index) / 1_000_000, self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_sec": round(self.total, 6),
+            "mean_ms": round(self.total / self.count * 1000, 4) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 4),
+            "p95_ms": round(self.percentile(0.95) * 1000, 4),
+            "p99_ms": round(self.percentile(0.99) * 1000, 4),
+            "max_ms": round(self.max * 1000, 4),
+            "buckets_us": {f"<{1 << index}": count for index, count in enumerate(self.buckets) if count},
+        }
+
+
+class _Phase:
+    """有効時に phase() が返す計測用のコンテキストマネージャ"""
+    __slots__ = ("name", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self) -> "_Phase":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        Metrics.record(self.name, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """
+    フェーズごとの処理時間のヒストグラムとカウンタを集計する、全モジュール共通の計測層
+    無効時の phase() は共有の空のコンテキストマネージャを返すだけなので、計測コードを残したままでも負荷はほぼない
+    親プロセスで実行された処理だけが集計される（プロセスプールのワーカー内の処理は含まれない）
+    """
+    PROFILE_MODES = ("cprofile", "sample")
+    SAMPLE_INTERVAL = 0.005
+    IDLE_MODULES = ("threading.py", "queue.py", "thread.py", "selectors.py")
+
+    enabled = False
+
+    _lock = threading.Lock()
+    _histograms: Dict[str, LatencyHistogram] = {}
+    _counters: Dict[str, int] = collections.Counter()
+    _started = 0.0
+    _profiler = None
+    _sampler = None
+    _samples: Dict[str, int] = collections.Counter()
+    _null_phase = contextlib.nullcontext()
+
+    @staticmethod
+    def enable(profile: Optional[str] = None) -> None:
+        """計測を開始する。profile に "cprofile" または "sample" を指定するとプロファイルも取る"""
+        if profile is not None and profile not in Metrics.PROFILE_MODES:
+            raise ValueError(f"未対応のプロファイルモードです: {profile}")
+        Metrics.reset()
+        Metrics.enabled = True
+        Metrics._started = time.perf_counter()
+
+        if profile == "cprofile":
+            Metrics._profiler = cProfile.Profile()
+            Metrics._profiler.enable()
+        elif profile == "sample":
+            Metrics._sampler = threading.Thread(target=Metrics._sample_loop, daemon=True)
+            Metrics._sampler.start()
+
+    @staticmethod
+    def disable() -> None:
+        """計測とプロファイルを停止する（集計結果は残る）"""
+        Metrics.enabled = False
+        if Metrics._profiler is not None:
+            Metrics._profiler.disable()
+        if Metrics._sampler is not None:
+            Metrics._sampler.join()
+            Metrics._sampler = None
+
+    @staticmethod
+    def reset() -> None:
+        with Metrics._lock:
+            Metrics._histograms = {}
+            Metrics._counters = collections.Counter()
+            Metrics._samples = collections.Counter()
+            Metrics._profiler = None
+
+    @staticmethod
+    def phase(name: str):
+        """with Metrics.phase("exif.header"): のように処理時間を計測する"""
+        if not Metrics.enabled:
+            return Metrics._null_phase
+        return _Phase(name)
+
+    @staticmethod
+    def record(name: str, seconds: float) -> None:
+        """計測済みの処理時間を記録する"""
+        with Metrics._lock:
+            histogram = Metrics._histograms.get(name)
+            if histogram is None:
+                histogram = Metrics._histograms[name] = LatencyHistogram()
+            histogram.add(seconds)
+
+    @staticmethod
+    def count(name: str, value: int = 1) -> None:
+        """カウンタを加算する"""
+        if Metrics.enabled:
+            with Metrics._lock:
+                Metrics._counters[name] += value
+
+    @staticmethod
+    def to_dict() -> Dict[str, Any]:
+        """集計結果を辞書で返す"""
+        wall = time.perf_counter() - Metrics._started if Metrics._started else 0.0
+        with Metrics._lock:
+            result = {
+                "wall_sec": round(wall, 6),
+                "phases": {name: histogram.to_dict() for name, histogram in sorted(Metrics._histograms.items())},
+                "counters": dict(sorted(Metrics._counters.items())),
+            }
+            if Metrics._samples:
+                total = sum(Metrics._samples.values())
+                result["samples"] = [
+                    {"function": function, "samples": count, "percent": round(count / total * 100, 2)}
+                    for function, count in Metrics._samples.most_common(50)]
+        return result
+
+    @staticmethod
+    def write_json(output_file: str) -> None:
+        """集計結果をJSONで保存する。cProfile の結果は同じ名前の .prof に保存する"""
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(Metrics.to_dict(), f, ensure_ascii=False, indent=2)
+        if Metrics._profiler is not None:
+            Metrics._profiler.dump_stats(os.path.splitext(output_file)[0] + ".prof")
+
+    @staticmethod
+    def print_summary(file=None) -> None:
+        """フェーズごとの集計結果を1画面に収まる表で表示する"""
+        file = file or sys.stdout
+        data = Metrics.to_dict()
+        wall = data["wall_sec"]
+        phases = sorted(data["phases"].items(), key=lambda item: item[1]["total_sec"], reverse=True)
+
+        print(f"計測結果 (経過時間 {wall:.3f}秒)", file=file)
+        print(f"{'phase':<24}{'count':>10}{'total_s':>10}{'%':>7}{'mean_ms':>10}{'p50_ms':>10}{'p95_ms':>10}"
+              f"{'p99_ms':>10}{'max_ms':>10}", file=file)
+        for name, phase in phases[:20]:
+            share = phase["total_sec"] / wall * 100 if wall else 0.0
+            print(f"{name:<24}{phase['count']:>10}{phase['total_sec']:>10.3f}{share:>7.1f}{phase['mean_ms']:>10.3f}"
+                  f"{phase['p50_ms']:>10.3f}{phase['p95_ms']:>10.3f}{phase['p99_ms']:>10.3f}"
+                  f"{phase['max_ms']:>10.3f}", file=file)
+
+        if data["counters"]:
+            print("カウンタ: " + ", ".join(f"{name}={value}" for name, value in data["counters"].items()), file=file)
+        for sample in data.get("samples", [])[:10]:
+            print(f"  サンプル {sample['percent']:>6.2f}%  {sample['function']}", file=file)
+
+    @staticmethod
+    def _sample_loop() -> None:
+        """全スレッドの実行中の関数を一定間隔で記録するサンプリングプロファイラ"""
+        own_id = threading.get_ident()
+        while Metrics.enabled:
+            time.sleep(Metrics.SAMPLE_INTERVAL)
+            frames: List = [frame for thread_id, frame in sys._current_frames().items() if thread_id != own_id]
+            with Metrics._lock:
+                for frame in frames:
+                    code = frame.f_code
+                    # 仕事を待っているだけのスレッドは数えない
+                    if os.path.basename(code.co_filename) in Metrics.IDLE_MODULES:
+                        continue
+                    Metrics._samples[f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"] += 1
@@ -0,0 +1,314 @@
+import hashlib
+import itertools
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Sequence, Tuple
+from PIL import Image, ImageOps
+from file_scanner import FileScanner
+from file_utils import FileUtils
+
+try:
+    import numpy as np
+except ImportError:  # 類似画像の検出を使わない場合は numpy は不要
+    np = None
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tif', '.tiff', '.webp')
+
+
+class PerceptualHasher:
+    """
+    縮小デコードした画像から64ビットの知覚ハッシュ (dHash / pHash) をバッチ単位でまとめて計算する
+    JPEGはdraftモードでDCT段階から縮小して読むため、元画像全体をデコードしない
+    """
+    DHASH_SIZE = (9, 8)
+    PHASH_SIZE = 32
+    PHASH_LOW_FREQUENCY = 8
+    BATCH_SIZE = 256
+
+    _dct_matrix = None
+
+    @staticmethod
+    def require_numpy() -> None:
+        """numpy がなければ分かりやすいエラーを送出する"""
+        if np is None:
+            raise RuntimeError("類似画像の検出には numpy が必要です (pip install numpy)")
+
+    @staticmethod
+    def load_gray(file_path: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """dHash用 (8x9) と pHash用 (32x32) のグレースケール画像を返す"""
+        size = PerceptualHasher.PHASH_SIZE
+        with Image.open(file_path) as img:
+            img.draft("L", (size * 2, size * 2))
+            img = ImageOps.exif_transpose(img).convert("L")
+            dhash_pixels = np.asarray(img.resize(PerceptualHasher.DHASH_SIZE, Image.BILINEAR), dtype=np.int16)
+            phash_pixels = np.asarray(img.resize((size, size), Image.BILINEAR), dtype=np.float32)
+        return dhash_pixels, phash_pixels
+
+    @staticmethod
+    def dhash(pixels: "np.ndarray") -> "np.ndarray":
+        """(N, 8, 9) の画素配列から、横に隣り合う画素の大小で dHash を計算する"""
+        return PerceptualHasher._pack_bits(pixels[:, :, 1:] > pixels[:, :, :-1])
+
+    @staticmethod
+    def phash(pixels: "np.ndarray") -> "np.ndarray":
+        """(N, 32, 32) の画素配列から、低周波のDCT係数と中央値の大小で pHash を計算する"""
+        dct = PerceptualHasher._get_dct_matrix()
+        coefficients = dct @ pixels @ dct.T
+        low = PerceptualHasher.PHASH_LOW_FREQUENCY
+        low_frequency = coefficients[:, :low, :low].reshape(len(pixels), -1)
+        # 直流成分は画像全体の明るさなので中央値の計算から除く
+        median = np.median(low_frequency[:, 1:], axis=1)
+        return PerceptualHasher._pack_bits(low_frequency > median[:, None])
+
+    @staticmethod
+    def hash_batch(file_paths: Sequence[str]) -> List[Tuple[Optional[int], Optional[int], Optional[str]]]:
+        """
+        複数の画像の (dHash, pHash, エラー) を入力順に返す
+        ハッシュ計算はバッチ全体でベクトル化して行う（プロセスプールのワーカーからも呼ばれる）
+        """
+        results = [(None, None, None)] * len(file_paths)
+        loaded = []
+        dhash_pixels = []
+        phash_pixels = []
+        for i, file_path in enumerate(file_paths):
+            try:
+                small, large = PerceptualHasher.load_gray(file_path)
+            except Exception as e:
+                results[i] = (None, None, str(e))
+                continue
+            loaded.append(i)
+            dhash_pixels.append(small)
+            phash_pixels.append(large)
+
+        if loaded:
+            dhashes = PerceptualHasher.dhash(np.stack(dhash_pixels)).tolist()
+            phashes = PerceptualHasher.phash(np.stack(phash_pixels)).tolist()
+            for i, dhash, phash in zip(loaded, dhashes, phashes):
+                results[i] = (dhash, phash, None)
+        return results
+
+    @staticmethod
+    def iter_hashes(file_paths: Sequence[str], workers: int = 1) -> Iterator[Tuple[str, Optional[int],
+                                                                                   Optional[int], Optional[str]]]:
+        """(パス, dHash, pHash, エラー) を入力順に返す（workers > 1 ではプロセスプールで並列に計算）"""
+        PerceptualHasher.require_numpy()
+        batch_size = PerceptualHasher.BATCH_SIZE
+        batches = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+
+        if workers <= 1:
+            results = map(PerceptualHasher.hash_batch, batches)
+            for batch, batch_results in zip(batches, results):
+                for file_path, result in zip(batch, batch_results):
+                    yield (file_path,) + result
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for batch, batch_results in zip(batches, executor.map(PerceptualHasher.hash_batch, batches)):
+                for file_path, result in zip(batch, batch_results):
+                    yield (file_path,) + result
+
+    @staticmethod
+    def popcount(values: "np.ndarray") -> "np.ndarray":
+        """符号なし整数配列の要素ごとの立っているビット数を返す"""
+        if hasattr(np, "bitwise_count"):
+            return np.bitwise_count(values).astype(np.int64)
+        values = np.ascontiguousarray(values)
+        table = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+        return table[values.view(np.uint8)].reshape(len(values), -1).sum(axis=1)
+
+    @staticmethod
+    def _pack_bits(bits: "np.ndarray") -> "np.ndarray":
+        """(N, 8, 8) の真偽値配列を先頭のビットを最上位とする uint64 に詰める"""
+        packed = np.packbits(bits.reshape(len(bits), 64), axis=1)
+        return packed.view(">u8").reshape(-1).astype(np.uint64)
+
+    @staticmethod
+    def _get_dct_matrix() -> "np.ndarray":
+        """DCT-II の変換行列（初回だけ作成する）"""
+        if PerceptualHasher._dct_matrix is None:
+            size = PerceptualHasher.PHASH_SIZE
+            k = np.arange(size)[:, None]
+            n = np.arange(size)[None, :]
+            PerceptualHasher._dct_matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)).astype(np.float32)
+        return PerceptualHasher._dct_matrix
+
+
+class PerceptualHashIndex:
+    """
+    ルートディレクトリ以下の画像の知覚ハッシュを配列で保持するインデックス
+    パスと同一性 (デバイス, inode, サイズ, mtime_ns) も保存し、更新時は変更された画像だけを再計算する
+    ハミング距離 k 以内のペアは multi-index hashing で探すため、全ペアの比較は行わない
+    """
+    INDEX_VERSION = 1
+    HASH_NAMES = ("dhash", "phash")
+
+    # 64ビットのハッシュを16ビットずつ4つのチャンクに分けて検索する
+    MIH_CHUNKS = 4
+    MIH_CHUNK_BITS = 16
+
+    # 1回にまとめて距離を計算する候補ペア数の上限（メモリ使用量を抑える）
+    MAX_CANDIDATES = 1 << 22
+
+    def __init__(self, paths: List[str], identities: "np.ndarray", dhashes: "np.ndarray", phashes: "np.ndarray"):
+        self.paths = paths
+        self.identities = identities
+        self.hashes = {"dhash": dhashes, "phash": phashes}
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @staticmethod
+    def get_index_path(root_dir: str) -> str:
+        """ルートディレクトリごとのインデックスファイルのパスを返す"""
+        digest = hashlib.sha1(os.path.abspath(root_dir).encode("utf-8", "surrogateescape")).hexdigest()
+        return os.path.join(FileUtils.get_cache_dir(), f"phash_{digest}.npz")
+
+    @staticmethod
+    def load(index_path: str) -> Optional["PerceptualHashIndex"]:
+        """保存済みのインデックスを読み込む（なければ、または形式が古ければ None）"""
+        PerceptualHasher.require_numpy()
+        try:
+            with np.load(index_path) as data:
+                if int(data["version"]) != PerceptualHashIndex.INDEX_VERSION:
+                    return None
+                encoded = data["paths"].tobytes().decode("utf-8", "surrogateescape")
+                return PerceptualHashIndex(encoded.split("\0") if encoded else [], data["identities"],
+                                           data["dhash"], data["phash"])
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def save(self, index_path: str) -> None:
+        """一時ファイル経由でインデックスを保存する"""
+        encoded = "\0".join(self.paths).encode("utf-8", "surrogateescape")
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, version=np.array(PerceptualHashIndex.INDEX_VERSION),
+                         paths=np.frombuffer(encoded, dtype=np.uint8), identities=self.identities,
+                         dhash=self.hashes["dhash"], phash=self.hashes["phash"])
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def build(root_dir: str, workers: int = 1,
+              previous: Optional["PerceptualHashIndex"] = None) -> "PerceptualHashIndex":
+        """
+        ルートディレクトリ以下の画像のインデックスを作成する
+        previous があれば、同一性が変わっていない画像のハッシュはそのまま引き継ぐ
+        """
+        PerceptualHasher.require_numpy()
+        reusable = {}
+        if previous is not None:
+            reusable = {path: i for i, path in enumerate(previous.paths)}
+
+        paths = []
+        identities = []
+        dhashes = []
+        phashes = []
+        pending = {}
+
+        for entry in FileScanner.iter_files(root_dir):
+            if entry.ext not in IMAGE_EXTENSIONS:
+                continue
+            identity = (entry.dev, entry.inode, entry.size, entry.mtime_ns)
+            i = reusable.get(entry.path)
+            if i is not None and tuple(previous.identities[i].tolist()) == identity:
+                paths.append(entry.path)
+                identities.append(identity)
+                dhashes.append(int(previous.hashes["dhash"][i]))
+                phashes.append(int(previous.hashes["phash"][i]))
+            else:
+                pending[entry.path] = identity
+
+        for file_path, dhash, phash, error in PerceptualHasher.iter_hashes(list(pending), workers):
+            if error is not None:
+                print(f"画像を読み込めません: {file_path} - {error}")
+                continue
+            paths.append(file_path)
+            identities.append(pending[file_path])
+            dhashes.append(dhash)
+            phashes.append(phash)
+
+        print(f"インデックス済みの画像: {len(paths)}枚 (新たにハッシュを計算: {len(pending)}枚)")
+        return PerceptualHashIndex(paths, np.array(identities, dtype=np.uint64).reshape(-1, 4),
+                                   np.array(dhashes, dtype=np.uint64), np.array(phashes, dtype=np.uint64))
+
+    @staticmethod
+    def update(root_dir: str, workers: int = 1) -> "PerceptualHashIndex":
+        """保存済みのインデックスを更新して保存し、更新後のインデックスを返す"""
+        index_path = PerceptualHashIndex.get_index_path(root_dir)
+        index = PerceptualHashIndex.build(root_dir, workers, PerceptualHashIndex.load(index_path))
+        index.save(index_path)
+        return index
+
+    def find_pairs(self, max_distance: int = 6, hash_name: str = "phash") -> Iterator[Tuple[int, int, int]]:
+        """
+        ハミング距離が max_distance 以内の画像のペア (i, j, 距離) を返す (i < j)
+        ハッシュを4つのチャンクに分けると、距離 k 以内のペアはいずれかのチャンクの距離が k // 4 以内になる
+        各チャンクの値で整列した配列を二分探索し、その近傍だけを候補として距離を確認する
+        """
+        if hash_name not in PerceptualHashIndex.HASH_NAMES:
+            raise ValueError(f"未対応のハッシュです: {hash_name}")
+
+        hashes = self.hashes[hash_name]
+        count = len(hashes)
+        chunk_bits = PerceptualHashIndex.MIH_CHUNK_BITS
+        radius = max_distance // PerceptualHashIndex.MIH_CHUNKS
+        chunk_mask = np.uint64((1 << chunk_bits) - 1)
+        chunks = [((hashes >> np.uint64(64 - chunk_bits * (c + 1))) & chunk_mask).astype(np.uint16)
+                  for c in range(PerceptualHashIndex.MIH_CHUNKS)]
+
+        # チャンク内で距離 radius 以内になる値との差分
+        flips = [np.uint16(sum(1 << bit for bit in bits))
+                 for r in range(radius + 1) for bits in itertools.combinations(range(chunk_bits), r)]
+
+        queries = np.arange(count)
+        for c, values in enumerate(chunks):
+            order = np.argsort(values, kind="stable")
+            sorted_values = values[order]
+            for flip in flips:
+                targets = values ^ flip
+                lo = np.searchsorted(sorted_values, targets, side="left")
+                counts = np.searchsorted(sorted_values, targets, side="right") - lo
+
+                for start, end in PerceptualHashIndex._split_by_total(counts):
+                    rows, cols = PerceptualHashIndex._expand(queries[start:end], lo[start:end],
+                                                             counts[start:end], order)
+                    keep = cols > rows
+                    rows, cols = rows[keep], cols[keep]
+
+                    # 前のチャンクで既に候補になったペアは除く
+                    for earlier in chunks[:c]:
+                        keep = PerceptualHasher.popcount(earlier[rows] ^ earlier[cols]) > radius
+                        rows, cols = rows[keep], cols[keep]
+
+                    distances = PerceptualHasher.popcount(hashes[rows] ^ hashes[cols])
+                    keep = distances <= max_distance
+                    yield from zip(rows[keep].tolist(), cols[keep].tolist(), distances[keep].tolist())
+
+    @staticmethod
+    def _split_by_total(counts: "np.ndarray") -> Iterator[Tuple[int, int]]:
+        """候補数の合計が MAX_CANDIDATES 前後になるように検索元の範囲を区切る"""
+        totals = np.cumsum(counts)
+        start = 0
+        while start < len(counts):
+            base = totals[start - 1] if start else 0
+            end = int(np.searchsorted(totals, base + PerceptualHashIndex.MAX_CANDIDATES, side="right"))
+            end = max(end, start + 1)
+            yield start, end
+            start = end
+
+    @staticmethod
+    def _expand(queries: "np.ndarray", lo: "np.ndarray", counts: "np.ndarray",
+                order: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """各検索元について、整列済み配列の [lo, lo + count) にある要素との組を展開する"""
+        total = int(counts.sum())
+        rows = np.repeat(queries, counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        cols = order[np.repeat(lo, counts) + offsets]
+        return rows, cols
+
@@ -0,0 +1,279 @@
+import atexit
+import datetime
+import os
+import re
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from exif_cache import ExifCache, FileIdentity
+from file_scanner import FileEntry
+from file_utils import FileUtils
+from metrics import Metrics
+
+
+class PhotoIndex:
+    """
+    写真のパスごとに撮影日時・メーカー・モデルを保存する検索用のメタデータインデックス (SQLite)
+    撮影日時、メーカーとモデル、ディレクトリに索引があり、アーカイブ全体を走査せずに検索できる
+    各行にはファイルの同一性 (デバイス, inode, サイズ, mtime_ns) を記録し、変わっていない写真は再解析しない
+    """
+    DB_NAME = "photo_index.sqlite"
+    COMMIT_INTERVAL = 1000
+
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.path.join(FileUtils.get_cache_dir(), PhotoIndex.DB_NAME)
+        self._pending_writes = 0
+        self._db = sqlite3.connect(self.db_path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS photos ("
+            "path TEXT PRIMARY KEY, dir TEXT, name TEXT, dev INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "taken_at TEXT, datetime_original TEXT, make TEXT COLLATE NOCASE, model TEXT COLLATE NOCASE, "
+            "has_gps INTEGER)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS photos_dir ON photos(dir)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS photos_taken_at ON photos(taken_at)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS photos_camera ON photos(make, model)")
+        self._db.commit()
+
+    @staticmethod
+    def get_default() -> "PhotoIndex":
+        """プロセス共通のインデックスを返す（終了時に自動で保存される）"""
+        with PhotoIndex._default_lock:
+            if PhotoIndex._default is None:
+                PhotoIndex._default = PhotoIndex()
+                atexit.register(PhotoIndex._default.close)
+            return PhotoIndex._default
+
+    def sync_directory(self, directory: str, entries: List[FileEntry]) -> Dict[str, Dict[str, Any]]:
+        """
+        1つのディレクトリの写真をインデックスと照合し、同一性が変わっていない写真の EXIF 情報を
+        {ファイル名: EXIF情報} で返す。entries にないファイルの記録は削除する
+        記録と一致した写真は stat し直した同一性でも確かめる（走査結果だけを信用しない）
+        """
+        directory = os.path.abspath(directory)
+        rows = self._db.execute(
+            "SELECT name, dev, inode, size, mtime_ns, datetime_original, make, model, has_gps "
+            "FROM photos WHERE dir = ?", (directory,)).fetchall()
+
+        names = {entry.name: (entry.dev, entry.inode, entry.size, entry.mtime_ns) for entry in entries}
+        fresh = {}
+        missing = []
+        for name, dev, inode, size, mtime_ns, datetime_original, make, model, has_gps in rows:
+            identity = names.get(name)
+            if identity is None:
+                missing.append((os.path.join(directory, name),))
+            elif identity == (dev, inode, size, mtime_ns) and \
+                    PhotoIndex._current_identity(os.path.join(directory, name)) == identity:
+                fresh[name] = PhotoIndex._to_exif(datetime_original, make, model)
+
+        if missing:
+            self._db.executemany("DELETE FROM photos WHERE path = ?", missing)
+            self._count_write(len(missing))
+        return fresh
+
+    def put(self, path: str, identity: FileIdentity, exif_data: Dict[str, Any]) -> None:
+        """写真のEXIF情報を記録する"""
+        path = os.path.abspath(path)
+        datetime_original = exif_data.get("DateTimeOriginal")
+        datetime_original = datetime_original if isinstance(datetime_original, str) else None
+        self._db.execute(
+            "INSERT OR REPLACE INTO photos (path, dir, name, dev, inode, size, mtime_ns, taken_at, "
+            "datetime_original, make, model, has_gps) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, os.path.dirname(path), os.path.basename(path)) + tuple(identity) + (
+                PhotoIndex._normalize_date(datetime_original), datetime_original,
+                PhotoIndex._clean_text(exif_data.get("Make")), PhotoIndex._clean_text(exif_data.get("Model")),
+                int("GPSInfo" in exif_data)))
+        self._count_write()
+
+    def remove(self, path: str) -> None:
+        """写真の記録を削除する"""
+        self._db.execute("DELETE FROM photos WHERE path = ?", (os.path.abspath(path),))
+        self._count_write()
+
+    def query(self, date: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+              make: Optional[str] = None, model: Optional[str] = None, directory: Optional[str] = None,
+              no_date: bool = False, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        条件に合う写真を撮影日時順に返す
+        date は "2019"、"2019-03"、"2019-03-15" のような年・年月・日付で、その期間に撮影された写真を返す
+        date_from / date_to は同じ形式の期間の始まりと終わり（両端を含む）
+        make / model は大文字小文字を区別せずに一致するもの、directory はそのディレクトリ以下の写真
+        no_date=True で撮影日情報がない写真を返す
+        """
+        conditions, params = self._build_conditions(date, date_from, date_to, make, model, directory, no_date)
+        sql = "SELECT path, datetime_original, make, model FROM photos"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY taken_at, path"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        with Metrics.phase("photo_index.query"):
+            rows = self._db.execute(sql, params).fetchall()
+        return [{"path": path, "date": datetime_original, "make": make, "model": model}
+                for path, datetime_original, make, model in rows]
+
+    def count(self, date: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+              make: Optional[str] = None, model: Optional[str] = None, directory: Optional[str] = None,
+              no_date: bool = False) -> int:
+        """query() と同じ条件に合う写真の枚数を返す"""
+        conditions, params = self._build_conditions(date, date_from, date_to, make, model, directory, no_date)
+        sql = "SELECT COUNT(*) FROM photos"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        with Metrics.phase("photo_index.query"):
+            return self._db.execute(sql, params).fetchone()[0]
+
+    def close(self) -> None:
+        """保存してデータベースを閉じる"""
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def _build_conditions(date: Optional[str], date_from: Optional[str], date_to: Optional[str],
+                          make: Optional[str], model: Optional[str], directory: Optional[str],
+                          no_date: bool) -> Tuple[List[str], List[Any]]:
+        """検索条件を WHERE 句の条件とパラメータに変換する（いずれも索引を使える形にする）"""
+        conditions = []
+        params = []
+        if date:
+            start, end = PhotoIndex._date_range(date)
+            conditions.append("taken_at >= ? AND taken_at < ?")
+            params += [start, end]
+        if date_from:
+            conditions.append("taken_at >= ?")
+            params.append(PhotoIndex._date_range(date_from)[0])
+        if date_to:
+            conditions.append("taken_at < ?")
+            params.append(PhotoIndex._date_range(date_to)[1])
+        if no_date:
+            conditions.append("taken_at IS NULL")
+        if make:
+            conditions.append("make = ?")
+            params.append(make.strip())
+        if model:
+            conditions.append("model = ?")
+            params.append(model.strip())
+        if directory:
+            # "dir LIKE 'x/%'" は索引を使えないため、範囲の比較で配下のディレクトリを表す
+            directory = os.path.abspath(directory)
+            conditions.append("(dir = ? OR (dir >= ? AND dir < ?))")
+            params += [directory, directory + os.sep, directory + chr(ord(os.sep) + 1)]
+        return conditions, params
+
+    @staticmethod
+    def _date_range(value: str) -> Tuple[str, str]:
+        """年・年月・日付の文字列を、taken_at と比較できる期間 [開始, 終了) に変換する"""
+        try:
+            parts = [int(part) for part in re.split(r"[-/:.]", value.strip()) if part]
+            if len(parts) == 3:
+                start = datetime.date(parts[0], parts[1], parts[2])
+                end = start + datetime.timedelta(days=1)
+            elif len(parts) == 2:
+                start = datetime.date(parts[0], parts[1], 1)
+                end = datetime.date(parts[0] + parts[1] // 12, parts[1] % 12 + 1, 1)
+            elif len(parts) == 1:
+                start = datetime.date(parts[0], 1, 1)
+                end = datetime.date(parts[0] + 1, 1, 1)
+            else:
+                raise ValueError(value)
+        except ValueError:
+            raise ValueError(f"日付の形式が不正です: {value}（例: 2019, 2019-03, 2019-03-15）") from None
+        return start.isoformat(), end.isoformat()
+
+    @staticmethod
+    def _normalize_date(datetime_original: Optional[str]) -> Optional[str]:
+        """EXIFの "YYYY:MM:DD HH:MM:SS" を並べ替え・範囲検索できる "YYYY-MM-DD HH:MM:SS" にする（不正なら None）"""
+        if not datetime_original:
+            return None
+        try:
+            return datetime.datetime.strptime(datetime_original.strip(), '%Y:%m:%d %H:%M:%S').isoformat(" ")
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _clean_text(value: Any) -> Optional[str]:
+        """EXIFの文字列の末尾のNULや空白を取り除く"""
+        if not isinstance(value, str):
+            return None
+        return value.strip("\x00 ") or None
+
+    @staticmethod
+    def _current_identity(path: str) -> Optional[FileIdentity]:
+        """ファイルの現在の同一性を返す（stat できなければ None）"""
+        try:
+            return ExifCache.file_identity(path)
+        except OSError:
+            return None
+
+    @staticmethod
+    def _to_exif(datetime_original: Optional[str], make: Optional[str], model: Optional[str]) -> Dict[str, Any]:
+        """記録から extract_exif と同じ形の辞書を作る（GPSInfo は有無しか記録しないため含めない）"""
+        exif_data = {}
+        if datetime_original is not None:
+            exif_data["DateTimeOriginal"] = datetime_original
+        if make is not None:
+            exif_data["Make"] = make
+        if model is not None:
+            exif_data["Model"] = model
+        return exif_data
+
+    def _count_write(self, count: int = 1) -> None:
+        self._pending_writes += count
+        if self._pending_writes >= PhotoIndex.COMMIT_INTERVAL:
+            self._db.commit()
+            self._pending_writes = 0
+
+
+class PhotoIndexUpdater:
+    """
+    走査中の写真をディレクトリ単位でインデックスと照合し、iter_exif の lookup に記録済みの EXIF 情報を渡す
+    解析した写真は record() で、移動・リネームした写真は forget() でインデックスに反映する
+    """
+
+    def __init__(self, index: Optional[PhotoIndex] = None):
+        self.index = index or PhotoIndex.get_default()
+        self.hits = 0
+        self.misses = 0
+        self._directory_hits: Dict[str, Dict[str, Any]] = {}
+        self._known: Dict[str, Dict[str, Any]] = {}
+        self._identities: Dict[str, FileIdentity] = {}
+
+    def begin_directory(self, directory: str, entries: List[FileEntry]) -> None:
+        """ディレクトリ内の写真をすべて渡して照合する（なくなった写真の記録は削除される）"""
+        self._directory_hits = self.index.sync_directory(directory, entries)
+
+    def expect(self, entry: FileEntry) -> None:
+        """begin_directory() で渡した写真のうち、これから iter_exif に渡すものを登録する"""
+        exif_data = self._directory_hits.get(entry.name)
+        if exif_data is not None:
+            self._known[entry.path] = exif_data
+            self.hits += 1
+        else:
+            self._identities[entry.path] = (entry.dev, entry.inode, entry.size, entry.mtime_ns)
+            self.misses += 1
+
+    def lookup(self, path: str) -> Optional[Dict[str, Any]]:
+        """インデックスに記録済みで解析が不要な写真の EXIF 情報を返す"""
+        return self._known.pop(path, None)
+
+    def record(self, path: str, exif_data: Dict[str, Any]) -> None:
+        """解析した写真の EXIF 情報を記録する（記録済みだった写真は何もしない）"""
+        identity = self._identities.pop(path, None)
+        if identity is not None:
+            self.index.put(path, identity, exif_data)
+
+    def release(self, path: str) -> None:
+        """記録せずに処理を終えた写真を忘れる（インデックスの記録はそのまま残す）"""
+        self._known.pop(path, None)
+        self._identities.pop(path, None)
+
+    def forget(self, path: str) -> None:
+        """移動・リネームされた写真の記録を削除する"""
+        self._known.pop(path, None)
+        self._identities.pop(path, None)
+        self.index.remove(path)
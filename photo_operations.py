@@ -1,55 +1,293 @@
 import os
-import re
 import datetime
-from typing import Dict, List, Tuple, Optional, Any
+import contextlib
+import heapq
+import itertools
+import json
+import random
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AbstractSet, Dict, List, Tuple, Optional, Any, Sequence, Iterable, Iterator, Callable
 from PIL import Image, ExifTags
-import openai
-import base64
 from collections import Counter
+from date_resolver import DateResolver
+from duplicate_finder import DuplicateFinder, DuplicateIndex
+from exif_cache import ExifCache
+from exif_reader import ExifReader
+from file_scanner import FileEntry, FileScanner
+from file_transfer import FileTransfer
 from file_utils import FileUtils
+from image_preprocessor import ImagePreprocessor
+from incremental_state import IncrementalState
+from judgment_cache import JudgmentCache
+from llm_client import LLMClient
+from metrics import Metrics
+from perceptual_hash import PerceptualHashIndex
+from photo_index import PhotoIndex, PhotoIndexUpdater
 
 class PhotoOperations:
+    # 並列モードで1ワーカーあたりに一度に割り当てるファイル数
+    EXIF_BATCH_SIZE = 256
+
+    # EXIFの撮影日を読める写真の拡張子（RAW+JPEG などの組では、この並び順で先のものを代表にする）
+    PHOTO_EXTENSIONS = ('.jpg', '.jpeg', '.heic', '.heif', '.png', '.tif', '.tiff',
+                        '.dng', '.cr2', '.nef', '.nrw', '.arw', '.orf', '.rw2', '.pef', '.srw')
+
+    # 単独では処理しないが、同じ名前の写真と一緒にリネーム・移動するサイドカー
+    SIDECAR_EXTENSIONS = ('.cr3', '.raf', '.xmp')
+
+    # rename_photos_with_date が付ける "pYYYY-MM-DD_HH-MM-SS_" 形式の接頭辞
+    DATE_PREFIX_PATTERN = DateResolver.PREFIX_PATTERN
+
+    # 関連性分析の最大判定回数と、判定を打ち切る票数
+    LLM_VOTES = 5
+    LLM_MAJORITY = 3
+
+    # プロンプトを変更した場合は上げて、判定キャッシュを無効にする
+    LLM_PROMPT_VERSION = 1
+
+    # 抽出モードで撮影日がない写真の分を見込んで、max_photos の何倍の候補を保持するか
+    SAMPLE_OVERSAMPLING = 2
+
     @staticmethod
-    def extract_exif(file_path: str) -> Dict[str, Any]:
-        """画像ファイルからEXIF情報を抽出する関数"""
-        exif_data = {}
+    def extract_exif(file_path: str, tags: Optional[Sequence[str]] = ExifReader.DEFAULT_TAGS,
+                     use_cache: bool = True) -> Dict[str, Any]:
+        """
+        画像ファイルからEXIF情報を抽出する関数
+        tags を指定した場合はヘッダーのみを読む ExifReader で指定タグだけを取得し、
+        構造が不正なファイルや未対応のタグのみ Pillow で読み直す。
+        tags=None の場合は Pillow で全タグを取得する
+        tags 指定時は ExifCache を参照し、変更のないファイルは再解析しない
+        """
+        exif_data, error = PhotoOperations._extract_exif_result(file_path, tags, use_cache)
+        if error:
+            print(f"EXIF抽出エラー: {file_path} - {error}")
+        return exif_data
+
+    @staticmethod
+    def _extract_exif_result(file_path: str, tags: Optional[Sequence[str]],
+                             use_cache: bool = True) -> Tuple[Dict[str, Any], Optional[str]]:
+        """EXIF情報とエラーメッセージの組を返す（プロセスプールのワーカーからも呼ばれる）"""
         try:
-            with Image.open(file_path) as img:
-                raw_exif = img._getexif()
-                if raw_exif:
-                    for tag_id, value in raw_exif.items():
-                        tag_name = ExifTags.TAGS.get(tag_id, str(tag_id))
-                        exif_data[tag_name] = value
+            if tags is None or not use_cache:
+                return PhotoOperations._read_exif(file_path, tags), None
+
+            cache = ExifCache.get_default()
+            identity = ExifCache.file_identity(file_path)
+            exif_data = cache.get(file_path, identity, tags)
+            if exif_data is None:
+                exif_data = PhotoOperations._read_exif(file_path, tags)
+                cache.put(file_path, identity, tags, exif_data)
+            return exif_data, None
         except Exception as e:
-            print(f"EXIF抽出エラー: {file_path} - {e}")
+            return {}, str(e)
+
+    @staticmethod
+    def iter_exif(file_paths: Iterable[str], workers: int = 1,
+                  tags: Sequence[str] = ExifReader.DEFAULT_TAGS,
+                  lookup: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None
+                  ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        ファイルパスとEXIF情報の組を入力順に返す
+        workers > 1 の場合はキャッシュにないファイルの解析をプロセスプールにバッチ単位で振り分ける
+        キャッシュの読み書きとエラー表示は親プロセスで行うため、出力は逐次処理と同じ順序になる
+        lookup を渡した場合は、lookup が EXIF 情報を返したファイルを解析せずにその結果を使う
+        """
+        if workers <= 1:
+            for file_path in file_paths:
+                exif_data = lookup(file_path) if lookup is not None else None
+                if exif_data is None:
+                    exif_data = PhotoOperations.extract_exif(file_path, tags)
+                yield file_path, exif_data
+            return
+
+        cache = ExifCache.get_default()
+        path_iter = iter(file_paths)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            while True:
+                batch = list(itertools.islice(path_iter, PhotoOperations.EXIF_BATCH_SIZE * workers))
+                if not batch:
+                    break
+
+                results = [({}, None)] * len(batch)
+                identities = {}
+                pending = []
+                for i, file_path in enumerate(batch):
+                    known = lookup(file_path) if lookup is not None else None
+                    if known is not None:
+                        results[i] = (known, None)
+                        continue
+                    try:
+                        identities[i] = ExifCache.file_identity(file_path)
+                    except OSError as e:
+                        results[i] = ({}, str(e))
+                        continue
+                    cached = cache.get(file_path, identities[i], tags)
+                    if cached is None:
+                        pending.append(i)
+                    else:
+                        results[i] = (cached, None)
+
+                chunk_size = max(1, len(pending) // (workers * 4))
+                pending_paths = [batch[i] for i in pending]
+                for i, result in zip(pending, executor.map(PhotoOperations._extract_exif_result, pending_paths,
+                                                           itertools.repeat(tags), itertools.repeat(False),
+                                                           chunksize=chunk_size)):
+                    if result[1] is None:
+                        cache.put(batch[i], identities[i], tags, result[0])
+                    results[i] = result
+
+                for file_path, (exif_data, error) in zip(batch, results):
+                    if error:
+                        print(f"EXIF抽出エラー: {file_path} - {error}")
+                    yield file_path, exif_data
+
+    @staticmethod
+    def _iter_photo_paths(root_dir: str, state: Optional[IncrementalState] = None,
+                          sidecars: Optional[Dict[str, List[str]]] = None,
+                          updater: Optional[PhotoIndexUpdater] = None) -> Iterator[str]:
+        """
+        ツリー内の写真のパスを走査順に返す
+        state を渡した場合は、前回の実行から変わっていないファイルを除く
+        sidecars を渡した場合は RAW+JPEG などの組の代表だけを返し、残りのパスを sidecars[代表のパス] に入れる
+        updater を渡した場合は、ディレクトリごとにメタデータインデックスと照合し、返す写真を updater に登録する
+        """
+        for root, _, entries in FileScanner.walk_entries(root_dir):
+            if sidecars is None:
+                photos = [(entry, []) for entry in entries if entry.ext in PhotoOperations.PHOTO_EXTENSIONS]
+            else:
+                photos = PhotoOperations.group_sidecars(entries)
+
+            if updater is not None:
+                updater.begin_directory(root, [entry for entry in entries
+                                               if entry.ext in PhotoOperations.PHOTO_EXTENSIONS])
+
+            if state is not None:
+                changed = {entry.path for entry in state.filter_entries(root, [photo for photo, _ in photos])}
+                photos = [(photo, group) for photo, group in photos if photo.path in changed]
+
+            for photo, group in photos:
+                if group:
+                    sidecars[photo.path] = [entry.path for entry in group]
+                if updater is not None:
+                    updater.expect(photo)
+                yield photo.path
+
+    @staticmethod
+    def _iter_indexed_exif(root_dir: str, workers: int = 1,
+                           state: Optional[IncrementalState] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        ツリー内の写真のパスとEXIF情報の組を走査順に返す
+        メタデータインデックスの記録が新しい写真は解析せずに記録を使い、それ以外は解析してインデックスを更新する
+        """
+        updater = PhotoIndexUpdater()
+        photo_paths = PhotoOperations._iter_photo_paths(root_dir, state, updater=updater)
+        for file_path, exif_data in PhotoOperations.iter_exif(photo_paths, workers, lookup=updater.lookup):
+            updater.record(file_path, exif_data)
+            yield file_path, exif_data
+
+        Metrics.count("photo_index.hit", updater.hits)
+        Metrics.count("photo_index.miss", updater.misses)
+        print(f"メタデータインデックス: 記録済み {updater.hits}件 / 解析 {updater.misses}件")
+
+    @staticmethod
+    def group_sidecars(entries: List[FileEntry]) -> List[Tuple[FileEntry, List[FileEntry]]]:
+        """
+        1つのディレクトリの写真を拡張子を除いた名前で組にし、
+        (代表, サイドカーのリスト) のリストを返す。代表は PHOTO_EXTENSIONS の並び順で最初の形式のファイル
+        代表になれる写真がない組（CR3 だけなど）は含めない
+        名前の大文字小文字は区別する（IMG_1.JPG と img_1.JPG を組にすると、リネーム後に同じ名前になってしまう）
+        """
+        groups: Dict[str, List[FileEntry]] = {}
+        for entry in entries:
+            if entry.ext in PhotoOperations.PHOTO_EXTENSIONS or entry.ext in PhotoOperations.SIDECAR_EXTENSIONS:
+                groups.setdefault(os.path.splitext(entry.name)[0], []).append(entry)
+
+        result = []
+        for group in groups.values():
+            photos = [entry for entry in group if entry.ext in PhotoOperations.PHOTO_EXTENSIONS]
+            if not photos:
+                continue
+            primary = min(photos, key=lambda entry: PhotoOperations.PHOTO_EXTENSIONS.index(entry.ext))
+            result.append((primary, [entry for entry in group if entry is not primary]))
+        return result
+
+    @staticmethod
+    def _read_exif(file_path: str, tags: Optional[Sequence[str]]) -> Dict[str, Any]:
+        """キャッシュを使わずにEXIF情報を読み込む（読み込みエラーは例外として送出する）"""
+        if tags is not None:
+            try:
+                with Metrics.phase("exif.header"):
+                    return ExifReader.read_tags(file_path, tags)
+            except ValueError:
+                # ExifFormatError（不正な構造・未対応の形式）と未対応タグの指定
+                Metrics.count("exif.pillow_fallback")
+
+        exif_data = {}
+        with Metrics.phase("exif.pillow"), Image.open(file_path) as img:
+            # _getexif() は JPEG 系の形式にしかない
+            raw_exif = img._getexif() if hasattr(img, "_getexif") else None
+            if raw_exif:
+                for tag_id, value in raw_exif.items():
+                    tag_name = ExifTags.TAGS.get(tag_id, str(tag_id))
+                    if tags is None or tag_name in tags:
+                        exif_data[tag_name] = value
 
         return exif_data
 
     @staticmethod
-    def report_exif(root_dir: Optional[str] = None, output_file: str = "exif_report.txt") -> int:
-        """JPEG画像の撮影日情報を収集してファイルに出力する関数"""
+    def _print_cache_stats() -> None:
+        """EXIFキャッシュのヒット率を表示する"""
+        stats = ExifCache.get_default().stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / lookups * 100 if lookups else 0
+        print(f"EXIFキャッシュ: ヒット {stats['hits']}件 / ミス {stats['misses']}件 ({hit_rate:.1f}%), "
+              f"無効化 {stats['invalidated']}件, 削除 {stats['evicted']}件")
+
+    @staticmethod
+    def _open_state(operation: str, root_dir: str, incremental: bool):
+        """incremental=True なら差分実行の状態ストアを、そうでなければ None を返すコンテキストマネージャを返す"""
+        if not incremental:
+            return contextlib.nullcontext()
+        return IncrementalState(operation, root_dir)
+
+    @staticmethod
+    def _print_incremental_stats(state: Optional[IncrementalState]) -> None:
+        """差分実行で読み飛ばしたファイル数を表示する"""
+        if state is not None:
+            print(f"差分実行: 新規・変更 {state.changed_count}件 / 前回から変更なし {state.skipped_count}件")
+
+    @staticmethod
+    def report_exif(root_dir: Optional[str] = None, output_file: str = "exif_report.txt", workers: int = 1,
+                    incremental: bool = False) -> int:
+        """
+        写真の撮影日情報を収集してファイルに出力する関数
+        incremental=True の場合は、前回の実行以降に追加・変更された写真だけを出力する
+        """
         root_dir = root_dir or os.getcwd()
         photo_count = 0
 
-        with open(output_file, "w", encoding="utf-8") as f:
-            for root, _, files in os.walk(root_dir):
-                for filename in files:
-                    if filename.lower().endswith(('.jpg', '.jpeg')):
-                        file_path = os.path.join(root, filename)
-                        exif_data = PhotoOperations.extract_exif(file_path)
-
-                        if "DateTimeOriginal" in exif_data:
-                            f.write(f"{file_path} -> {exif_data['DateTimeOriginal']}\n")
-                            photo_count += 1
+        with PhotoOperations._open_state("report-exif", root_dir, incremental) as state, \
+                open(output_file, "w", encoding="utf-8") as f:
+            for file_path, exif_data in PhotoOperations._iter_indexed_exif(root_dir, workers, state):
+                if "DateTimeOriginal" in exif_data:
+                    f.write(f"{file_path} -> {exif_data['DateTimeOriginal']}\n")
+                    photo_count += 1
+                if state is not None:
+                    state.mark_done(file_path)
 
+        PhotoOperations._print_incremental_stats(state)
         print(f"撮影日情報が見つかった写真: {photo_count}枚")
         print(f"レポートが {output_file} に保存されました")
+        PhotoOperations._print_cache_stats()
 
         return photo_count
 
     @staticmethod
-    def report_exif_errors(root_dir: Optional[str] = None, output_file: str = "exif_errors.txt") -> int:
-        """JPEG画像のうち、EXIF撮影日情報がないファイルのリストを出力する関数"""
+    def report_exif_errors(root_dir: Optional[str] = None, output_file: str = "exif_errors.txt",
+                           workers: int = 1) -> int:
+        """写真のうち、EXIF撮影日情報がないファイルのリストを出力する関数"""
         root_dir = root_dir or os.getcwd()
         error_count = 0
         total_photos = 0
@@ -59,251 +297,660 @@ class PhotoOperations:
             f.write(f"# 生成日時: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write(f"# 検索対象: {root_dir}\n\n")
 
-            for root, _, files in os.walk(root_dir):
-                for filename in files:
-                    if filename.lower().endswith(('.jpg', '.jpeg')):
-                        total_photos += 1
-                        file_path = os.path.join(root, filename)
-                        exif_data = PhotoOperations.extract_exif(file_path)
+            for file_path, exif_data in PhotoOperations._iter_indexed_exif(root_dir, workers):
+                total_photos += 1
 
-                        if "DateTimeOriginal" not in exif_data:
-                            # 撮影日情報がない場合のみ記録
-                            f.write(f"{file_path}\n")
-                            error_count += 1
+                if "DateTimeOriginal" not in exif_data:
+                    # 撮影日情報がない場合のみ記録
+                    f.write(f"{file_path}\n")
+                    error_count += 1
 
         print(f"写真ファイル総数: {total_photos}枚")
         print(f"撮影日情報がない写真: {error_count}枚 ({(error_count/total_photos*100 if total_photos > 0 else 0):.2f}%)")
         print(f"エラーリストが {output_file} に保存されました")
+        PhotoOperations._print_cache_stats()
 
         return error_count
 
     @staticmethod
-    def rename_photos_with_date(root_dir: Optional[str] = None) -> int:
-        """JPG/JPEGファイルの名前の先頭にEXIF撮影日を追加する関数"""
+    def update_photo_index(root_dir: Optional[str] = None, workers: int = 1) -> int:
+        """ツリー内の写真をメタデータインデックスに反映し、写真の枚数を返す（変わっていない写真は解析しない）"""
+        root_dir = root_dir or os.getcwd()
+        photo_count = sum(1 for _ in PhotoOperations._iter_indexed_exif(root_dir, workers))
+        print(f"インデックスを更新しました: {root_dir} ({photo_count}枚)")
+        return photo_count
+
+    @staticmethod
+    def query_photos(date: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None,
+                     make: Optional[str] = None, model: Optional[str] = None, directory: Optional[str] = None,
+                     no_date: bool = False, limit: Optional[int] = None, count_only: bool = False):
+        """
+        メタデータインデックスから条件に合う写真を検索して表示する
+        写真を走査しないため、結果はインデックスを最後に更新した時点（レポート・パイプライン・--refresh）のもの
+        """
+        index = PhotoIndex.get_default()
+        conditions = dict(date=date, date_from=date_from, date_to=date_to, make=make, model=model,
+                          directory=directory, no_date=no_date)
+        if count_only:
+            count = index.count(**conditions)
+            print(f"該当する写真: {count}枚")
+            return count
+
+        photos = index.query(limit=limit, **conditions)
+        for photo in photos:
+            print("\t".join(value or "-" for value in (photo["path"], photo["date"], photo["make"], photo["model"])))
+        print(f"該当する写真: {len(photos)}枚")
+        return photos
+
+    @staticmethod
+    def rename_photos_with_date(root_dir: Optional[str] = None, workers: int = 1, incremental: bool = False) -> int:
+        """
+        写真ファイルの名前の先頭にEXIF撮影日を追加する関数
+        RAW+JPEG などの同じ名前の組は、代表の写真の撮影日で同じ名前にそろえてリネームする
+        incremental=True の場合は、前回の実行以降に追加・変更された写真だけを処理する
+        """
         root_dir = root_dir or os.getcwd()
         renamed_count = 0
-        date_pattern = re.compile(r'^p\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}_')
 
-        for root, _, files in os.walk(root_dir):
-            for filename in files:
-                if not filename.lower().endswith(('.jpg', '.jpeg')):
-                    continue
+        with PhotoOperations._open_state("rename-photos", root_dir, incremental) as state:
+            # 既に日付形式で始まるファイルはEXIFを読まずにスキップ
+            sidecars: Dict[str, List[str]] = {}
+            photo_paths = PhotoOperations._iter_rename_targets(root_dir, state, sidecars)
 
-                # 既に日付形式で始まる場合はスキップ
-                if date_pattern.match(filename):
+            # EXIFの解析は並列化できるが、リネームは親プロセスで走査順に行う
+            for file_path, exif_data in PhotoOperations.iter_exif(photo_paths, workers):
+                new_path = None
+                file_sidecars = sidecars.pop(file_path, [])
+                try:
+                    # 撮影日情報がなければスキップ
+                    if "DateTimeOriginal" in exif_data:
+                        new_path = PhotoOperations.rename_photo_with_date(file_path, exif_data, file_sidecars)
+                        if new_path:
+                            renamed_count += 1 + len(file_sidecars)
+                except Exception as e:
+                    print(f"リネームエラー: {file_path} - {e}")
+                    if state is not None:
+                        state.discard(file_path)
                     continue
 
-                file_path = os.path.join(root, filename)
+                if state is not None:
+                    state.mark_done(file_path, new_path)
 
-                # EXIF情報を取得
-                exif_data = PhotoOperations.extract_exif(file_path)
+        PhotoOperations._print_incremental_stats(state)
+        return renamed_count
 
-                # 撮影日情報がなければスキップ
-                if "DateTimeOriginal" not in exif_data:
-                    continue
+    @staticmethod
+    def _iter_rename_targets(root_dir: str, state: Optional[IncrementalState],
+                             sidecars: Dict[str, List[str]]) -> Iterator[str]:
+        """リネーム対象の写真のパスを返す（既に日付形式で始まるファイルは処理済みとして除く）"""
+        for path in PhotoOperations._iter_photo_paths(root_dir, state, sidecars):
+            if not PhotoOperations.DATE_PREFIX_PATTERN.match(os.path.basename(path)):
+                yield path
+                continue
+            sidecars.pop(path, None)
+            if state is not None:
+                state.mark_done(path)
 
-                try:
-                    # EXIF日時文字列を解析 (通常形式: "YYYY:MM:DD HH:MM:SS")
-                    exif_date = exif_data["DateTimeOriginal"]
-                    date_obj = datetime.datetime.strptime(exif_date, '%Y:%m:%d %H:%M:%S')
+    @staticmethod
+    def rename_photo_with_date(file_path: str, exif_data: Dict[str, Any],
+                               sidecars: Sequence[str] = ()) -> Optional[str]:
+        """
+        1枚の写真の名前の先頭に撮影日を追加し、新しいパスを返す
+        sidecars（同じ名前の RAW など）も拡張子以外は同じ名前にリネームする
+        名前が変わらなかった場合は None を返し、日付の解析やリネームに失敗した場合は例外を送出する
+        """
+        root, filename = os.path.split(file_path)
 
-                    # 新しい形式に変換 "pyyyy-MM-dd_hh-mm-ss_"
-                    date_prefix = date_obj.strftime('p%Y-%m-%d_%H-%M-%S_')
+        # EXIF日時文字列を解析 (通常形式: "YYYY:MM:DD HH:MM:SS")
+        exif_date = exif_data["DateTimeOriginal"]
+        with Metrics.phase("date.strptime"):
+            date_obj = datetime.datetime.strptime(exif_date, '%Y:%m:%d %H:%M:%S')
 
-                    # 新しいファイル名を作成
-                    new_filename = f"{date_prefix}{filename}"
-                    new_path = os.path.join(root, new_filename)
+        # 新しい形式に変換 "pyyyy-MM-dd_hh-mm-ss_"
+        date_prefix = date_obj.strftime('p%Y-%m-%d_%H-%M-%S_')
 
-                    # 重複を避けるためパスの一意性を確保
-                    new_path = FileUtils.ensure_unique_path(new_path)
+        # 新しいファイル名を作成
+        new_filename = f"{date_prefix}{filename}"
+        new_path = os.path.join(root, new_filename)
 
-                    # ファイル名が変わる場合のみリネーム
-                    if file_path != new_path:
-                        os.rename(file_path, new_path)
-                        print(f"リネーム: {file_path} -> {new_path}")
-                        renamed_count += 1
-                except Exception as e:
-                    print(f"リネームエラー: {file_path} - {e}")
+        # 重複を避けるためパスの一意性を確保
+        with Metrics.phase("path.ensure_unique"):
+            new_path = FileUtils.ensure_unique_path(new_path, sidecars=sidecars)
 
-        return renamed_count
+        # ファイル名が変わる場合のみリネーム
+        if file_path == new_path:
+            return None
+
+        with Metrics.phase("fs.rename"):
+            os.rename(file_path, new_path)
+        print(f"リネーム: {file_path} -> {new_path}")
+
+        for sidecar in sidecars:
+            sidecar_target = FileUtils.sidecar_path(new_path, sidecar)
+            with Metrics.phase("fs.rename"):
+                os.rename(sidecar, sidecar_target)
+            print(f"リネーム: {sidecar} -> {sidecar_target}")
+        return new_path
 
     @staticmethod
-    def organize_photos_by_date(root_dir: Optional[str] = None, target_base_dir: str = "images") -> int:
-        """JPG/JPEGファイルをEXIF撮影日に基づいて images/yyyy/MM-dd フォルダに整理する関数"""
+    def organize_photos_by_date(root_dir: Optional[str] = None, target_base_dir: str = "images",
+                                workers: int = 1, duplicate_mode: Optional[str] = None,
+                                transfer_workers: int = FileTransfer.DEFAULT_WORKERS,
+                                verify_hash: bool = False, incremental: bool = False,
+                                date_sources: Sequence[str] = DateResolver.DEFAULT_SOURCES,
+                                report_file: Optional[str] = None) -> int:
+        """
+        写真を撮影日に基づいて images/yyyy/MM-dd フォルダに整理する関数
+        RAW+JPEG などの同じ名前の組は、代表の写真の撮影日で同じフォルダに同じ名前のまま移動する
+        duplicate_mode を指定すると、移動先に同じ内容の写真がある場合の処理を選べる
+        ("skip": 移動しない / "hardlink": 移動元を既存の写真へのハードリンクにする / "report": 報告だけして移動する)
+        移動先が別のデバイスの場合は transfer_workers 個のスレッドで並列にコピーし、移動元を削除する
+        （verify_hash=True でコピー後にハッシュも照合する）
+        incremental=True の場合は、前回の実行以降に追加・変更された写真だけを処理する
+        （撮影日がなく残った写真などは、変更されない限り次回から読み飛ばす）
+        撮影日は date_sources の順に DateResolver で決め、ファイル名などから分かる写真はEXIFを読まない
+        report_file を指定すると、写真ごとの撮影日・取得元・移動先をタブ区切りで出力する
+        """
         root_dir = root_dir or os.getcwd()
         moved_count = 0
         errors_count = 0
         no_date_count = 0
 
-        # ベースディレクトリの絶対パスを取得
-        if os.path.isabs(target_base_dir):
-            base_dir = target_base_dir
-        else:
-            # 相対パスの場合は実行ディレクトリからの相対パスとする
-            base_dir = os.path.join(os.getcwd(), target_base_dir)
-
-        print(f"写真の整理を開始します: {root_dir} -> {base_dir}")
+        base_dir = PhotoOperations.resolve_target_base_dir(target_base_dir)
+        duplicate_index = DuplicateIndex(duplicate_mode) if duplicate_mode else None
+        updater = PhotoIndexUpdater() if "index" in date_sources else None
+        resolver = DateResolver(date_sources, updater.lookup if updater is not None else None)
 
-        for root, _, files in os.walk(root_dir):
-            for filename in files:
-                if not filename.lower().endswith(('.jpg', '.jpeg')):
-                    continue
+        # 解析したEXIFだけをメタデータインデックスに記録する（ファイル名から決めた日時などは記録しない）
+        parses_exif = "exif" in date_sources
 
-                file_path = os.path.join(root, filename)
+        print(f"写真の整理を開始します: {root_dir} -> {base_dir}")
 
-                # EXIF情報を取得
-                exif_data = PhotoOperations.extract_exif(file_path)
+        # EXIFの解析は並列化できるが、移動先の決定は親プロセスで走査順に行う
+        # 状態は整理先ごとに分けて記録する
+        with PhotoOperations._open_state(f"organize-photos:{base_dir}", root_dir, incremental) as state, \
+                FileTransfer(transfer_workers, verify_hash) as transfer, \
+                (open(report_file, "w", encoding="utf-8") if report_file else contextlib.nullcontext()) as report:
+            if report is not None:
+                report.write("# path\tdate\tsource\ttarget\n")
+
+            sidecars: Dict[str, List[str]] = {}
+            photo_paths = PhotoOperations._iter_photo_paths(root_dir, state, sidecars, updater)
+            for file_path, exif_data in PhotoOperations.iter_exif(photo_paths, workers, lookup=resolver.lookup):
+                file_sidecars = sidecars.pop(file_path, [])
+                resolved = resolver.resolve(file_path, exif_data)
+                target_path = None
+
+                if updater is not None:
+                    if parses_exif and (resolved is None or resolved.source in ("exif", "mtime")):
+                        updater.record(file_path, exif_data)
+                    else:
+                        updater.release(file_path)
 
-                # 撮影日情報がなければスキップ
-                if "DateTimeOriginal" not in exif_data:
+                # 撮影日が決まらなければスキップ
+                if resolved is None:
                     print(f"撮影日なし: {file_path}")
                     no_date_count += 1
+                    if state is not None:
+                        state.mark_done(file_path)
+                    if report is not None:
+                        report.write(f"{file_path}\t-\t-\t-\n")
                     continue
 
                 try:
-                    # EXIF日時文字列を解析 (通常形式: "YYYY:MM:DD HH:MM:SS")
-                    exif_date = exif_data["DateTimeOriginal"]
-                    date_obj = datetime.datetime.strptime(exif_date, '%Y:%m:%d %H:%M:%S')
-
-                    # フォルダパスを作成 "images/YYYY/MM-DD"
-                    year_folder = date_obj.strftime('%Y')
-                    day_folder = date_obj.strftime('%m-%d')
-
-                    target_dir = os.path.join(base_dir, year_folder, day_folder)
-
-                    # ターゲットディレクトリが存在しなければ作成
-                    os.makedirs(target_dir, exist_ok=True)
-
-                    # ターゲットファイルパス
-                    target_path = os.path.join(target_dir, filename)
-
-                    # 重複を避けるためパスの一意性を確保
-                    target_path = FileUtils.ensure_unique_path(target_path)
-
-                    # ファイルを移動
-                    os.rename(file_path, target_path)
-                    print(f"移動: {file_path} -> {target_path}")
-                    moved_count += 1
-
+                    target_path = PhotoOperations.organize_photo(
+                        file_path, dict(exif_data, DateTimeOriginal=resolved.value), base_dir, duplicate_index,
+                        transfer, file_sidecars)
                 except Exception as e:
                     print(f"エラー: {file_path} - {e}")
                     errors_count += 1
+                    if state is not None:
+                        state.discard(file_path)
+                    continue
+                finally:
+                    if report is not None:
+                        report.write(f"{file_path}\t{resolved.value}\t{resolved.source}\t{target_path or '-'}\n")
+
+                if target_path:
+                    moved_count += 1 + len(file_sidecars)
+                    if updater is not None:
+                        for path in [file_path] + file_sidecars:
+                            updater.forget(path)
+                if state is not None:
+                    # 移動した写真は移動元に残らないので記録しない（転送に失敗した場合も次回やり直される）
+                    if target_path:
+                        state.discard(file_path)
+                    else:
+                        state.mark_done(file_path)
+
+        # デバイスをまたぐコピーに失敗した写真は移動元に残っている
+        moved_count -= transfer.failed_count
+        errors_count += transfer.failed_count
 
+        PhotoOperations._print_incremental_stats(state)
         print(f"処理完了: {moved_count}枚の写真を整理しました。")
         print(f"撮影日情報なし: {no_date_count}枚")
+        print(f"撮影日の取得元: {resolver.summary() or 'なし'}")
+        if duplicate_index is not None:
+            print(f"重複: {duplicate_index.duplicate_count}枚")
         print(f"エラー: {errors_count}件")
+        if report_file:
+            print(f"レポートが {report_file} に保存されました")
 
         return moved_count
 
     @staticmethod
-    def analyze_photo_path_exif_correlation(root_dir: Optional[str] = None, max_photos: int = 100) -> Dict:
+    def resolve_target_base_dir(target_base_dir: str) -> str:
+        """整理先のベースディレクトリの絶対パスを返す"""
+        if os.path.isabs(target_base_dir):
+            return target_base_dir
+        # 相対パスの場合は実行ディレクトリからの相対パスとする
+        return os.path.join(os.getcwd(), target_base_dir)
+
+    @staticmethod
+    def organize_photo(file_path: str, exif_data: Dict[str, Any], base_dir: str,
+                       duplicate_index: Optional[DuplicateIndex] = None,
+                       transfer: Optional[FileTransfer] = None, sidecars: Sequence[str] = ()) -> Optional[str]:
+        """
+        1枚の写真を base_dir/YYYY/MM-DD に移動し、移動先のパスを返す
+        sidecars（同じ名前の RAW など）も同じフォルダに、拡張子以外は同じ名前で移動する
+        既に整理済みの位置にある場合や重複として移動しなかった場合は None を返し、失敗した場合は例外を送出する
+        transfer を渡した場合、別のデバイスへのコピーは非同期に行われ、完了は transfer が表示する
+        """
+        filename = os.path.basename(file_path)
+
+        # EXIF日時文字列を解析 (通常形式: "YYYY:MM:DD HH:MM:SS")
+        exif_date = exif_data["DateTimeOriginal"]
+        with Metrics.phase("date.strptime"):
+            date_obj = datetime.datetime.strptime(exif_date, '%Y:%m:%d %H:%M:%S')
+
+        # フォルダパスを作成 "images/YYYY/MM-DD"
+        year_folder = date_obj.strftime('%Y')
+        day_folder = date_obj.strftime('%m-%d')
+
+        target_dir = os.path.join(base_dir, year_folder, day_folder)
+
+        # ターゲットディレクトリが存在しなければ作成
+        os.makedirs(target_dir, exist_ok=True)
+
+        # ターゲットファイルパス
+        target_path = os.path.join(target_dir, filename)
+
+        # 重複を避けるためパスの一意性を確保（整理済みの写真自身は衝突とみなさない）
+        with Metrics.phase("path.ensure_unique"):
+            target_path = FileUtils.ensure_unique_path(target_path, source_path=file_path,
+                                                       reserved=transfer.reserved if transfer is not None else None,
+                                                       sidecars=sidecars)
+
+        if target_path == file_path:
+            return None
+
+        # 移動先に同じ内容の写真があるかを確認
+        if duplicate_index is not None:
+            duplicate_path = duplicate_index.find(file_path, target_dir)
+            if duplicate_path is not None:
+                duplicate_index.duplicate_count += 1
+                if duplicate_index.mode == "skip":
+                    print(f"重複のためスキップ: {file_path} (既存: {duplicate_path})")
+                    return None
+                if duplicate_index.mode == "hardlink":
+                    PhotoOperations._replace_with_hardlink(file_path, duplicate_path)
+                    return None
+                print(f"重複: {file_path} (既存: {duplicate_path})")
+
+        # ファイルを移動
+        size = os.path.getsize(file_path)
+        for source, destination in [(file_path, target_path)] + [
+                (sidecar, FileUtils.sidecar_path(target_path, sidecar)) for sidecar in sidecars]:
+            if transfer is not None:
+                transfer.move(source, destination)
+            else:
+                FileTransfer.move_file(source, destination)
+                print(f"移動: {source} -> {destination}")
+        if duplicate_index is not None:
+            duplicate_index.add(target_path, size)
+        return target_path
+
+    @staticmethod
+    def _replace_with_hardlink(file_path: str, existing_path: str) -> None:
+        """file_path を既存の写真へのハードリンクに置き換える（置き換えられない場合はそのまま残す）"""
+        temp_path = FileUtils.ensure_unique_path(file_path + ".link")
+        try:
+            os.link(existing_path, temp_path)
+        except OSError as e:
+            print(f"重複のためスキップ: {file_path} (ハードリンクを作成できません: {e})")
+            return
+        os.replace(temp_path, file_path)
+        print(f"ハードリンクに置換: {file_path} -> {existing_path}")
+
+    @staticmethod
+    def report_similar_photos(root_dir: Optional[str] = None, output_file: str = "similar_photos.txt",
+                              max_distance: int = 6, hash_name: str = "phash", workers: int = 1) -> int:
+        """
+        リサイズや再エンコードされた同じ写真など、知覚ハッシュのハミング距離が max_distance 以内の
+        写真のペアを出力する関数（ハッシュはインデックスに保存され、次回は変更された画像だけを再計算する）
+        """
+        root_dir = root_dir or os.getcwd()
+        index = PerceptualHashIndex.update(root_dir, workers)
+
+        pair_count = 0
+        with open(output_file, "w", encoding="utf-8") as f:
+            for i, j, distance in index.find_pairs(max_distance, hash_name):
+                f.write(f"{distance}\t{index.paths[i]}\t{index.paths[j]}\n")
+                pair_count += 1
+
+        print(f"類似した写真のペア: {pair_count}組 ({hash_name}, 距離 {max_distance} 以内)")
+        print(f"レポートが {output_file} に保存されました")
+        return pair_count
+
+    @staticmethod
+    def analyze_photo_path_exif_correlation(root_dir: Optional[str] = None, max_photos: int = 100,
+                                            max_in_flight: int = 4,
+                                            base_url: str = LLMClient.DEFAULT_BASE_URL,
+                                            model: str = LLMClient.DEFAULT_MODEL,
+                                            image_max_edge: int = ImagePreprocessor.DEFAULT_MAX_EDGE,
+                                            image_quality: int = ImagePreprocessor.DEFAULT_QUALITY,
+                                            force_reevaluate: bool = False, sample: bool = False,
+                                            seed: int = 0, checkpoint: Optional[str] = None) -> Dict:
         """
         写真のパス名とEXIF情報の関連性を分析する関数
         LLMを使って判定し、複数回の結果から多数決で決定する
+        リクエストは最大 max_in_flight 件まで並行して送信し、複数の写真の判定をパイプライン化する
+        画像は長辺 image_max_edge 以内に縮小したJPEGとして送信する
+        判定済みの写真は JudgmentCache の結果を使う（force_reevaluate=True で再評価）
+        sample=True の場合は走査順の先頭からではなく、ツリー全体から max_photos 枚を無作為に抽出する（seed で再現可能）
+        checkpoint を指定すると1枚ごとの結果をJSONLで追記し、同じファイルで再実行すると分析済みの写真から再開する
         """
         root_dir = root_dir or os.getcwd()
-        processed_count = 0
         results_summary = {
             "total_analyzed": 0,
             "has_correlation": 0,
             "no_correlation": 0,
             "path_incorrect": 0,
             "exif_incorrect": 0,
+            "llm_requests": 0,
+            "cache_hits": 0,
             "details": []
         }
 
-        # ローカルLLMサーバーの設定
-        openai.api_base = "http://localhost:1234/v1"
-        openai.api_key = ""  # APIキーは空欄でOK
-
         print(f"写真のパス名とEXIF情報の関連性分析を開始します: {root_dir}")
 
-        for root, _, files in os.walk(root_dir):
-            for filename in files:
-                if not filename.lower().endswith(('.jpg', '.jpeg')):
-                    continue
-
-                if processed_count >= max_photos:
+        # 前回中断したところまでの結果を集計に戻し、分析済みの写真は対象から外す
+        resumed = PhotoOperations._load_analysis_checkpoint(checkpoint) if checkpoint else []
+        for result in resumed:
+            PhotoOperations._add_analysis_result(results_summary, result)
+        if resumed:
+            print(f"チェックポイントから再開します: 分析済み {len(resumed)}枚 ({checkpoint})")
+        done_paths = {result["file_path"] for result in resumed}
+        processed_count = len(resumed)
+
+        remaining = max(max_photos - processed_count, 0)
+        if sample:
+            targets = PhotoOperations._iter_sampled_analysis_targets(root_dir, max_photos, seed, done_paths)
+        else:
+            targets = PhotoOperations._iter_analysis_targets(root_dir, remaining, done_paths)
+
+        # ローカルLLMサーバーへの接続はクライアント内で使い回す
+        with LLMClient(base_url=base_url, model=model, max_in_flight=max_in_flight) as client, \
+                JudgmentCache() as judgment_cache, \
+                ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="photo") as photo_executor, \
+                (open(checkpoint, "a", encoding="utf-8") if checkpoint else contextlib.nullcontext()) as journal:
+            # 写真単位のタスクを一定数だけ先行させ、結果は走査順に受け取る
+            window = deque()
+            submitted = 0
+            while True:
+                while len(window) < max_in_flight and submitted < remaining:
+                    target = next(targets, None)
+                    if target is None:
+                        break
+                    file_path, exif_data = target
+                    future = photo_executor.submit(PhotoOperations._analyze_photo, client, judgment_cache,
+                                                   root_dir, file_path, exif_data, image_max_edge,
+                                                   image_quality, force_reevaluate)
+                    window.append((file_path, future))
+                    submitted += 1
+
+                if not window:
                     break
 
-                file_path = os.path.join(root, filename)
-
-                # EXIF情報を取得
-                exif_data = PhotoOperations.extract_exif(file_path)
-
-                # 撮影日情報がなければスキップ
-                if "DateTimeOriginal" not in exif_data:
+                file_path, future = window.popleft()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"エラー: {file_path} - {e}")
                     continue
 
-                try:
-                    # 画像をBase64エンコード
-                    with open(file_path, "rb") as image_file:
-                        encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-
-                    # パス情報を取得
-                    relative_path = os.path.relpath(file_path, root_dir)
-                    path_parts = os.path.normpath(relative_path).split(os.sep)
-
-                    # 主要なEXIF情報を抽出
-                    exif_summary = {
-                        "DateTimeOriginal": exif_data.get("DateTimeOriginal", ""),
-                        "Make": exif_data.get("Make", ""),
-                        "Model": exif_data.get("Model", ""),
-                        "GPSInfo": "あり" if "GPSInfo" in exif_data else "なし"
-                    }
-
-                    # 5回判定を行い、結果を集計
-                    judgments = []
-                    for _ in range(5):
-                        judgment = PhotoOperations._get_llm_judgment(path_parts, filename, exif_summary, encoded_image)
-                        judgments.append(judgment)
-
-                    # 多数決で最終判定を決定
-                    final_judgment = Counter(judgments).most_common(1)[0][0]
-
-                    # 結果を記録
-                    result = {
-                        "file_path": file_path,
-                        "exif_date": exif_data.get("DateTimeOriginal", ""),
-                        "final_judgment": final_judgment,
-                        "judgment_counts": dict(Counter(judgments))
-                    }
-
-                    results_summary["details"].append(result)
-                    results_summary["total_analyzed"] += 1
-
-                    if "関連あり_一致" in final_judgment:
-                        results_summary["has_correlation"] += 1
-                    elif "関連あり_不一致_パス名不正" in final_judgment:
-                        results_summary["has_correlation"] += 1
-                        results_summary["path_incorrect"] += 1
-                    elif "関連あり_不一致_EXIF不正" in final_judgment:
-                        results_summary["has_correlation"] += 1
-                        results_summary["exif_incorrect"] += 1
-                    else:
-                        results_summary["no_correlation"] += 1
+                PhotoOperations._add_analysis_result(results_summary, result)
+                # 通信エラーを含む結果は、再開したときに分析し直すため記録しない（判定キャッシュと同じ扱い）
+                if journal is not None and "判定エラー" not in result["judgment_counts"]:
+                    journal.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    journal.flush()
 
-                    print(f"分析 {processed_count+1}: {file_path}")
-                    print(f"  判定結果: {final_judgment}")
-                    print(f"  投票内訳: {dict(Counter(judgments))}")
+                print(f"分析 {processed_count+1}: {file_path}")
+                print(f"  判定結果: {result['final_judgment']}")
+                print(f"  投票内訳: {result['judgment_counts']}{' (キャッシュ)' if result['cached'] else ''}")
 
-                    processed_count += 1
+                processed_count += 1
 
-                except Exception as e:
-                    print(f"エラー: {file_path} - {e}")
+        # 走査を途中で打ち切った場合もジェネレーターを閉じて走査のスレッドを止める
+        targets.close()
 
         # 集計結果を表示
+        total_analyzed = results_summary['total_analyzed']
         print("\n===== 分析結果サマリー =====")
-        print(f"分析した写真: {results_summary['total_analyzed']}枚")
-        print(f"関連性あり: {results_summary['has_correlation']}枚 ({results_summary['has_correlation']/results_summary['total_analyzed']*100:.1f}%)")
+        print(f"分析した写真: {total_analyzed}枚")
+        print(f"関連性あり: {results_summary['has_correlation']}枚 ({(results_summary['has_correlation']/total_analyzed*100 if total_analyzed > 0 else 0):.1f}%)")
         print(f"関連性なし: {results_summary['no_correlation']}枚")
         print(f"パス名が不正と判断: {results_summary['path_incorrect']}枚")
         print(f"EXIF情報が不正と判断: {results_summary['exif_incorrect']}枚")
+        print(f"LLMリクエスト数: {results_summary['llm_requests']}回")
+        print(f"判定キャッシュ: ヒット {results_summary['cache_hits']}枚 ({(results_summary['cache_hits']/total_analyzed*100 if total_analyzed > 0 else 0):.1f}%)")
 
         return results_summary
 
     @staticmethod
-    def _get_llm_judgment(path_parts: List[str], filename: str, exif_summary: Dict, image_data: str) -> str:
+    def _add_analysis_result(results_summary: Dict, result: Dict[str, Any]) -> None:
+        """1枚の写真の判定結果を集計に加える"""
+        final_judgment = result["final_judgment"]
+        results_summary["details"].append(result)
+        results_summary["total_analyzed"] += 1
+        if result["cached"]:
+            results_summary["cache_hits"] += 1
+        else:
+            results_summary["llm_requests"] += sum(result["judgment_counts"].values())
+
+        if "関連あり_一致" in final_judgment:
+            results_summary["has_correlation"] += 1
+        elif "関連あり_不一致_パス名不正" in final_judgment:
+            results_summary["has_correlation"] += 1
+            results_summary["path_incorrect"] += 1
+        elif "関連あり_不一致_EXIF不正" in final_judgment:
+            results_summary["has_correlation"] += 1
+            results_summary["exif_incorrect"] += 1
+        else:
+            results_summary["no_correlation"] += 1
+
+    @staticmethod
+    def _load_analysis_checkpoint(checkpoint: str) -> List[Dict[str, Any]]:
+        """
+        チェックポイントのJSONLから分析済みの結果を読み込む
+        書き込み途中で中断された末尾の不完全な行は、続きを追記できるように切り詰める
+        通信エラーを含む結果は分析済みとみなさない（再開時にもう一度判定する）
+        """
+        if not os.path.exists(checkpoint):
+            return []
+
+        with open(checkpoint, "rb") as f:
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            with open(checkpoint, "r+b") as f:
+                f.truncate(len(complete))
+
+        results = []
+        for line in complete.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"警告: チェックポイントの壊れた行を無視します: {line[:80]}")
+                continue
+            if "判定エラー" not in result.get("judgment_counts", {}):
+                results.append(result)
+        return results
+
+    @staticmethod
+    def _iter_analysis_jpeg_paths(root_dir: str) -> Iterator[str]:
+        """関連性分析の対象になり得るJPEGのパスを走査順に返す"""
+        for _, _, entries in FileScanner.walk_entries(root_dir):
+            for entry in entries:
+                if entry.ext in ('.jpg', '.jpeg'):
+                    yield entry.path
+
+    @staticmethod
+    def _iter_analysis_targets(root_dir: str, max_photos: int,
+                               exclude: AbstractSet[str] = frozenset()) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        関連性分析の対象となる撮影日情報付きの写真を走査順に最大 max_photos 枚返す
+        max_photos 枚に達した時点で走査をやめ、残りの写真のEXIF解析は行わない
+        """
+        if max_photos <= 0:
+            return
+
+        selected_count = 0
+        for file_path in PhotoOperations._iter_analysis_jpeg_paths(root_dir):
+            if file_path in exclude:
+                continue
+
+            # EXIF情報を取得
+            exif_data = PhotoOperations.extract_exif(file_path)
+
+            # 撮影日情報がなければスキップ
+            if "DateTimeOriginal" not in exif_data:
+                continue
+
+            yield file_path, exif_data
+            selected_count += 1
+            if selected_count >= max_photos:
+                return
+
+    @staticmethod
+    def _iter_sampled_analysis_targets(root_dir: str, max_photos: int, seed: int = 0,
+                                       exclude: AbstractSet[str] = frozenset()) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        ツリー全体の写真から無作為に抽出した撮影日情報付きの写真を返す
+        走査中は乱数のキーが小さい順に max_photos * SAMPLE_OVERSAMPLING 件の候補だけを保持し（リザーバーサンプリング）、
+        EXIF解析は候補に対してだけ行う。キーが小さい順に解析し、撮影日情報がない写真は次の候補で補う
+        exclude（チェックポイントで分析済みの写真）も抽出には含めるため、同じ seed で再開すると同じ標本になる
+        """
+        capacity = max(max_photos, 0) * PhotoOperations.SAMPLE_OVERSAMPLING
+        if capacity == 0:
+            return
+
+        rng = random.Random(seed)
+        reservoir: List[Tuple[float, str]] = []
+        candidate_count = 0
+        for file_path in PhotoOperations._iter_analysis_jpeg_paths(root_dir):
+            # キーの符号を反転したヒープで、キーが最大の候補を素早く入れ替える
+            key = rng.random()
+            candidate_count += 1
+            if len(reservoir) < capacity:
+                heapq.heappush(reservoir, (-key, file_path))
+            elif -reservoir[0][0] > key:
+                heapq.heapreplace(reservoir, (-key, file_path))
+
+        print(f"抽出: 候補 {candidate_count}枚から {len(reservoir)}枚を保持")
+
+        selected_count = 0
+        for _, file_path in sorted(reservoir, reverse=True):
+            exif_data = PhotoOperations.extract_exif(file_path)
+            if "DateTimeOriginal" not in exif_data:
+                continue
+
+            # 分析済みの写真も標本の枚数に数える
+            selected_count += 1
+            if file_path not in exclude:
+                yield file_path, exif_data
+            if selected_count >= max_photos:
+                return
+
+        if selected_count < max_photos and candidate_count > len(reservoir):
+            print(f"警告: 撮影日情報付きの候補が足りず、{selected_count}枚のみ抽出しました")
+
+    @staticmethod
+    def _analyze_photo(client: LLMClient, judgment_cache: JudgmentCache, root_dir: str, file_path: str,
+                       exif_data: Dict[str, Any], image_max_edge: int = ImagePreprocessor.DEFAULT_MAX_EDGE,
+                       image_quality: int = ImagePreprocessor.DEFAULT_QUALITY,
+                       force_reevaluate: bool = False) -> Dict[str, Any]:
+        """1枚の写真について多数決で関連性を判定する（判定済みならキャッシュを使う）"""
+        # パス情報を取得
+        relative_path = os.path.relpath(file_path, root_dir)
+        path_parts = os.path.normpath(relative_path).split(os.sep)
+
+        # 主要なEXIF情報を抽出
+        exif_summary = {
+            "DateTimeOriginal": exif_data.get("DateTimeOriginal", ""),
+            "Make": exif_data.get("Make", ""),
+            "Model": exif_data.get("Model", ""),
+            "GPSInfo": "あり" if "GPSInfo" in exif_data else "なし"
+        }
+
+        filename = os.path.basename(file_path)
+        cache_key = JudgmentCache.make_key(DuplicateFinder.full_hash(file_path), path_parts, filename, exif_summary,
+                                           client.model, PhotoOperations.LLM_PROMPT_VERSION, image_max_edge,
+                                           image_quality)
+        judgments = None if force_reevaluate else judgment_cache.get(cache_key)
+        Metrics.count("llm.cache_hit" if judgments is not None else "llm.cache_miss")
+        cached = judgments is not None
+
+        if not cached:
+            # 縮小した画像をBase64エンコード
+            with Metrics.phase("llm.encode_image"):
+                encoded_image = ImagePreprocessor.encode_base64(file_path, image_max_edge, image_quality)
+            judgments = PhotoOperations._vote_llm_judgments(
+                client, path_parts, filename, exif_summary, encoded_image)
+
+            # 通信エラーを含む結果は次回再評価させるため保存しない
+            if "判定エラー" not in judgments:
+                judgment_cache.put(cache_key, file_path, judgments)
+
+        # 多数決で最終判定を決定
+        final_judgment = Counter(judgments).most_common(1)[0][0]
+
+        return {
+            "file_path": file_path,
+            "exif_date": exif_data.get("DateTimeOriginal", ""),
+            "final_judgment": final_judgment,
+            "judgment_counts": dict(Counter(judgments)),
+            "cached": cached
+        }
+
+    @staticmethod
+    def _vote_llm_judgments(client: LLMClient, path_parts: List[str], filename: str, exif_summary: Dict,
+                            image_data: str) -> List[str]:
+        """
+        最大 LLM_VOTES 回の判定を行い、いずれかの判定が LLM_MAJORITY 票に達した時点で打ち切る
+        過半数に届くのに必要な分だけをまとめて並行に送信する
+        """
+        judgments = []
+        while len(judgments) < PhotoOperations.LLM_VOTES:
+            top_votes = Counter(judgments).most_common(1)[0][1] if judgments else 0
+            if top_votes >= PhotoOperations.LLM_MAJORITY:
+                break
+
+            request_count = min(PhotoOperations.LLM_MAJORITY - top_votes,
+                                PhotoOperations.LLM_VOTES - len(judgments))
+            futures = [client.submit(PhotoOperations._get_llm_judgment, path_parts, filename,
+                                     exif_summary, image_data, client)
+                       for _ in range(request_count)]
+            judgments.extend(future.result() for future in futures)
+
+        return judgments
+
+    @staticmethod
+    def _get_llm_judgment(path_parts: List[str], filename: str, exif_summary: Dict, image_data: str,
+                          client: Optional[LLMClient] = None) -> str:
         """LLMを使ってパス名とEXIF情報の関連性を判定する（画像データも送信）"""
         try:
             # テキストプロンプト部分
@@ -341,13 +988,11 @@ EXIF情報:
                 }
             ]
 
-            completion = openai.ChatCompletion.create(
-                model="gemma-3-4b-it",  # または画像対応のモデル名に変更
-                messages=messages
-            )
-
-            # 応答から判定結果を抽出
-            response = completion.choices[0].message.content
+            if client is None:
+                with LLMClient(max_in_flight=1) as single_client:
+                    response = single_client.chat(messages)
+            else:
+                response = client.chat(messages)
 
             print(f"LLM応答: {response}")
 
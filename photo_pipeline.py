@@ -0,0 +1,338 @@
+import datetime
+import os
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set
+from date_resolver import DateResolver
+from duplicate_finder import DuplicateIndex
+from file_reporter import ExtensionReport, FileReporter
+from file_scanner import FileEntry, FileScanner
+from file_transfer import FileTransfer
+from file_utils import FileUtils
+from photo_index import PhotoIndexUpdater
+from photo_operations import PhotoOperations
+
+
+class PipelineStep:
+    """
+    パイプラインの1ステップ
+    process_file は全ファイルに対して、process_photo はEXIF解析後の写真に対して呼ばれる
+    moves_sidecars が True のステップには RAW+JPEG などの組の代表だけが渡され、残り（サイドカー）は
+    代表と一緒に扱う。それ以外のステップにはサイドカーも1枚の写真として渡される
+    """
+    name = ""
+    moves_sidecars = False
+
+    def process_file(self, entry: FileEntry) -> bool:
+        """ファイル単位の処理。ファイルを削除した場合は False を返して後続のステップを止める"""
+        return True
+
+    def wants_exif(self, file_path: str) -> bool:
+        """この写真のEXIF情報が必要かどうか"""
+        return False
+
+    def process_photo(self, file_path: str, exif_data: Dict[str, Any], sidecars: Sequence[str] = ()) -> str:
+        """写真単位の処理。リネームや移動をした場合は新しいパスを返す（サイドカーも拡張子以外は同じ名前にする）"""
+        return file_path
+
+    def finish(self) -> Any:
+        """集計結果を表示して戻り値を返す"""
+        return None
+
+
+class RemoveFileManyStep(PipelineStep):
+    name = "remove-filemany"
+    TARGET_FILE = "_filemany.simDB"
+
+    def __init__(self):
+        self.deleted_count = 0
+
+    def process_file(self, entry: FileEntry) -> bool:
+        if entry.name != RemoveFileManyStep.TARGET_FILE:
+            return True
+        try:
+            os.remove(entry.path)
+            self.deleted_count += 1
+            print(f"削除: {entry.path}")
+            return False
+        except Exception as e:
+            print(f"エラー: {entry.path} の削除に失敗しました - {e}")
+            return True
+
+    def finish(self) -> int:
+        print(f"完了: {self.deleted_count} 件のファイルを削除しました")
+        return self.deleted_count
+
+
+class ExtensionReportStep(PipelineStep):
+    name = "report-extensions"
+
+    def __init__(self, root_dir: str, max_files_to_show: int = 50, output_json: Optional[str] = None,
+                 output_csv: Optional[str] = None):
+        self.root_dir = root_dir
+        self.output_json = output_json
+        self.output_csv = output_csv
+        self.report = ExtensionReport(max_files_to_show)
+
+    def process_file(self, entry: FileEntry) -> bool:
+        self.report.add(entry.path, entry.ext, entry.size)
+        return True
+
+    def finish(self) -> Dict[str, int]:
+        FileReporter.print_extension_report(self.report, self.root_dir, self.output_json, self.output_csv)
+        return self.report.extension_counts
+
+
+class ReportExifStep(PipelineStep):
+    name = "report-exif"
+
+    def __init__(self, output_file: str = "exif_report.txt"):
+        self.output_file = output_file
+        self.photo_count = 0
+        self._file = open(output_file, "w", encoding="utf-8")
+
+    def wants_exif(self, file_path: str) -> bool:
+        return True
+
+    def process_photo(self, file_path: str, exif_data: Dict[str, Any], sidecars: Sequence[str] = ()) -> str:
+        if "DateTimeOriginal" in exif_data:
+            self._file.write(f"{file_path} -> {exif_data['DateTimeOriginal']}\n")
+            self.photo_count += 1
+        return file_path
+
+    def finish(self) -> int:
+        self._file.close()
+        print(f"撮影日情報が見つかった写真: {self.photo_count}枚")
+        print(f"レポートが {self.output_file} に保存されました")
+        return self.photo_count
+
+
+class ReportExifErrorsStep(PipelineStep):
+    name = "report-exif-errors"
+
+    def __init__(self, root_dir: str, output_file: str = "exif_errors.txt"):
+        self.output_file = output_file
+        self.error_count = 0
+        self.total_photos = 0
+        self._file = open(output_file, "w", encoding="utf-8")
+        self._file.write("# EXIF 撮影日情報がない画像ファイルのリスト\n")
+        self._file.write(f"# 生成日時: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+        self._file.write(f"# 検索対象: {root_dir}\n\n")
+
+    def wants_exif(self, file_path: str) -> bool:
+        return True
+
+    def process_photo(self, file_path: str, exif_data: Dict[str, Any], sidecars: Sequence[str] = ()) -> str:
+        self.total_photos += 1
+        if "DateTimeOriginal" not in exif_data:
+            self._file.write(f"{file_path}\n")
+            self.error_count += 1
+        return file_path
+
+    def finish(self) -> int:
+        self._file.close()
+        total_photos = self.total_photos
+        print(f"写真ファイル総数: {total_photos}枚")
+        print(f"撮影日情報がない写真: {self.error_count}枚 ({(self.error_count/total_photos*100 if total_photos > 0 else 0):.2f}%)")
+        print(f"エラーリストが {self.output_file} に保存されました")
+        return self.error_count
+
+
+class RenamePhotosStep(PipelineStep):
+    name = "rename-photos"
+    moves_sidecars = True
+
+    def __init__(self):
+        self.renamed_count = 0
+
+    def wants_exif(self, file_path: str) -> bool:
+        # 既に日付形式で始まるファイルはEXIFを必要としない
+        return not PhotoOperations.DATE_PREFIX_PATTERN.match(os.path.basename(file_path))
+
+    def process_photo(self, file_path: str, exif_data: Dict[str, Any], sidecars: Sequence[str] = ()) -> str:
+        if not self.wants_exif(file_path) or "DateTimeOriginal" not in exif_data:
+            return file_path
+        try:
+            new_path = PhotoOperations.rename_photo_with_date(file_path, exif_data, sidecars)
+        except Exception as e:
+            print(f"リネームエラー: {file_path} - {e}")
+            return file_path
+        if new_path is None:
+            return file_path
+        self.renamed_count += 1 + len(sidecars)
+        return new_path
+
+    def finish(self) -> int:
+        print(f"リネーム完了: {self.renamed_count}枚")
+        return self.renamed_count
+
+
+class OrganizePhotosStep(PipelineStep):
+    name = "organize-photos"
+    moves_sidecars = True
+
+    def __init__(self, target_base_dir: str = "images", duplicate_mode: Optional[str] = None,
+                 transfer_workers: int = FileTransfer.DEFAULT_WORKERS, verify_hash: bool = False,
+                 date_sources: Sequence[str] = DateResolver.DEFAULT_SOURCES):
+        self.base_dir = PhotoOperations.resolve_target_base_dir(target_base_dir)
+        self.duplicate_index = DuplicateIndex(duplicate_mode) if duplicate_mode else None
+        self.transfer = FileTransfer(transfer_workers, verify_hash)
+        # パイプラインではEXIFは共有のものを使い、接頭辞・ファイル名の日時はそれより優先する
+        self.resolver = DateResolver([source for source in date_sources if source != "index"])
+        self.moved_count = 0
+        self.errors_count = 0
+        self.no_date_count = 0
+
+    def wants_exif(self, file_path: str) -> bool:
+        return True
+
+    def process_photo(self, file_path: str, exif_data: Dict[str, Any], sidecars: Sequence[str] = ()) -> str:
+        resolved = self.resolver.resolve(file_path, exif_data)
+        if resolved is None:
+            print(f"撮影日なし: {file_path}")
+            self.no_date_count += 1
+            return file_path
+        try:
+            target_path = PhotoOperations.organize_photo(file_path, dict(exif_data, DateTimeOriginal=resolved.value),
+                                                         self.base_dir, self.duplicate_index, self.transfer,
+                                                         sidecars)
+        except Exception as e:
+            print(f"エラー: {file_path} - {e}")
+            self.errors_count += 1
+            return file_path
+        if target_path is None:
+            return file_path
+        self.moved_count += 1 + len(sidecars)
+        return target_path
+
+    def finish(self) -> int:
+        self.transfer.close()
+        self.moved_count -= self.transfer.failed_count
+        self.errors_count += self.transfer.failed_count
+        print(f"処理完了: {self.moved_count}枚の写真を整理しました。")
+        print(f"撮影日情報なし: {self.no_date_count}枚")
+        print(f"撮影日の取得元: {self.resolver.summary() or 'なし'}")
+        if self.duplicate_index is not None:
+            print(f"重複: {self.duplicate_index.duplicate_count}枚")
+        print(f"エラー: {self.errors_count}件")
+        return self.moved_count
+
+
+class PhotoPipeline:
+    """
+    複数の操作を1回の走査でまとめて実行するパイプライン
+    各ファイルのstat結果とEXIF解析結果は1度だけ取得し、全ステップで共有する
+    """
+    STEP_NAMES = (RemoveFileManyStep.name, ExtensionReportStep.name, ReportExifStep.name,
+                  ReportExifErrorsStep.name, RenamePhotosStep.name, OrganizePhotosStep.name)
+
+    @staticmethod
+    def create_steps(step_names: List[str], root_dir: Optional[str] = None, target_base_dir: str = "images",
+                     exif_report: str = "exif_report.txt", exif_errors: str = "exif_errors.txt",
+                     max_files_to_show: int = 50, output_json: Optional[str] = None,
+                     output_csv: Optional[str] = None, duplicate_mode: Optional[str] = None,
+                     transfer_workers: int = FileTransfer.DEFAULT_WORKERS,
+                     verify_hash: bool = False,
+                     date_sources: Sequence[str] = DateResolver.DEFAULT_SOURCES) -> List[PipelineStep]:
+        """ステップ名の一覧からステップを作成する"""
+        root_dir = root_dir or os.getcwd()
+        factories = {
+            RemoveFileManyStep.name: lambda: RemoveFileManyStep(),
+            ExtensionReportStep.name: lambda: ExtensionReportStep(root_dir, max_files_to_show, output_json,
+                                                                  output_csv),
+            ReportExifStep.name: lambda: ReportExifStep(exif_report),
+            ReportExifErrorsStep.name: lambda: ReportExifErrorsStep(root_dir, exif_errors),
+            RenamePhotosStep.name: lambda: RenamePhotosStep(),
+            OrganizePhotosStep.name: lambda: OrganizePhotosStep(target_base_dir, duplicate_mode,
+                                                                  transfer_workers, verify_hash, date_sources),
+        }
+        unknown = [name for name in step_names if name not in factories]
+        if unknown:
+            raise ValueError(f"未対応のステップです: {', '.join(unknown)}")
+        return [factories[name]() for name in step_names]
+
+    @staticmethod
+    def run(steps: List[PipelineStep], root_dir: Optional[str] = None, workers: int = 1) -> Dict[str, Any]:
+        """ステップを1回の走査で実行し、ステップ名ごとの結果を返す"""
+        root_dir = root_dir or os.getcwd()
+
+        # ステップが移動・リネームしたファイルを、後から走査したディレクトリで再処理しないようにする
+        produced_paths = set()
+
+        # 組の代表のパス -> サイドカーのパス、代表と一緒に扱うためEXIF解析のみ行うサイドカーのパス
+        sidecars: Dict[str, List[str]] = {}
+        sidecar_paths: Set[str] = set()
+
+        # 解析した写真はメタデータインデックスに記録し、移動・リネームした写真は記録から外す
+        updater = PhotoIndexUpdater()
+
+        print(f"パイプラインを開始します: {root_dir} ({' -> '.join(step.name for step in steps)})")
+
+        photo_paths = PhotoPipeline._iter_files(steps, root_dir, produced_paths, sidecars, sidecar_paths, updater)
+        for original_path, exif_data in PhotoOperations.iter_exif(photo_paths, workers, lookup=updater.lookup):
+            # サイドカーは代表より先に返されるので、代表と一緒に移動するステップ以外で処理する
+            if original_path in sidecar_paths:
+                sidecar_paths.discard(original_path)
+                for step in steps:
+                    if not step.moves_sidecars:
+                        step.process_photo(original_path, exif_data)
+                updater.record(original_path, exif_data)
+                continue
+
+            file_path = original_path
+            original_sidecars = file_sidecars = sidecars.pop(original_path, [])
+            for step in steps:
+                new_path = step.process_photo(file_path, exif_data, file_sidecars)
+                if new_path != file_path:
+                    file_sidecars = [FileUtils.sidecar_path(new_path, sidecar) for sidecar in file_sidecars]
+                    file_path = new_path
+            if file_path != original_path:
+                produced_paths.add(file_path)
+                produced_paths.update(file_sidecars)
+                for path in [original_path] + original_sidecars:
+                    updater.forget(path)
+            else:
+                updater.record(original_path, exif_data)
+
+        return {step.name: step.finish() for step in steps}
+
+    @staticmethod
+    def _iter_files(steps: List[PipelineStep], root_dir: str, produced_paths: set,
+                    sidecars: Dict[str, List[str]], sidecar_paths: Set[str],
+                    updater: PhotoIndexUpdater) -> Iterator[str]:
+        """
+        全ファイルにファイル単位の処理を行い、EXIF情報が必要な写真のパスを返す
+        サイドカーを一緒に移動するステップがある場合は、ディレクトリごとに写真を組にまとめる
+        """
+        group_sidecars = any(step.moves_sidecars for step in steps)
+        for root, _, entries in FileScanner.walk_entries(root_dir):
+            updater.begin_directory(root, [entry for entry in entries
+                                           if entry.ext in PhotoOperations.PHOTO_EXTENSIONS])
+            remaining = []
+            for entry in entries:
+                if entry.path in produced_paths:
+                    produced_paths.discard(entry.path)
+                    continue
+
+                if not all(step.process_file(entry) for step in steps):
+                    continue
+
+                if not group_sidecars:
+                    if entry.ext in PhotoOperations.PHOTO_EXTENSIONS and any(step.wants_exif(entry.path)
+                                                                             for step in steps):
+                        updater.expect(entry)
+                        yield entry.path
+                    continue
+                remaining.append(entry)
+
+            for photo, group in PhotoOperations.group_sidecars(remaining):
+                if not any(step.wants_exif(photo.path) for step in steps):
+                    continue
+                for entry in group:
+                    if entry.ext in PhotoOperations.PHOTO_EXTENSIONS and any(
+                            not step.moves_sidecars and step.wants_exif(entry.path) for step in steps):
+                        sidecar_paths.add(entry.path)
+                        updater.expect(entry)
+                        yield entry.path
+                if group:
+                    sidecars[photo.path] = [entry.path for entry in group]
+                updater.expect(photo)
+                yield photo.path
@@ -0,0 +1,556 @@
+import collections
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import json
+import os
+import select
+import signal
+import struct
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from date_resolver import DateResolver
+from duplicate_finder import DuplicateIndex
+from file_scanner import FileEntry, FileScanner
+from file_transfer import FileTransfer
+from file_utils import FileUtils
+from incremental_state import IncrementalState
+from metrics import Metrics
+from photo_operations import PhotoOperations
+
+# ファイルのサイズと mtime_ns（書き込みが終わったかの判定に使う）
+FileSignature = Tuple[int, int]
+
+# RAW+JPEG などの組を表す (ディレクトリ, 拡張子を除いた名前)
+GroupKey = Tuple[str, str]
+
+
+class _Inotify:
+    """libc の inotify を ctypes で呼び出す薄いラッパー（Linux 以外や初期化に失敗した場合は OSError）"""
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+
+    WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT_HEADER = struct.Struct("iIII")
+    READ_SIZE = 64 * 1024
+
+    def __init__(self):
+        library = ctypes.util.find_library("c")
+        if library is None:
+            raise OSError(errno.ENOSYS, "libc が見つかりません")
+        self._libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify に対応していません")
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self._paths: Dict[int, str] = {}
+
+    def add_watch(self, path: str) -> None:
+        """ディレクトリを監視対象に加える（監視数の上限などで失敗した場合は OSError）"""
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), _Inotify.WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        self._paths[wd] = path
+
+    def read_events(self, timeout: float) -> Iterator[Tuple[str, int, str]]:
+        """timeout 秒まで待ち、(ディレクトリ, マスク, 名前) を返す。キューが溢れた場合のディレクトリは空文字"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return
+        try:
+            data = os.read(self.fd, _Inotify.READ_SIZE)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + _Inotify.EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _Inotify.EVENT_HEADER.unpack_from(data, offset)
+            offset += _Inotify.EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & _Inotify.IN_Q_OVERFLOW:
+                yield "", mask, ""
+                continue
+            directory = self._paths.get(wd)
+            if mask & _Inotify.IN_IGNORED:
+                self._paths.pop(wd, None)
+            if directory is not None:
+                yield directory, mask, name
+
+    @property
+    def watch_count(self) -> int:
+        return len(self._paths)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PhotoWatcher:
+    """
+    取り込み用ディレクトリを監視し、届いた写真を撮影日でリネーム・整理し続けるデーモン
+    Linux では inotify で変更を受け取り、使えない場合は一定間隔の走査（差分実行の状態ストアで変更分のみ）に切り替える
+    書き込み中のファイルは、最後の変更から settle 秒たってもサイズと mtime が変わらなくなるまで待つ
+    RAW+JPEG などの同じ名前の組は、組のすべてのファイルの書き込みが終わってから代表の撮影日で一緒に処理する
+    待機中のファイルは max_pending 件までしか保持せず、溢れた分は後から走査し直して拾うため、メモリ使用量は一定に収まる
+    状態（待機数・処理数・直近のスループット）は stats_file に定期的に書き出し、status_port を指定するとHTTPでも返す
+    """
+    DEFAULT_SETTLE = 2.0
+    DEFAULT_BATCH_SIZE = 256
+    DEFAULT_MAX_PENDING = 10000
+    DEFAULT_POLL_INTERVAL = 5.0
+    STATS_NAME = "watch_status.json"
+    STATS_INTERVAL = 1.0
+    THROUGHPUT_WINDOW = 60.0
+
+    # 待機リストに入れる拡張子（サイドカーは単独では処理しないが、組の書き込みが終わるのを待つために監視する）
+    WATCH_EXTENSIONS = PhotoOperations.PHOTO_EXTENSIONS + PhotoOperations.SIDECAR_EXTENSIONS
+
+    def __init__(self, root_dir: str, target_base_dir: str = "images", rename: bool = False, workers: int = 1,
+                 duplicate_mode: Optional[str] = None, transfer_workers: int = FileTransfer.DEFAULT_WORKERS,
+                 verify_hash: bool = False, date_sources: Sequence[str] = DateResolver.DEFAULT_SOURCES,
+                 settle: float = DEFAULT_SETTLE, batch_size: int = DEFAULT_BATCH_SIZE,
+                 max_pending: int = DEFAULT_MAX_PENDING, poll_interval: float = DEFAULT_POLL_INTERVAL,
+                 polling: bool = False, stats_file: Optional[str] = None, status_port: Optional[int] = None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.base_dir = PhotoOperations.resolve_target_base_dir(target_base_dir)
+        self.rename = rename
+        self.workers = workers
+        self.settle = settle
+        self.batch_size = max(batch_size, 1)
+        self.max_pending = max(max_pending, self.batch_size)
+        self.poll_interval = poll_interval
+        self.stats_file = stats_file or os.path.join(FileUtils.get_cache_dir(), PhotoWatcher.STATS_NAME)
+        self.status_port = status_port
+
+        self.duplicate_index = DuplicateIndex(duplicate_mode) if duplicate_mode else None
+        self.resolver = DateResolver([source for source in date_sources if source != "index"])
+        self.transfer = FileTransfer(transfer_workers, verify_hash)
+        self.state = IncrementalState(f"organize-photos:{self.base_dir}", self.root_dir)
+
+        self.stats: Dict[str, Any] = {
+            "mode": "polling" if polling else "inotify",
+            "root": self.root_dir,
+            "target": self.base_dir,
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "processed": 0,
+            "moved": 0,
+            "renamed": 0,
+            "no_date": 0,
+            "errors": 0,
+            "batches": 0,
+            "rescans": 0,
+            "dropped_events": 0,
+        }
+
+        # 待機中のファイル: パス -> (最後に変化を見た時刻, 最後に見たサイズと mtime)。古い順に並ぶ
+        self._pending: "collections.OrderedDict[str, Tuple[float, Optional[FileSignature]]]" = \
+            collections.OrderedDict()
+        # 走査し直し中のイテレーター（待機数に空きがある分だけ進める）
+        self._rescan: Optional[Iterator[Tuple[str, FileSignature]]] = None
+        self._rescan_again = False
+        self._next_poll = 0.0
+        self._recent = collections.deque(maxlen=1024)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._inotify: Optional[_Inotify] = None
+        self._status_server: Optional[ThreadingHTTPServer] = None
+
+    def run(self, duration: Optional[float] = None) -> Dict[str, Any]:
+        """監視を開始し、stop() されるか duration 秒たつまで処理を続けて統計を返す"""
+        deadline = time.monotonic() + duration if duration is not None else None
+        if self.stats["mode"] == "inotify":
+            self._start_inotify()
+        self._start_status_server()
+
+        # 監視を始める前に置かれていたファイルも拾う
+        self._schedule_rescan()
+        print(f"監視を開始します ({self.stats['mode']}): {self.root_dir} -> {self.base_dir}")
+
+        next_stats = 0.0
+        try:
+            while not self._stop.is_set() and (deadline is None or time.monotonic() < deadline):
+                self._collect(timeout=min(self.settle / 2, 0.5))
+                self._process_ready()
+
+                now = time.monotonic()
+                if now >= next_stats:
+                    self._write_stats()
+                    next_stats = now + PhotoWatcher.STATS_INTERVAL
+        finally:
+            self.close()
+        return self.snapshot()
+
+    def stop(self) -> None:
+        """監視を止める（処理中のバッチは最後まで行う）"""
+        self._stop.set()
+
+    def install_signal_handlers(self) -> None:
+        """SIGINT / SIGTERM で監視を止める"""
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: self.stop())
+
+    def close(self) -> None:
+        """残りのコピーを待ち、状態を保存して監視を終える"""
+        self.transfer.close()
+        self.state.close()
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        self._write_stats()
+        if self._status_server is not None:
+            self._status_server.shutdown()
+            self._status_server.server_close()
+            self._status_server = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """現在の統計（待機数・スループットなど）を返す"""
+        now = time.monotonic()
+        with self._lock:
+            recent = [count for timestamp, count in self._recent if now - timestamp <= PhotoWatcher.THROUGHPUT_WINDOW]
+            stats = dict(self.stats)
+            stats["pending"] = len(self._pending)
+            stats["rescan_in_progress"] = self._rescan is not None
+            stats["watches"] = self._inotify.watch_count if self._inotify is not None else 0
+        stats["files_per_minute"] = sum(recent) * 60.0 / PhotoWatcher.THROUGHPUT_WINDOW
+        stats["updated_at"] = datetime.datetime.now().isoformat(timespec="seconds")
+        return stats
+
+    def _start_inotify(self) -> None:
+        """ツリー全体に inotify の監視を付ける（使えなければ走査に切り替える）"""
+        try:
+            self._inotify = _Inotify()
+            self._watch_tree(self.root_dir)
+        except OSError as e:
+            print(f"inotify を使えないため、{self.poll_interval}秒ごとの走査に切り替えます: {e}")
+            if self._inotify is not None:
+                self._inotify.close()
+                self._inotify = None
+            self.stats["mode"] = "polling"
+
+    def _watch_tree(self, directory: str) -> None:
+        for root, dirs, _ in FileScanner.walk(directory):
+            if self._is_excluded(root):
+                dirs[:] = []
+                continue
+            self._inotify.add_watch(root)
+
+    def _collect(self, timeout: float) -> None:
+        """変更されたファイルを待機リストに集める"""
+        if self._inotify is not None:
+            for directory, mask, name in self._inotify.read_events(timeout):
+                self._handle_event(directory, mask, name)
+        else:
+            now = time.monotonic()
+            if now >= self._next_poll:
+                self._schedule_rescan()
+                self._next_poll = now + self.poll_interval
+            else:
+                self._stop.wait(timeout)
+
+        # 走査し直しは待機数に空きがある分だけ進める
+        while self._rescan is not None and len(self._pending) < self.max_pending:
+            item = next(self._rescan, None)
+            if item is None:
+                self._rescan = None
+                if self._rescan_again:
+                    self._schedule_rescan()
+                    continue
+                break
+            path, signature = item
+            self._touch(path, signature)
+
+    def _handle_event(self, directory: str, mask: int, name: str) -> None:
+        if not directory:
+            # カーネルのイベントキューが溢れたため、取りこぼした分を走査し直して拾う
+            self.stats["dropped_events"] += 1
+            self._schedule_rescan()
+            return
+
+        path = os.path.join(directory, name)
+        if mask & _Inotify.IN_ISDIR:
+            if mask & (_Inotify.IN_CREATE | _Inotify.IN_MOVED_TO) and not self._is_excluded(path):
+                # 監視を付ける前に中に置かれたファイルは走査で拾う
+                try:
+                    self._watch_tree(path)
+                except OSError as e:
+                    print(f"監視を追加できません: {path} - {e}")
+                self._schedule_rescan()
+            return
+
+        if os.path.splitext(name)[1].lower() not in PhotoWatcher.WATCH_EXTENSIONS:
+            return
+        if mask & (_Inotify.IN_DELETE | _Inotify.IN_MOVED_FROM):
+            with self._lock:
+                self._pending.pop(path, None)
+        elif mask & (_Inotify.IN_CLOSE_WRITE | _Inotify.IN_MOVED_TO):
+            self._touch(path, PhotoWatcher._signature(path))
+        elif mask & (_Inotify.IN_CREATE | _Inotify.IN_MODIFY):
+            self._touch(path, None)
+
+    def _touch(self, path: str, signature: Optional[FileSignature]) -> None:
+        """ファイルの変化を記録し、待機リストの末尾に回す（満杯なら後の走査し直しに任せる）"""
+        if path not in self._pending and len(self._pending) >= self.max_pending:
+            self.stats["dropped_events"] += 1
+            self._schedule_rescan()
+            return
+        with self._lock:
+            self._pending[path] = (time.monotonic(), signature)
+            self._pending.move_to_end(path)
+
+    def _schedule_rescan(self) -> None:
+        """
+        取り込み用ディレクトリの新しいファイルと変更されたファイルを走査し直す
+        走査中に呼ばれた場合は、走査済みのディレクトリに後から届いたファイルを拾うため、終わってからもう一度走査する
+        """
+        if self._rescan is None:
+            self.stats["rescans"] += 1
+            self._rescan = self._iter_changed()
+            self._rescan_again = False
+        else:
+            self._rescan_again = True
+
+    def _iter_changed(self) -> Iterator[Tuple[str, FileSignature]]:
+        """
+        前回処理したときから変わった写真と、そのサイドカーを返す（変更のないディレクトリはスキャンインデックスで列挙を省く）
+        organize-photos と同じく、差分実行の状態には組の代表だけを記録する
+        """
+        for root, dirs, entries in FileScanner.walk_entries(self.root_dir):
+            if self._is_excluded(root):
+                dirs[:] = []
+                continue
+            groups = PhotoOperations.group_sidecars(entries)
+            changed = {entry.path for entry in self.state.filter_entries(root, [photo for photo, _ in groups])}
+            for photo, group in groups:
+                if photo.path not in changed:
+                    continue
+                for entry in [photo] + group:
+                    if entry.path not in self._pending:
+                        yield entry.path, (entry.size, entry.mtime_ns)
+
+    def _process_ready(self) -> None:
+        """
+        settle 秒以上変化していないファイルを、同じ名前の組ごとにバッチにまとめて処理する
+        組のどれかのファイルがまだ settle 秒たっていない場合は、組全体を待たせる
+        """
+        now = time.monotonic()
+        settled: "collections.OrderedDict[GroupKey, List[Tuple[str, Optional[FileSignature]]]]" = \
+            collections.OrderedDict()
+        waiting = set()
+        candidates: List[Tuple[str, Optional[FileSignature]]] = []
+        with self._lock:
+            for path, (last_seen, signature) in self._pending.items():
+                key = PhotoWatcher._group_key(path)
+                if now - last_seen < self.settle:
+                    waiting.add(key)
+                else:
+                    settled.setdefault(key, []).append((path, signature))
+            for key, members in settled.items():
+                if len(candidates) >= self.batch_size:
+                    break
+                if key not in waiting:
+                    candidates.extend(members)
+            for path, _ in candidates:
+                del self._pending[path]
+
+        checked: "collections.OrderedDict[GroupKey, List[FileEntry]]" = collections.OrderedDict()
+        unsettled = set()
+        for path, signature in candidates:
+            entry = PhotoWatcher._entry(path)
+            if entry is None:
+                # 処理する前に削除・移動されたファイル
+                self.state.discard(path)
+                continue
+            key = PhotoWatcher._group_key(path)
+            checked.setdefault(key, []).append(entry)
+            if (entry.size, entry.mtime_ns) != signature:
+                unsettled.add(key)
+
+        ready = []
+        for key, entries in checked.items():
+            if key in unsettled:
+                # まだ書き込まれている（またはサイズを確認していない）ので、組ごともう一度 settle 秒待つ
+                for entry in entries:
+                    self._touch(entry.path, (entry.size, entry.mtime_ns))
+            else:
+                ready.extend(entries)
+
+        if ready:
+            self._process_batch(ready)
+
+    def _process_batch(self, entries: List[FileEntry]) -> None:
+        """
+        書き込みが終わったファイルを組にまとめ、代表の写真の撮影日でサイドカーと一緒にリネーム・整理する
+        先に届いて処理済みになったサイドカーも拾うため、ディレクトリ内の同じ名前のファイルを組に加える
+        写真のないサイドカーだけの組は、写真が届くまでそのまま残す
+        """
+        by_directory: Dict[str, List[FileEntry]] = {}
+        for entry in entries:
+            by_directory.setdefault(os.path.dirname(entry.path), []).append(entry)
+
+        sidecars: Dict[str, List[str]] = {}
+        for directory, directory_entries in by_directory.items():
+            companions = self._find_companions(directory, directory_entries)
+            if companions is None:
+                continue
+            for photo, group in PhotoOperations.group_sidecars(directory_entries + companions):
+                sidecars[photo.path] = [entry.path for entry in group]
+
+        processed = len(sidecars) + sum(len(group) for group in sidecars.values())
+        with Metrics.phase("watch.batch"):
+            for file_path, exif_data in PhotoOperations.iter_exif(list(sidecars), self.workers,
+                                                                  lookup=self.resolver.lookup):
+                self._process_photo(file_path, exif_data, sidecars[file_path])
+
+        with self._lock:
+            self.stats["batches"] += 1
+            self.stats["processed"] += processed
+            self._recent.append((time.monotonic(), processed))
+
+    def _find_companions(self, directory: str, entries: List[FileEntry]) -> Optional[List[FileEntry]]:
+        """
+        entries と同じ名前で、待機リストにないディレクトリ内のファイルを返す
+        そのうち直近 settle 秒以内に変更されたもの（イベントをまだ受け取っていないもの）があれば、
+        該当する組を待機リストに戻し、残りの組だけで処理できるよう entries から除く（すべて戻した場合は None）
+        """
+        names = {entry.name for entry in entries}
+        stems = {os.path.splitext(name)[0] for name in names}
+        companions = []
+        try:
+            with os.scandir(directory) as it:
+                for dir_entry in it:
+                    stem, ext = os.path.splitext(dir_entry.name)
+                    if dir_entry.name in names or stem not in stems or ext.lower() not in PhotoWatcher.WATCH_EXTENSIONS:
+                        continue
+                    entry = PhotoWatcher._entry(dir_entry.path)
+                    if entry is not None:
+                        companions.append(entry)
+        except OSError:
+            pass
+
+        # mtime が未来のファイル（時計のずれたカメラやコピー元）は書き込み中とみなさない
+        now_ns = time.time_ns()
+        recent_ns = now_ns - int(self.settle * 1_000_000_000)
+        busy = {os.path.splitext(entry.name)[0] for entry in companions
+                if entry.path in self._pending or recent_ns < entry.mtime_ns <= now_ns}
+        if busy:
+            for entry in entries + companions:
+                if os.path.splitext(entry.name)[0] in busy:
+                    self._touch(entry.path, (entry.size, entry.mtime_ns))
+            entries[:] = [entry for entry in entries if os.path.splitext(entry.name)[0] not in busy]
+            companions = [entry for entry in companions if os.path.splitext(entry.name)[0] not in busy]
+            if not entries:
+                return None
+        return companions
+
+    def _process_photo(self, file_path: str, exif_data: Dict[str, Any], sidecars: Sequence[str] = ()) -> None:
+        resolved = self.resolver.resolve(file_path, exif_data)
+        if resolved is None:
+            print(f"撮影日なし: {file_path}")
+            self.stats["no_date"] += 1
+            self.state.mark_done(file_path)
+            return
+
+        exif_data = dict(exif_data, DateTimeOriginal=resolved.value)
+        try:
+            path = file_path
+            if self.rename and not PhotoOperations.DATE_PREFIX_PATTERN.match(os.path.basename(path)):
+                new_path = PhotoOperations.rename_photo_with_date(path, exif_data, sidecars)
+                if new_path is not None:
+                    path = new_path
+                    sidecars = [FileUtils.sidecar_path(new_path, sidecar) for sidecar in sidecars]
+                    self.stats["renamed"] += 1 + len(sidecars)
+            target_path = PhotoOperations.organize_photo(path, exif_data, self.base_dir, self.duplicate_index,
+                                                         self.transfer, sidecars)
+        except Exception as e:
+            print(f"エラー: {file_path} - {e}")
+            self.stats["errors"] += 1
+            self.state.discard(file_path)
+            return
+
+        if target_path:
+            self.stats["moved"] += 1 + len(sidecars)
+            self.state.discard(file_path)
+        else:
+            self.state.mark_done(file_path, path if path != file_path else None)
+
+    def _is_excluded(self, path: str) -> bool:
+        """整理先が取り込み用ディレクトリの中にある場合、整理済みの写真は監視しない"""
+        path = os.path.abspath(path)
+        return os.path.commonpath([self.base_dir, path]) == self.base_dir
+
+    def _write_stats(self) -> None:
+        """統計をJSONファイルに書き出す（読み手が途中の内容を見ないよう、置き換えで更新する）"""
+        stats = self.snapshot()
+        tmp_path = self.stats_file + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(stats, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.stats_file)
+        except OSError as e:
+            print(f"統計を書き出せません: {self.stats_file} - {e}")
+
+    def _start_status_server(self) -> None:
+        """status_port が指定されていれば、GET で統計のJSONを返すHTTPサーバーを起動する"""
+        if self.status_port is None:
+            return
+        watcher = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(watcher.snapshot(), ensure_ascii=False).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._status_server = ThreadingHTTPServer(("127.0.0.1", self.status_port), Handler)
+        self._status_server.daemon_threads = True
+        threading.Thread(target=self._status_server.serve_forever, daemon=True).start()
+        host, port = self._status_server.server_address[:2]
+        print(f"状態を http://{host}:{port}/ で公開しています")
+
+    @staticmethod
+    def _group_key(path: str) -> GroupKey:
+        directory, name = os.path.split(path)
+        return directory, os.path.splitext(name)[0]
+
+    @staticmethod
+    def _entry(path: str) -> Optional[FileEntry]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        name = os.path.basename(path)
+        return FileEntry(path, name, stat.st_size, stat.st_mtime_ns, stat.st_ino, os.path.splitext(name)[1].lower(),
+                         stat.st_dev)
+
+    @staticmethod
+    def _signature(path: str) -> Optional[FileSignature]:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
@@ -0,0 +1,223 @@
+import datetime
+import json
+import os
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+from file_scanner import FileScanner
+from file_utils import FileUtils
+from metrics import Metrics
+
+
+class RenameOperation(NamedTuple):
+    """1件のリネーム（変更前のパスと変更後のパス）"""
+    old_path: str
+    new_path: str
+
+
+class RenamePlanner:
+    """
+    ディレクトリごとに一度だけ列挙した名前の集合を使い、名前の衝突をメモリ上で解決して
+    リネーム計画を作成する。計画はドライランで確認でき、適用時は取り消し用のジャーナルを書き出す
+    """
+    JOURNAL_SUBDIR = "rename_journals"
+
+    @staticmethod
+    def plan_file_renames(root_dir: Optional[str] = None) -> List[RenameOperation]:
+        """ファイル名を正規化するリネーム計画を作成する"""
+        root_dir = root_dir or os.getcwd()
+        plan = []
+        for root, dirs, files in FileScanner.walk(root_dir):
+            plan.extend(RenamePlanner.plan_directory(root, files, dirs, RenamePlanner._normalized_file_names))
+        return plan
+
+    @staticmethod
+    def plan_directory_renames(root_dir: Optional[str] = None) -> List[RenameOperation]:
+        """
+        ディレクトリ名を正規化するリネーム計画を作成する
+        下層から順に並ぶため、計画の順に適用すれば各パスは適用時点でも有効なまま
+        """
+        root_dir = root_dir or os.getcwd()
+        plan = []
+        for root, dirs, files in FileScanner.walk(root_dir, topdown=False):
+            plan.extend(RenamePlanner.plan_directory(root, dirs, files, RenamePlanner._normalized_dir_names,
+                                                     is_directory=True))
+        return plan
+
+    @staticmethod
+    def plan_directory(directory: str, names: Iterable[str], other_names: Iterable[str],
+                       make_names: Callable[[List[str]], List[str]],
+                       is_directory: bool = False) -> List[RenameOperation]:
+        """
+        1つのディレクトリ内の names を make_names でまとめて変換するリネーム計画を作成する
+        other_names は変換しないが衝突判定に含める同じディレクトリ内の名前
+        """
+        names = list(names)
+        all_names = names + list(other_names)
+        fold = RenamePlanner._get_fold(directory, all_names)
+        taken = {fold(name) for name in all_names}
+        next_counters = {}
+        plan = []
+
+        for old_name, made_name in zip(names, make_names(names)):
+            new_name = RenamePlanner._resolve_name(made_name, old_name, taken, next_counters, fold, is_directory)
+            if new_name == old_name:
+                continue
+
+            taken.discard(fold(old_name))
+            taken.add(fold(new_name))
+            plan.append(RenameOperation(os.path.join(directory, old_name), os.path.join(directory, new_name)))
+
+        return plan
+
+    @staticmethod
+    def _resolve_name(name: str, source_name: str, taken: Set[str], next_counters: Dict[tuple, int],
+                      fold: Callable[[str], str], is_directory: bool) -> str:
+        """
+        ensure_unique_path と同じ規則で連番を付けるが、存在確認は名前の集合で行う
+        同じ基本名の連番は前回の続きから探すため、同名が大量にあっても線形時間で済む
+        """
+        source_key = fold(source_name)
+        key = fold(name)
+        if key not in taken or key == source_key:
+            return name
+
+        # ディレクトリの場合は拡張子がない
+        if is_directory:
+            base, ext = name, ""
+        else:
+            base, ext = os.path.splitext(name)
+
+        counter_key = (fold(base), fold(ext))
+        counter = next_counters.get(counter_key, 1)
+        while True:
+            candidate = f"{base}_{counter}{ext}"
+            candidate_key = fold(candidate)
+            counter += 1
+            if candidate_key not in taken or candidate_key == source_key:
+                next_counters[counter_key] = counter
+                return candidate
+
+    @staticmethod
+    def _get_fold(directory: str, names: List[str]) -> Callable[[str], str]:
+        """ディレクトリのファイルシステムが大文字小文字を区別しない場合は比較用に小文字化する"""
+        for name in names:
+            swapped = name.swapcase()
+            if swapped == name:
+                continue
+            # 大文字小文字を入れ替えた名前で同じファイルが見つかれば区別しないファイルシステム
+            try:
+                if os.path.samefile(os.path.join(directory, name), os.path.join(directory, swapped)):
+                    return str.lower
+            except OSError:
+                pass
+            return lambda value: value
+        return os.path.normcase
+
+    @staticmethod
+    def _normalized_file_names(old_names: List[str]) -> List[str]:
+        """ファイル名を正規化した名前を返す（拡張子は小文字化して残す）"""
+        bases, exts = zip(*map(os.path.splitext, old_names)) if old_names else ((), ())
+
+        # 名前をまとめて正規化
+        normalized_bases, _ = FileUtils.normalize_names(bases)
+
+        # 元のファイル名に半角全角英数が一つもない場合に備え、空になったら仮名を入れる
+        return [(normalized_base or "file") + ext.lower() for normalized_base, ext in zip(normalized_bases, exts)]
+
+    @staticmethod
+    def _normalized_dir_names(old_names: List[str]) -> List[str]:
+        """ディレクトリ名を正規化した名前を返す"""
+        normalized_names, _ = FileUtils.normalize_names(old_names)
+        # 空になったら仮のディレクトリ名を入れる
+        return [normalized_name or "folder" for normalized_name in normalized_names]
+
+    @staticmethod
+    def print_plan(plan: List[RenameOperation], label: str = "リネーム") -> None:
+        """リネーム計画を表示する（ドライラン用）"""
+        for operation in plan:
+            print(f"[ドライラン] {label}: {operation.old_path} -> {operation.new_path}")
+        print(f"[ドライラン] {len(plan)} 件のリネームを予定しています")
+
+    @staticmethod
+    def apply(plan: List[RenameOperation], label: str = "リネーム", journal_path: Optional[str] = None) -> int:
+        """
+        リネーム計画を順に適用し、成功した操作をジャーナルに記録する
+        計画作成後に同名のファイルが作られていた場合は上書きせずにエラーとする
+        """
+        if not plan:
+            return 0
+
+        journal_path = journal_path or RenamePlanner._new_journal_path()
+        renamed_count = 0
+
+        with open(journal_path, "w", encoding="utf-8") as journal:
+            for operation in plan:
+                try:
+                    if os.path.lexists(operation.new_path) and not RenamePlanner._is_same_entry(operation):
+                        raise FileExistsError(f"変更先が既に存在します: {operation.new_path}")
+                    with Metrics.phase("fs.rename"):
+                        os.rename(operation.old_path, operation.new_path)
+                except OSError as e:
+                    print(f"エラー: {operation.old_path} のリネームに失敗しました - {e}")
+                    continue
+
+                journal.write(json.dumps({"old": operation.old_path, "new": operation.new_path},
+                                         ensure_ascii=False) + "\n")
+                journal.flush()
+                print(f"{label}: {operation.old_path} -> {operation.new_path}")
+                renamed_count += 1
+
+        print(f"取り消し用ジャーナル: {journal_path}")
+        return renamed_count
+
+    @staticmethod
+    def undo(journal_path: Optional[str] = None) -> int:
+        """ジャーナルに記録されたリネームを逆順に取り消す（省略時は最新のジャーナル）"""
+        journal_path = journal_path or RenamePlanner.latest_journal()
+        if journal_path is None:
+            print("取り消せるジャーナルがありません")
+            return 0
+
+        with open(journal_path, encoding="utf-8") as journal:
+            operations = [json.loads(line) for line in journal if line.strip()]
+
+        restored_count = 0
+        for entry in reversed(operations):
+            operation = RenameOperation(entry["new"], entry["old"])
+            try:
+                if os.path.lexists(operation.new_path) and not RenamePlanner._is_same_entry(operation):
+                    raise FileExistsError(f"元の名前が既に使われています: {operation.new_path}")
+                os.rename(operation.old_path, operation.new_path)
+            except OSError as e:
+                print(f"エラー: {operation.old_path} を元に戻せませんでした - {e}")
+                continue
+            print(f"復元: {operation.old_path} -> {operation.new_path}")
+            restored_count += 1
+
+        os.replace(journal_path, journal_path + ".undone")
+        print(f"完了: {restored_count} 件のリネームを取り消しました")
+        return restored_count
+
+    @staticmethod
+    def latest_journal() -> Optional[str]:
+        """未取り消しのジャーナルのうち最新のものを返す"""
+        journal_dir = os.path.join(FileUtils.get_cache_dir(), RenamePlanner.JOURNAL_SUBDIR)
+        if not os.path.isdir(journal_dir):
+            return None
+        journals = sorted(name for name in os.listdir(journal_dir) if name.endswith(".jsonl"))
+        return os.path.join(journal_dir, journals[-1]) if journals else None
+
+    @staticmethod
+    def _new_journal_path() -> str:
+        """新しいジャーナルファイルのパスを返す"""
+        journal_dir = os.path.join(FileUtils.get_cache_dir(), RenamePlanner.JOURNAL_SUBDIR)
+        os.makedirs(journal_dir, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        return os.path.join(journal_dir, f"{timestamp}.jsonl")
+
+    @staticmethod
+    def _is_same_entry(operation: RenameOperation) -> bool:
+        """大文字小文字だけが異なるリネームで、変更先が変更元自身を指しているかを判定する"""
+        try:
+            return os.path.samefile(operation.old_path, operation.new_path)
+        except OSError:
+            return False
@@ -0,0 +1,89 @@
+import os
+import threading
+import time
+import pytest
+from benchmark import SlowFilesystem
+from file_scanner import FileScanner
+
+LATENCY = 0.002
+THREADS = 4
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    """深さ3・各階層3ディレクトリ、各ディレクトリにファイル2つのツリーを作る"""
+    monkeypatch.setenv("IMAGECLASSIFICATION_CACHE_DIR", str(tmp_path / "cache"))
+    root = tmp_path / "tree"
+
+    def build(directory, depth):
+        os.makedirs(directory)
+        for i in range(2):
+            (directory / f"file{i}.jpg").write_bytes(b"x" * (i + 1))
+        if depth < 3:
+            for i in range(3):
+                build(directory / f"dir{i}", depth + 1)
+
+    build(root, 0)
+    return str(root)
+
+
+def walk(root, **kwargs):
+    return [(top, list(dirs), [entry.name for entry in entries])
+            for top, dirs, entries in FileScanner.walk_entries(root, **kwargs)]
+
+
+def os_walk(root, topdown=True):
+    return [(top, dirs, files) for top, dirs, files in os.walk(root, topdown=topdown)]
+
+
+def as_set(result):
+    return {(top, frozenset(dirs), frozenset(files)) for top, dirs, files in result}
+
+
+@pytest.mark.parametrize("topdown", [True, False])
+@pytest.mark.parametrize("use_index", [False, True])
+def test_parallel_ordered_matches_os_walk(tree, topdown, use_index):
+    # 2回目の走査ではスキャンインデックスから復元したディレクトリも含めて比べる
+    walk(tree, topdown=topdown)
+    expected = os_walk(tree, topdown)
+    with SlowFilesystem(tree, LATENCY):
+        serial = walk(tree, topdown=topdown, use_index=use_index, threads=1)
+        parallel = walk(tree, topdown=topdown, use_index=use_index, threads=THREADS, ordered=True)
+    assert serial == expected
+    assert parallel == expected
+
+
+def test_parallel_unordered_yields_same_entries(tree):
+    expected = os_walk(tree)
+    with SlowFilesystem(tree, LATENCY):
+        unordered = walk(tree, use_index=False, threads=THREADS, ordered=False)
+    assert len(unordered) == len(expected)
+    assert as_set(unordered) == as_set(expected)
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_prefetch_window_is_bounded(tree, monkeypatch, ordered):
+    window = THREADS * FileScanner.PREFETCH_PER_THREAD
+    read_dir = FileScanner._read_dir
+    lock = threading.Lock()
+    listed = 0
+
+    def counting_read_dir(*args):
+        nonlocal listed
+        with lock:
+            listed += 1
+        return read_dir(*args)
+
+    monkeypatch.setattr(FileScanner, "_read_dir", staticmethod(counting_read_dir))
+
+    # 呼び出し側の処理を遅くし、列挙が先行しすぎないことを確かめる
+    yielded = 0
+    max_ahead = 0
+    with SlowFilesystem(tree, LATENCY):
+        for _ in FileScanner.walk_entries(tree, use_index=False, threads=THREADS, ordered=ordered):
+            yielded += 1
+            time.sleep(LATENCY * 5)
+            with lock:
+                max_ahead = max(max_ahead, listed - yielded)
+    assert yielded == 1 + 3 + 9 + 27
+    assert max_ahead <= window
@@ -0,0 +1,56 @@
+import random
+import sys
+from file_utils import FileUtils
+
+# 乱数で生成する名前の文字の候補（正規化で変わりやすい文字を多めに含める）
+SAMPLE_CHARS = (
+    "abcXYZ019_-. __"
+    "ＡＢＣａｂｃ０１９＿－．　"  # 全角英数・記号
+    "ｶﾞﾊﾟｱ"  # 半角カナ
+    "がぱア写真日本"  # 合成済みのかな・漢字
+    "゙゚́̈"  # 結合文字
+    "ﬁﬃ①⑩㍻℡Ⅻ²"  # 互換文字
+    "ÀéÖßİıǅ"  # ラテン文字の大文字小文字・合字
+    "\udc80\udcff\udce9"  # os.fsdecode のサロゲートエスケープ
+    "\U0001d400\U0001d7ce\U0001f600\U00020000"  # アストラル文字（数学用英数字・絵文字・CJK拡張B）
+)
+
+
+def random_name(rng: random.Random) -> str:
+    length = rng.randint(0, 24)
+    chars = []
+    for _ in range(length):
+        if rng.random() < 0.8:
+            chars.append(rng.choice(SAMPLE_CHARS))
+        else:
+            # 基本多言語面とアストラル面の任意の文字（サロゲートを含む）
+            chars.append(chr(rng.randint(0, sys.maxunicode)))
+    return "".join(chars)
+
+
+def test_normalize_names_matches_normalize_name():
+    rng = random.Random(20240517)
+    for _ in range(200):
+        names = [random_name(rng) for _ in range(rng.randint(1, 100))]
+        normalized, _ = FileUtils.normalize_names(names)
+        assert normalized == [FileUtils.normalize_name(name) for name in names]
+
+
+def test_normalize_names_collisions():
+    rng = random.Random(7)
+    # 正規化後に衝突しやすいよう、少ない文字から名前を作る
+    names = ["".join(rng.choice("aA_ Ａ.ｂb") for _ in range(rng.randint(1, 4))) for _ in range(500)]
+    _, collisions = FileUtils.normalize_names(names)
+
+    expected = {}
+    for name in names:
+        group = expected.setdefault(FileUtils.normalize_name(name), [])
+        if name not in group:
+            group.append(name)
+    assert collisions == {new_name: group for new_name, group in expected.items() if len(group) > 1}
+
+
+def test_normalize_names_edge_cases():
+    names = ["", "_", "___", "ＩＭＧ＿０００１", "IMG__0001_", "\udcff\udcfe", "\U0001d400\U0001d401", "ｶﾞ写真"]
+    normalized, _ = FileUtils.normalize_names(names)
+    assert normalized == [FileUtils.normalize_name(name) for name in names]
@@ -0,0 +1,39 @@
+from llm_client import LLMClient
+from llm_stub_server import JUDGMENT_CATEGORIES, LLMStubServer
+from photo_operations import PhotoOperations
+
+MESSAGES = [{"role": "user", "content": "test"}]
+EXIF_SUMMARY = {"DateTimeOriginal": "2019:03:15 12:00:00", "Make": "", "Model": "", "GPSInfo": "なし"}
+
+
+def vote(stub: LLMStubServer):
+    with LLMClient(base_url=stub.base_url, max_in_flight=4) as client:
+        return PhotoOperations._vote_llm_judgments(client, ["2019", "a.jpg"], "a.jpg", EXIF_SUMMARY, "")
+
+
+def test_vote_stops_at_majority():
+    with LLMStubServer() as stub:
+        judgments = vote(stub)
+    assert judgments == [JUDGMENT_CATEGORIES[0]] * PhotoOperations.LLM_MAJORITY
+    assert stub.request_count == PhotoOperations.LLM_MAJORITY
+
+
+def test_vote_sends_at_most_all_votes():
+    # どの判定も過半数に届かない場合は LLM_VOTES 回で打ち切る
+    with LLMStubServer(responses=JUDGMENT_CATEGORIES) as stub:
+        judgments = vote(stub)
+    assert len(judgments) == PhotoOperations.LLM_VOTES
+    assert stub.request_count == PhotoOperations.LLM_VOTES
+
+
+def test_in_flight_cap_and_connection_reuse():
+    with LLMStubServer(delay=0.05) as stub:
+        with LLMClient(base_url=stub.base_url, max_in_flight=2) as client:
+            futures = [client.submit(client.chat, MESSAGES) for _ in range(10)]
+            responses = [future.result() for future in futures]
+
+    assert responses == [JUDGMENT_CATEGORIES[0]] * 10
+    assert stub.request_count == 10
+    assert stub.max_active == 2
+    # リクエスト用スレッドごとにKeep-Aliveの接続を使い回す
+    assert stub.connection_count <= 2
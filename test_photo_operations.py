@@ -0,0 +1,69 @@
+import json
+import os
+from PIL import Image
+from llm_stub_server import LLMStubServer
+from photo_operations import PhotoOperations
+
+
+def make_photo(path: str, date: str, color: tuple) -> None:
+    """撮影日時付きの小さなJPEGを作る（内容が判定キャッシュのキーになるため写真ごとに色を変える）"""
+    exif = Image.Exif()
+    exif[0x8769] = {0x9003: date}
+    Image.new("RGB", (16, 16), color).save(path, exif=exif.tobytes())
+
+
+def test_resume_retries_errored_results(tmp_path, monkeypatch):
+    monkeypatch.setenv("IMAGECLASSIFICATION_CACHE_DIR", str(tmp_path / "cache"))
+    os.makedirs(tmp_path / "cache")
+    root = tmp_path / "photos"
+    os.makedirs(root)
+    errored_path = str(root / "a.jpg")
+    done_path = str(root / "b.jpg")
+    make_photo(errored_path, "2019:03:15 12:00:00", (255, 0, 0))
+    make_photo(done_path, "2019:03:16 12:00:00", (0, 255, 0))
+
+    # LLMサーバーが止まっていた間の結果（a.jpg）と、正常に判定できた結果（b.jpg）
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    with open(checkpoint, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"file_path": errored_path, "exif_date": "2019:03:15 12:00:00",
+                            "final_judgment": "判定エラー", "judgment_counts": {"判定エラー": 5},
+                            "cached": False}, ensure_ascii=False) + "\n")
+        f.write(json.dumps({"file_path": done_path, "exif_date": "2019:03:16 12:00:00",
+                            "final_judgment": "関連あり_一致", "judgment_counts": {"関連あり_一致": 3},
+                            "cached": False}, ensure_ascii=False) + "\n")
+
+    with LLMStubServer() as stub:
+        summary = PhotoOperations.analyze_photo_path_exif_correlation(
+            str(root), max_photos=2, base_url=stub.base_url, checkpoint=str(checkpoint))
+
+    # a.jpg だけを判定し直す（3票で打ち切り）
+    assert stub.request_count == PhotoOperations.LLM_MAJORITY
+    judgments = {detail["file_path"]: detail["final_judgment"] for detail in summary["details"]}
+    assert judgments == {errored_path: "関連あり_一致", done_path: "関連あり_一致"}
+    assert summary["no_correlation"] == 0
+
+    with open(checkpoint, encoding="utf-8") as f:
+        last = json.loads(f.read().splitlines()[-1])
+    assert last["file_path"] == errored_path
+    assert last["final_judgment"] == "関連あり_一致"
+
+
+def test_errored_results_are_not_checkpointed(tmp_path, monkeypatch):
+    monkeypatch.setenv("IMAGECLASSIFICATION_CACHE_DIR", str(tmp_path / "cache"))
+    os.makedirs(tmp_path / "cache")
+    root = tmp_path / "photos"
+    os.makedirs(root)
+    make_photo(str(root / "c.jpg"), "2020:01:01 00:00:00", (0, 0, 255))
+
+    # 起動せずに閉じたスタブのアドレスに送り、すべての判定を通信エラーにする
+    stub = LLMStubServer()
+    base_url = stub.base_url
+    stub.httpd.server_close()
+
+    checkpoint = tmp_path / "checkpoint.jsonl"
+    summary = PhotoOperations.analyze_photo_path_exif_correlation(
+        str(root), max_photos=1, base_url=base_url, checkpoint=str(checkpoint))
+
+    assert summary["details"][0]["final_judgment"] == "判定エラー"
+    assert checkpoint.read_text(encoding="utf-8") == ""
+    assert PhotoOperations._load_analysis_checkpoint(str(checkpoint)) == []